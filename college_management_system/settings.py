@@ -48,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Only active when REQUEST_INSTRUMENTATION is True
+    'main_app.middleware.RequestInstrumentationMiddleware',
+
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +63,7 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
 
     # My Middleware
+    'main_app.middleware.SessionRefreshMiddleware',
     'main_app.middleware.LoginCheckMiddleWare',
 ]
 
@@ -76,6 +80,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'main_app.context_processors.notifications',
             ],
         },
     },
@@ -147,6 +152,8 @@ MEDIA_URL = '/media/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Generated files only views check access to, such as report card zips; never served directly
+PRIVATE_ROOT = os.path.join(BASE_DIR, 'private')
 AUTH_USER_MODEL = 'main_app.CustomUser'
 AUTHENTICATION_BACKENDS = ['main_app.EmailBackend.EmailBackend']
 TIME_ZONE = 'Asia/Kolkata'
@@ -154,7 +161,45 @@ TIME_ZONE = 'Asia/Kolkata'
 # Session Configuration for Remember Me functionality
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds (default)
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True  # This will be overridden by remember me
-SESSION_SAVE_EVERY_REQUEST = True  # Save session on every request to extend expiry
+SESSION_SAVE_EVERY_REQUEST = False  # SessionRefreshMiddleware extends the expiry instead
+SESSION_REFRESH_INTERVAL = 24 * 60 * 60  # Re-save a session to slide its expiry at most once a day
+
+# Seconds to cache each user's Staff/Student profile across requests (0 = per request only).
+# Profile saves clear it; only enable with a cache shared by all workers.
+PROFILE_CACHE_TIMEOUT = 0
+
+# Login captcha. main_app.captcha.StubCaptchaVerifier accepts any token, for tests
+CAPTCHA_BACKEND = 'main_app.captcha.RecaptchaVerifier'
+CAPTCHA_SECRET_KEY = os.environ.get('CAPTCHA_SECRET_KEY', '')  # Required by RecaptchaVerifier
+CAPTCHA_TIMEOUT = (2, 3)  # Connect and read timeouts, in seconds
+CAPTCHA_POOL_SIZE = 20  # Keep-alive connections to the verify endpoint, per worker
+
+# Seconds a user's unread notification count stays cached; it is adjusted in place as
+# notifications are sent and read, so per-process caches can lag in other workers
+NOTIFICATION_COUNT_CACHE_TIMEOUT = 60 * 60
+NOTIFICATION_RETENTION_DAYS = 365  # archive_notifications moves older ones out of the inboxes
+
+# Push notifications are queued by the views and sent by the send_push_notifications worker
+FCM_SERVER_KEY = os.environ.get('FCM_SERVER_KEY', '')  # The worker refuses to start without one
+FCM_URL = os.environ.get('FCM_URL', 'https://fcm.googleapis.com/fcm/send')
+FCM_TIMEOUT = (3, 10)  # Connect and read timeouts, in seconds
+PUSH_RETRY_DELAY = 30  # Seconds before the first retry; doubles on each further attempt
+PUSH_MAX_ATTEMPTS = 5
+
+# Bulk student import: password hashing processes (default: one per CPU) and web upload size.
+# Uploads are hashed inside the request (about 0.1s of CPU per row), so bigger sheets go
+# through the import_students command
+STUDENT_IMPORT_WORKERS = None
+STUDENT_IMPORT_MAX_UPLOAD_ROWS = 100
+
+LIBRARY_FINE_PER_DAY = 5  # Charged for each day a book is kept past its expiry date
+
+RESULT_PASS_MARK = 40  # Out of a 100 point total (test 40 + exam 60)
+REPORT_CARD_WORKERS = None  # Rendering processes of generate_report_cards (default: one per CPU)
+
+# Per-request Server-Timing header and repeated query logging
+REQUEST_INSTRUMENTATION = os.environ.get('REQUEST_INSTRUMENTATION') == '1'
+REQUEST_INSTRUMENTATION_REPEAT_THRESHOLD = 10  # Same query this many times in one request is logged
 
 # EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_mails")
@@ -3,13 +3,14 @@ from django.views import View
 from django.contrib import messages
 from .models import Subject, Staff, Student, StudentResult
 from .forms import EditResultForm
+from .middleware import get_profile_or_404
 from django.urls import reverse
 
 
 class EditResultView(View):
     def get(self, request, *args, **kwargs):
         resultForm = EditResultForm()
-        staff = get_object_or_404(Staff, admin=request.user)
+        staff = get_profile_or_404(request, Staff)
         resultForm.fields['subject'].queryset = Subject.objects.filter(staff=staff)
         context = {
             'form': resultForm,
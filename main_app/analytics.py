@@ -0,0 +1,79 @@
+import numpy as np
+from django.conf import settings
+
+from .models import Student, Subject
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Totals are out of 100 (test 40 + exam 60); the last bucket includes 100
+BUCKETS = np.arange(0, 101, 10)
+
+
+def load_scores(results):
+    """(student ids, subject ids, totals) of a StudentResult queryset as arrays, from one query"""
+    rows = np.array(list(results.order_by().values_list('student_id', 'subject_id', 'test', 'exam')),
+                    dtype=np.float64).reshape(-1, 4)
+    return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2] + rows[:, 3]
+
+
+def competition_ranks(scores):
+    """Rank of each score with the highest first and ties sharing a rank: 1, 2, 2, 4"""
+    return scores.size - np.searchsorted(np.sort(scores), scores, side='right') + 1
+
+
+def summarize(totals, pass_mark):
+    """Distribution of an array of totals as JSON-ready numbers"""
+    counts, edges = np.histogram(totals, bins=BUCKETS)
+    summary = {
+        'count': int(totals.size),
+        'histogram': [{'from': int(low), 'to': int(high), 'count': int(count)}
+                      for low, high, count in zip(edges, edges[1:], counts)],
+    }
+    if not totals.size:
+        return dict(summary, mean=None, median=None, std=None, min=None, max=None, pass_rate=None,
+                    percentiles={str(p): None for p in PERCENTILES})
+    return dict(
+        summary,
+        mean=round(float(totals.mean()), 2),
+        median=round(float(np.median(totals)), 2),
+        std=round(float(totals.std()), 2),
+        min=float(totals.min()),
+        max=float(totals.max()),
+        pass_rate=round(float(np.count_nonzero(totals >= pass_mark) / totals.size), 4),
+        percentiles={str(p): round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(totals, PERCENTILES))},
+    )
+
+
+def analyse(results, pass_mark=None):
+    """Overall and per-subject distributions of a StudentResult queryset, and
+    every student ranked by their mean total over the subjects in it"""
+    if pass_mark is None:
+        pass_mark = getattr(settings, 'RESULT_PASS_MARK', 40)
+    students, subjects, totals = load_scores(results)
+
+    order = np.argsort(subjects, kind='stable')
+    subject_ids, starts = np.unique(subjects[order], return_index=True)
+    subject_names = dict(Subject.objects.filter(id__in=results.values('subject_id')).values_list('id', 'name'))
+    per_subject = [
+        dict(summarize(group, pass_mark), id=int(subject_id), name=subject_names.get(subject_id, ''))
+        for subject_id, group in zip(subject_ids, np.split(totals[order], starts[1:]))
+    ]
+
+    student_ids, inverse = np.unique(students, return_inverse=True)
+    means = np.bincount(inverse, weights=totals) / np.bincount(inverse)
+    ranks = competition_ranks(means)
+    names = {
+        student_id: last_name + " " + first_name
+        for student_id, last_name, first_name in Student.objects.filter(
+            id__in=results.values('student_id')).values_list('id', 'admin__last_name', 'admin__first_name')
+    }
+    by_rank = np.lexsort((student_ids, ranks))
+    return {
+        'pass_mark': pass_mark,
+        'summary': summarize(totals, pass_mark),
+        'subjects': per_subject,
+        'students': [
+            {'id': int(student_ids[i]), 'name': names.get(student_ids[i], ''), 'score': round(float(means[i]), 2),
+             'rank': int(ranks[i])}
+            for i in by_rank
+        ],
+    }
@@ -0,0 +1,93 @@
+import csv
+from itertools import groupby, islice
+
+from .models import Attendance, AttendanceReport, Student
+
+# Reports held in memory at once by long_rows(), whatever the size of the export
+ROWS_PER_QUERY = 20000
+
+
+class Echo:
+    """File-like object for csv.writer that hands back each line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def _registers(course, session, start=None, end=None):
+    registers = Attendance.objects.filter(subject__course=course, session=session)
+    if start:
+        registers = registers.filter(date__gte=start)
+    if end:
+        registers = registers.filter(date__lte=end)
+    return registers
+
+
+def _student_names(course, session):
+    return {
+        student_id: (last_name + " " + first_name, email)
+        for student_id, last_name, first_name, email in Student.objects.filter(
+            course=course, session=session).values_list('id', 'admin__last_name', 'admin__first_name', 'admin__email')
+    }
+
+
+def long_rows(course, session, start=None, end=None):
+    """Header, then one row per student per register in date order"""
+    registers = _registers(course, session, start, end).order_by('date', 'subject__name', 'id').values_list(
+        'id', 'date', 'subject__name')
+    students = _student_names(course, session)
+    # A register holds at most one report per student of the cohort
+    registers_per_query = max(ROWS_PER_QUERY // max(len(students), 1), 1)
+    registers = registers.iterator(chunk_size=registers_per_query)
+    yield ('date', 'subject', 'student_id', 'student', 'email', 'status')
+    while True:
+        chunk = list(islice(registers, registers_per_query))
+        if not chunk:
+            return
+        # Walks the (attendance, student) unique index, so no sort is needed
+        reports = AttendanceReport.objects.filter(attendance_id__in=[register[0] for register in chunk]).order_by(
+            'attendance_id', 'student_id').values_list('attendance_id', 'student_id', 'status')
+        by_register = {
+            attendance_id: list(rows)
+            for attendance_id, rows in groupby(reports.iterator(chunk_size=2000), key=lambda row: row[0])
+        }
+        for attendance_id, date, subject in chunk:
+            for _, student_id, status in by_register.get(attendance_id, ()):
+                name, email = students.get(student_id, ("", ""))
+                yield (date.isoformat(), subject, student_id, name, email, "Present" if status else "Absent")
+
+
+def matrix_rows(course, session, start=None, end=None):
+    """Header with one column per register date, then one row per subject
+    and student with P, A or blank (no class that day) in each column"""
+    registers = list(_registers(course, session, start, end).order_by('subject__name', 'subject_id', 'date').values_list(
+        'id', 'subject_id', 'subject__name', 'date'))
+    dates = sorted({register[3] for register in registers})
+    column = {date: n for n, date in enumerate(dates)}
+    students = _student_names(course, session)
+    yield ('subject', 'student_id', 'student', 'email') + tuple(date.isoformat() for date in dates) + (
+        'present', 'absent')
+    for (subject_id, subject), subject_registers in groupby(registers, key=lambda register: register[1:3]):
+        date_of = {register[0]: register[3] for register in subject_registers}
+        reports = AttendanceReport.objects.filter(attendance_id__in=list(date_of)).order_by(
+            'student_id', 'attendance_id').values_list('student_id', 'attendance_id', 'status')
+        for student_id, rows in groupby(reports.iterator(chunk_size=2000), key=lambda row: row[0]):
+            cells = [""] * len(dates)
+            present = absent = 0
+            for _, attendance_id, status in rows:
+                cells[column[date_of[attendance_id]]] = "P" if status else "A"
+                present += status
+                absent += not status
+            name, email = students.get(student_id, ("", ""))
+            yield (subject, student_id, name, email, *cells, present, absent)
+
+
+def csv_chunks(rows, lines=500):
+    """CSV text of rows, a few hundred lines per chunk for StreamingHttpResponse"""
+    writer = csv.writer(Echo())
+    rows = iter(rows)
+    while True:
+        chunk = "".join(writer.writerow(row) for row in islice(rows, lines))
+        if not chunk:
+            return
+        yield chunk
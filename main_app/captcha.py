@@ -0,0 +1,63 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+
+class CaptchaUnavailable(Exception):
+    """The captcha service could not be reached or gave an unusable answer"""
+
+
+class BaseCaptchaVerifier(ABC):
+    @abstractmethod
+    def verify(self, token, remote_ip=None):
+        """Return True when the token proves a human solved the captcha"""
+
+
+class RecaptchaVerifier(BaseCaptchaVerifier):
+    """Google reCAPTCHA siteverify over one pooled, keep-alive HTTP session.
+
+    Every token goes to Google, which accepts each one once, so a captured
+    token cannot be replayed for further login attempts.
+    """
+
+    def __init__(self):
+        self.url = getattr(settings, 'CAPTCHA_VERIFY_URL', "https://www.google.com/recaptcha/api/siteverify")
+        self.secret = getattr(settings, 'CAPTCHA_SECRET_KEY', '')
+        if not self.secret:
+            raise ImproperlyConfigured("Set CAPTCHA_SECRET_KEY, or use StubCaptchaVerifier as CAPTCHA_BACKEND")
+        self.timeout = getattr(settings, 'CAPTCHA_TIMEOUT', (2, 3))
+        pool_size = getattr(settings, 'CAPTCHA_POOL_SIZE', 20)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def verify(self, token, remote_ip=None):
+        if not token:
+            return False
+        data = {'secret': self.secret, 'response': token}
+        if remote_ip:
+            data['remoteip'] = remote_ip
+        try:
+            response = self.session.post(self.url, data=data, timeout=self.timeout)
+            response.raise_for_status()
+            return bool(response.json().get('success'))
+        except (requests.RequestException, ValueError) as e:
+            raise CaptchaUnavailable(str(e)) from e
+
+
+class StubCaptchaVerifier(BaseCaptchaVerifier):
+    """Offline verifier for tests and load tests: any token but "fail" passes"""
+
+    def verify(self, token, remote_ip=None):
+        return bool(token) and token != 'fail'
+
+
+@lru_cache(maxsize=None)
+def get_captcha_verifier():
+    """The CAPTCHA_BACKEND instance shared by every request of this process"""
+    return import_string(getattr(settings, 'CAPTCHA_BACKEND', 'main_app.captcha.RecaptchaVerifier'))()
@@ -0,0 +1,9 @@
+from functools import partial
+
+from .models import unread_notification_count
+
+
+def notifications(request):
+    """Unread count for the sidebar badge; only looked up (in the cache) when
+    a template renders it"""
+    return {'unread_notification_count': partial(unread_notification_count, request.user)}
@@ -205,3 +205,35 @@ class IssueBookForm(forms.Form):
     
     isbn2.widget.attrs.update({'class': 'form-control'})
     name2.widget.attrs.update({'class':'form-control'})
+
+
+class StudentImportForm(forms.Form):
+    file = forms.FileField(label="Student sheet (.csv or .xlsx)")
+    file.widget.attrs.update({'class': 'form-control', 'accept': '.csv,.xlsx'})
+
+
+class AttendanceExportForm(forms.Form):
+    LAYOUTS = (
+        ('long', "One row per student per class"),
+        ('matrix', "One row per subject and student, one column per date"),
+    )
+    course = forms.ModelChoiceField(queryset=models.Course.objects.all())
+    session = forms.ModelChoiceField(queryset=models.Session.objects.all())
+    start = forms.DateField(required=False, widget=DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=DateInput(attrs={'type': 'date'}))
+    layout = forms.ChoiceField(choices=LAYOUTS, initial='long', required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.visible_fields():
+            field.field.widget.attrs['class'] = 'form-control'
+
+    def clean_layout(self):
+        return self.cleaned_data['layout'] or 'long'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError("The start date must not be after the end date")
+        return cleaned_data
@@ -1,71 +1,75 @@
 import json
-import requests
+from django.conf import settings
 from django.contrib import messages
 from django.core.files.storage import FileSystemStorage
-from django.http import HttpResponse, JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import (HttpResponse, HttpResponseRedirect,
                               get_object_or_404, redirect, render)
-from django.templatetags.static import static
 from django.urls import reverse
+from django.utils.text import slugify
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import UpdateView
 
+from . import analytics, attendance_export, student_import
 from .forms import *
+from .middleware import get_profile_or_404
+from .pagination import keyset_page
 from .models import *
 
 
 def admin_home(request):
     total_staff = Staff.objects.all().count()
     total_students = Student.objects.all().count()
-    subjects = Subject.objects.all()
-    total_subject = subjects.count()
     total_course = Course.objects.all().count()
-    attendance_list = Attendance.objects.filter(subject__in=subjects)
-    total_attendance = attendance_list.count()
-    attendance_list = []
+
+    # Grouped counts, keyed by course / student id, so the page costs a
+    # fixed number of queries however many students are enrolled
+    students_per_course = dict(Student.objects.values_list(
+        'course_id').annotate(total=Count('id')).order_by())
+    subjects_per_course = dict(Subject.objects.values_list(
+        'course_id').annotate(total=Count('id')).order_by())
+
+    # Attendance taken and students enrolled per subject
+    subjects = Subject.objects.annotate(
+        attendance_count=Count('attendance')).values_list('name', 'course_id', 'attendance_count')
+    total_subject = len(subjects)
     subject_list = []
-    for subject in subjects:
-        attendance_count = Attendance.objects.filter(subject=subject).count()
-        subject_list.append(subject.name[:7])
+    attendance_list = []
+    student_count_list_in_subject = []
+    for name, course_id, attendance_count in subjects:
+        subject_list.append(name)
         attendance_list.append(attendance_count)
+        student_count_list_in_subject.append(
+            students_per_course.get(course_id, 0))
 
     # Total Subjects and students in Each Course
-    course_all = Course.objects.all()
     course_name_list = []
     subject_count_list = []
     student_count_list_in_course = []
-
-    for course in course_all:
-        subjects = Subject.objects.filter(course_id=course.id).count()
-        students = Student.objects.filter(course_id=course.id).count()
-        course_name_list.append(course.name)
-        subject_count_list.append(subjects)
-        student_count_list_in_course.append(students)
-    
-    subject_all = Subject.objects.all()
-    subject_list = []
-    student_count_list_in_subject = []
-    for subject in subject_all:
-        course = Course.objects.get(id=subject.course.id)
-        student_count = Student.objects.filter(course_id=course.id).count()
-        subject_list.append(subject.name)
-        student_count_list_in_subject.append(student_count)
-
+    for course_id, name in Course.objects.values_list('id', 'name'):
+        course_name_list.append(name)
+        subject_count_list.append(subjects_per_course.get(course_id, 0))
+        student_count_list_in_course.append(
+            students_per_course.get(course_id, 0))
 
     # For Students
-    student_attendance_present_list=[]
-    student_attendance_leave_list=[]
-    student_name_list=[]
-
-    students = Student.objects.all()
-    for student in students:
-        
-        attendance = AttendanceReport.objects.filter(student_id=student.id, status=True).count()
-        absent = AttendanceReport.objects.filter(student_id=student.id, status=False).count()
-        leave = LeaveReportStudent.objects.filter(student_id=student.id, status=1).count()
-        student_attendance_present_list.append(attendance)
-        student_attendance_leave_list.append(leave+absent)
-        student_name_list.append(student.admin.first_name)
+    attendance_per_student = {
+        row['student_id']: row for row in AttendanceSummary.objects.values('student_id').annotate(
+            present=Sum('present'), absent=Sum('absent')).order_by()
+    }
+    leave_per_student = dict(LeaveReportStudent.objects.filter(status=1).values_list(
+        'student_id').annotate(total=Count('id')).order_by())
+    student_attendance_present_list = []
+    student_attendance_leave_list = []
+    student_name_list = []
+    for student_id, first_name in Student.objects.values_list('id', 'admin__first_name'):
+        attendance = attendance_per_student.get(student_id, {})
+        student_attendance_present_list.append(attendance.get('present', 0))
+        student_attendance_leave_list.append(
+            leave_per_student.get(student_id, 0) + attendance.get('absent', 0))
+        student_name_list.append(first_name)
 
     context = {
         'page_title': "Administrative Dashboard",
@@ -154,6 +158,38 @@ def add_student(request):
     return render(request, 'hod_template/add_student_template.html', context)
 
 
+def import_students(request):
+    form = StudentImportForm(request.POST or None, request.FILES or None)
+    context = {'form': form, 'columns': student_import.COLUMNS, 'page_title': 'Import Students'}
+    if request.method == 'POST' and form.is_valid():
+        upload = form.cleaned_data['file']
+        try:
+            rows = student_import.read_rows(upload, upload.name)
+        except student_import.ImportFileError as e:
+            messages.error(request, str(e))
+            return render(request, 'hod_template/import_students.html', context)
+        limit = getattr(settings, 'STUDENT_IMPORT_MAX_UPLOAD_ROWS', 100)
+        if len(rows) > limit:
+            messages.error(request, "Uploads are limited to %d rows; use the import_students command for "
+                                    "larger sheets" % limit)
+            return render(request, 'hod_template/import_students.html', context)
+        valid, errors = student_import.validate_rows(rows)
+        if not errors:
+            try:
+                created = student_import.create_students(valid)
+            except IntegrityError:
+                # An email was registered after the rows were validated; report it like any bad row
+                valid, errors = student_import.validate_rows(rows)
+                if not errors:
+                    raise
+            else:
+                messages.success(request, "Imported %d students" % created)
+                return redirect(reverse('import_students'))
+        context['errors'] = errors
+        messages.error(request, "Nothing was imported: %d of %d rows have errors" % (len(errors), len(rows)))
+    return render(request, 'hod_template/import_students.html', context)
+
+
 def add_course(request):
     form = CourseForm(request.POST or None)
     context = {
@@ -205,23 +241,99 @@ def add_subject(request):
 
 
 def manage_staff(request):
-    allStaff = CustomUser.objects.filter(user_type=2)
     context = {
-        'allStaff': allStaff,
+        'courses': Course.objects.all(),
         'page_title': 'Manage Staff'
     }
     return render(request, "hod_template/manage_staff.html", context)
 
 
 def manage_student(request):
-    students = CustomUser.objects.filter(user_type=3)
     context = {
-        'students': students,
+        'courses': Course.objects.all(),
+        'sessions': Session.objects.all(),
         'page_title': 'Manage Students'
     }
     return render(request, "hod_template/manage_student.html", context)
 
 
+# Sort keys of the manage_staff/manage_student tables; each ends in a unique column
+PEOPLE_ORDERINGS = {
+    'name': ('admin__last_name', 'admin__first_name', 'admin_id'),
+    'email': ('admin__email', 'admin_id'),
+}
+
+
+def _people_table(request, people, row, filters):
+    """JSON page of a manage_* table: search, filter, sort and keyset pagination"""
+    search = request.GET.get('search', '').strip()
+    if search:
+        people = people.filter(Q(admin__last_name__istartswith=search) | Q(admin__first_name__istartswith=search) |
+                               Q(admin__email__istartswith=search))
+    try:
+        for field in filters:
+            if request.GET.get(field):
+                people = people.filter(**{field + '_id': int(request.GET[field])})
+        limit = min(max(int(request.GET.get('length', 50)), 1), 200)
+        ordering = PEOPLE_ORDERINGS.get(request.GET.get('sort'), PEOPLE_ORDERINGS['name'])
+        if request.GET.get('order') == 'desc':
+            ordering = ['-' + field for field in ordering]
+        cursor = request.GET.get('after')
+        page, next_cursor = keyset_page(people, ordering, cursor, limit)
+    except ValueError:
+        return JsonResponse({'error': "Invalid filter or page"}, status=400)
+    data = {'results': [row(person) for person in page], 'next': next_cursor}
+    if not cursor:
+        data['total'] = people.count()
+    return JsonResponse(data)
+
+
+def _person_row(person):
+    user = person.admin
+    return {
+        'id': person.id,
+        'name': "%s, %s" % (user.last_name, user.first_name),
+        'email': user.email,
+        'gender': user.gender,
+        'course': person.course.name if person.course else None,
+        'profile_pic': user.profile_pic.name,
+    }
+
+
+def staff_table(request):
+    def row(staff):
+        return dict(_person_row(staff), edit_url=reverse('edit_staff', args=[staff.id]),
+                    delete_url=reverse('delete_staff', args=[staff.id]))
+    return _people_table(request, Staff.objects.select_related('admin', 'course'), row, ('course',))
+
+
+def student_table(request):
+    def row(student):
+        return dict(_person_row(student), session=str(student.session) if student.session else None,
+                    edit_url=reverse('edit_student', args=[student.id]),
+                    delete_url=reverse('delete_student', args=[student.id]))
+    return _people_table(request, Student.objects.select_related('admin', 'course', 'session'), row,
+                         ('course', 'session'))
+
+
+LIST_PAGE_SIZE = 50
+# Unanswered leave requests and feedback first, newest first within each group
+PENDING_FIRST = ('answered', '-created_at', '-id')
+
+
+def _pending_first(queryset, pending):
+    return queryset.annotate(answered=Case(When(pending, then=Value(0)), default=Value(1),
+                                           output_field=IntegerField()))
+
+
+def _list_page(request, queryset, ordering):
+    """The page of a list view following its ?after= cursor; a bad cursor shows the first page"""
+    try:
+        return keyset_page(queryset, ordering, request.GET.get('after'), LIST_PAGE_SIZE)
+    except ValueError:
+        return keyset_page(queryset, ordering, None, LIST_PAGE_SIZE)
+
+
 def manage_course(request):
     courses = Course.objects.all()
     context = {
@@ -232,9 +344,11 @@ def manage_course(request):
 
 
 def manage_subject(request):
-    subjects = Subject.objects.all()
+    subjects, next_cursor = _list_page(request, Subject.objects.select_related('staff__admin', 'course').only(
+        'name', 'staff__admin__first_name', 'staff__admin__last_name', 'course__name'), ('name', 'id'))
     context = {
         'subjects': subjects,
+        'next_cursor': next_cursor,
         'page_title': 'Manage Subjects'
     }
     return render(request, "hod_template/manage_subject.html", context)
@@ -450,9 +564,14 @@ def check_email_availability(request):
 @csrf_exempt
 def student_feedback_message(request):
     if request.method != 'POST':
-        feedbacks = FeedbackStudent.objects.all()
+        feedbacks, next_cursor = _list_page(request, _pending_first(
+            FeedbackStudent.objects.select_related('student__admin', 'student__session').only(
+                'feedback', 'reply', 'created_at', 'updated_at', 'student__admin__first_name',
+                'student__admin__last_name', 'student__session__start_year', 'student__session__end_year'),
+            Q(reply='')), PENDING_FIRST)
         context = {
             'feedbacks': feedbacks,
+            'next_cursor': next_cursor,
             'page_title': 'Student Feedback Messages'
         }
         return render(request, 'hod_template/student_feedback_template.html', context)
@@ -471,9 +590,14 @@ def student_feedback_message(request):
 @csrf_exempt
 def staff_feedback_message(request):
     if request.method != 'POST':
-        feedbacks = FeedbackStaff.objects.all()
+        feedbacks, next_cursor = _list_page(request, _pending_first(
+            FeedbackStaff.objects.select_related('staff__admin', 'staff__course').only(
+                'feedback', 'reply', 'created_at', 'updated_at', 'staff__admin__first_name',
+                'staff__admin__last_name', 'staff__course__name'),
+            Q(reply='')), PENDING_FIRST)
         context = {
             'feedbacks': feedbacks,
+            'next_cursor': next_cursor,
             'page_title': 'Staff Feedback Messages'
         }
         return render(request, 'hod_template/staff_feedback_template.html', context)
@@ -492,9 +616,14 @@ def staff_feedback_message(request):
 @csrf_exempt
 def view_staff_leave(request):
     if request.method != 'POST':
-        allLeave = LeaveReportStaff.objects.all()
+        allLeave, next_cursor = _list_page(request, _pending_first(
+            LeaveReportStaff.objects.select_related('staff__admin', 'staff__course').only(
+                'date', 'message', 'status', 'created_at', 'updated_at', 'staff__admin__first_name',
+                'staff__admin__last_name', 'staff__course__name'),
+            Q(status=0)), PENDING_FIRST)
         context = {
             'allLeave': allLeave,
+            'next_cursor': next_cursor,
             'page_title': 'Leave Applications From Staff'
         }
         return render(request, "hod_template/staff_leave_view.html", context)
@@ -517,9 +646,14 @@ def view_staff_leave(request):
 @csrf_exempt
 def view_student_leave(request):
     if request.method != 'POST':
-        allLeave = LeaveReportStudent.objects.all()
+        allLeave, next_cursor = _list_page(request, _pending_first(
+            LeaveReportStudent.objects.select_related('student__admin', 'student__course').only(
+                'date', 'message', 'status', 'created_at', 'updated_at', 'student__admin__first_name',
+                'student__admin__last_name', 'student__course__name'),
+            Q(status=0)), PENDING_FIRST)
         context = {
             'allLeave': allLeave,
+            'next_cursor': next_cursor,
             'page_title': 'Leave Applications From Students'
         }
         return render(request, "hod_template/student_leave_view.html", context)
@@ -545,12 +679,27 @@ def admin_view_attendance(request):
     context = {
         'subjects': subjects,
         'sessions': sessions,
+        'export_form': AttendanceExportForm(initial={'layout': 'long'}),
         'page_title': 'View Attendance'
     }
 
     return render(request, "hod_template/admin_view_attendance.html", context)
 
 
+def export_attendance(request):
+    """Stream a course and session's attendance as CSV, long or matrix layout"""
+    form = AttendanceExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    data = form.cleaned_data
+    layout = attendance_export.matrix_rows if data['layout'] == 'matrix' else attendance_export.long_rows
+    rows = layout(data['course'], data['session'], data['start'], data['end'])
+    response = StreamingHttpResponse(attendance_export.csv_chunks(rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="attendance-%s-%d-%d-%s.csv"' % (
+        slugify(data['course'].name), data['session'].start_year.year, data['session'].end_year.year, data['layout'])
+    return response
+
+
 @csrf_exempt
 def get_admin_attendance(request):
     subject_id = request.POST.get('subject')
@@ -575,8 +724,81 @@ def get_admin_attendance(request):
         return None
 
 
+def result_analytics(request):
+    context = {
+        'courses': Course.objects.all(),
+        'subjects': Subject.objects.all(),
+        'page_title': 'Result Analytics'
+    }
+    return render(request, "hod_template/result_analytics.html", context)
+
+
+def result_analytics_data(request):
+    """Score distribution and ranks of one subject (?subject=) or a whole course (?course=)"""
+    try:
+        subject_id = int(request.GET['subject']) if request.GET.get('subject') else None
+        course_id = int(request.GET['course']) if request.GET.get('course') else None
+    except ValueError:
+        subject_id = course_id = None
+    if (subject_id is None) == (course_id is None):
+        return JsonResponse({'error': "Choose a subject or a course"}, status=400)
+    if subject_id is not None:
+        results = StudentResult.objects.filter(subject_id=subject_id)
+    else:
+        results = StudentResult.objects.filter(subject__course_id=course_id)
+    return JsonResponse(analytics.analyse(results))
+
+
+def report_cards(request):
+    if request.method == 'POST':
+        try:
+            course = Course.objects.get(id=request.POST.get('course'))
+            session = Session.objects.get(id=request.POST.get('session'))
+        except (ValueError, Course.DoesNotExist, Session.DoesNotExist):
+            messages.error(request, "Select a course and a session")
+        else:
+            ReportCardBatch.objects.create(course=course, session=session, requested_by=request.user)
+            messages.success(request, "Report cards queued; the zip appears below when ready")
+        return redirect(reverse('report_cards'))
+    context = {
+        'courses': Course.objects.all(),
+        'sessions': Session.objects.all(),
+        'page_title': 'Report Cards'
+    }
+    return render(request, "hod_template/report_cards.html", context)
+
+
+def report_card_batches(request):
+    """Progress of the latest report card batches, polled by the report cards page"""
+    batches = ReportCardBatch.objects.select_related('course', 'session').order_by('-created_at', '-id')[:20]
+    return JsonResponse({'batches': [{
+        'id': batch.id,
+        'course': batch.course.name,
+        'session': str(batch.session),
+        'status': batch.get_status_display(),
+        'rendered': batch.rendered,
+        'total': batch.total,
+        'error': batch.error,
+        'url': reverse('download_report_cards', args=[batch.id]) if batch.file else None,
+        'created_at': batch.created_at,
+    } for batch in batches]})
+
+
+def download_report_cards(request, batch_id):
+    """Stream a finished batch's zip, which is kept out of the public media files"""
+    batch = get_object_or_404(ReportCardBatch.objects.select_related('course', 'session'), id=batch_id)
+    if not batch.file:
+        raise Http404("Report cards are not ready")
+    try:
+        zipped = batch.file.open('rb')
+    except FileNotFoundError:
+        raise Http404("Report cards are missing")
+    return FileResponse(zipped, as_attachment=True, filename="report-cards-%s-%d-%d.zip" % (
+        slugify(batch.course.name), batch.session.start_year.year, batch.session.end_year.year))
+
+
 def admin_view_profile(request):
-    admin = get_object_or_404(Admin, admin=request.user)
+    admin = get_profile_or_404(request, Admin)
     form = AdminForm(request.POST or None, request.FILES or None,
                      instance=admin)
     context = {'form': form,
@@ -614,7 +836,9 @@ def admin_notify_staff(request):
     staff = CustomUser.objects.filter(user_type=2)
     context = {
         'page_title': "Send Notifications To Staff",
-        'allStaff': staff
+        'allStaff': staff,
+        'courses': Course.objects.all(),
+        'subjects': Subject.objects.all(),
     }
     return render(request, "hod_template/staff_notification.html", context)
 
@@ -623,7 +847,10 @@ def admin_notify_student(request):
     student = CustomUser.objects.filter(user_type=3)
     context = {
         'page_title': "Send Notifications To Students",
-        'students': student
+        'students': student,
+        'courses': Course.objects.all(),
+        'sessions': Session.objects.all(),
+        'subjects': Subject.objects.all(),
     }
     return render(request, "hod_template/student_notification.html", context)
 
@@ -634,22 +861,9 @@ def send_student_notification(request):
     message = request.POST.get('message')
     student = get_object_or_404(Student, admin_id=id)
     try:
-        url = "https://fcm.googleapis.com/fcm/send"
-        body = {
-            'notification': {
-                'title': "Student Management System",
-                'body': message,
-                'click_action': reverse('student_view_notification'),
-                'icon': static('dist/img/AdminLTELogo.png')
-            },
-            'to': student.admin.fcm_token
-        }
-        headers = {'Authorization':
-                   'key=AAAA3Bm8j_M:APA91bElZlOLetwV696SoEtgzpJr2qbxBfxVBfDWFiopBWzfCfzQp2nRyC7_A2mlukZEHV4g1AmyC6P_HonvSkY2YyliKt5tT3fe_1lrKod2Daigzhb2xnYQMxUWjCAIQcUexAMPZePB',
-                   'Content-Type': 'application/json'}
-        data = requests.post(url, data=json.dumps(body), headers=headers)
         notification = NotificationStudent(student=student, message=message)
         notification.save()
+        PushNotification.objects.enqueue([student.admin_id], message, reverse('student_view_notification'))
         return HttpResponse("True")
     except Exception as e:
         return HttpResponse("False")
@@ -661,27 +875,68 @@ def send_staff_notification(request):
     message = request.POST.get('message')
     staff = get_object_or_404(Staff, admin_id=id)
     try:
-        url = "https://fcm.googleapis.com/fcm/send"
-        body = {
-            'notification': {
-                'title': "Student Management System",
-                'body': message,
-                'click_action': reverse('staff_view_notification'),
-                'icon': static('dist/img/AdminLTELogo.png')
-            },
-            'to': staff.admin.fcm_token
-        }
-        headers = {'Authorization':
-                   'key=AAAA3Bm8j_M:APA91bElZlOLetwV696SoEtgzpJr2qbxBfxVBfDWFiopBWzfCfzQp2nRyC7_A2mlukZEHV4g1AmyC6P_HonvSkY2YyliKt5tT3fe_1lrKod2Daigzhb2xnYQMxUWjCAIQcUexAMPZePB',
-                   'Content-Type': 'application/json'}
-        data = requests.post(url, data=json.dumps(body), headers=headers)
         notification = NotificationStaff(staff=staff, message=message)
         notification.save()
+        PushNotification.objects.enqueue([staff.admin_id], message, reverse('staff_view_notification'))
         return HttpResponse("True")
     except Exception as e:
         return HttpResponse("False")
 
 
+def _broadcast_recipients(audience, course_id=None, session_id=None, subject_id=None):
+    """Profiles addressed by a broadcast; every given filter must match"""
+    if audience == 'student':
+        recipients = Student.objects.all()
+        if session_id:
+            recipients = recipients.filter(session_id=session_id)
+        if subject_id:
+            # A subject's roster is every student enrolled in its course
+            recipients = recipients.filter(course__subject__id=subject_id)
+    elif audience == 'staff':
+        if session_id:
+            raise ValueError("Staff are not enrolled in sessions")
+        recipients = Staff.objects.all()
+        if subject_id:
+            recipients = recipients.filter(subject__id=subject_id)
+    else:
+        raise ValueError("Unknown audience")
+    if course_id:
+        recipients = recipients.filter(course_id=course_id)
+    return recipients
+
+
+def broadcast_notification(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': "Only POST is allowed"}, status=405)
+    audience = request.POST.get('audience')
+    message = request.POST.get('message', '').strip()
+    if not message:
+        return JsonResponse({'error': "Please enter a message"}, status=400)
+    try:
+        filters = {key: int(request.POST[key]) for key in ('course_id', 'session_id', 'subject_id')
+                   if request.POST.get(key)}
+    except ValueError:
+        return JsonResponse({'error': "Invalid course, session or subject"}, status=400)
+    try:
+        recipients = _broadcast_recipients(audience, **filters)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if audience == 'student':
+        model, click_action = NotificationStudent, reverse('student_view_notification')
+    else:
+        model, click_action = NotificationStaff, reverse('staff_view_notification')
+    with transaction.atomic():
+        rows = list(recipients.values_list('id', 'admin_id'))
+        model.objects.bulk_create([
+            model(**{audience + '_id': profile_id}, message=message) for profile_id, admin_id in rows
+        ], batch_size=1000)
+        user_ids = [admin_id for profile_id, admin_id in rows]
+        PushNotification.objects.enqueue(user_ids, message, click_action)
+        transaction.on_commit(lambda: adjust_unread_counts(user_ids, 1))
+    return JsonResponse({'recipients': len(rows)})
+
+
 def delete_staff(request, staff_id):
     staff = get_object_or_404(CustomUser, staff__id=staff_id)
     staff.delete()
@@ -0,0 +1,43 @@
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from main_app.models import (ArchivedNotification, NotificationStaff, NotificationStudent,
+                             unread_count_cache_key)
+
+
+class Command(BaseCommand):
+    help = "Move staff and student notifications older than the retention period to ArchivedNotification"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 365))
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        for model in (NotificationStaff, NotificationStudent):
+            archived = self.archive(model, cutoff, options['batch_size'])
+            self.stdout.write("Archived %d %s rows" % (archived, model._meta.model_name))
+
+    def archive(self, model, cutoff, batch_size):
+        """Copy and delete one short transaction at a time, oldest first"""
+        total = 0
+        while True:
+            with transaction.atomic():
+                rows = list(model.objects.filter(created_at__lt=cutoff).order_by('created_at', 'id').values_list(
+                    'id', model.RECIPIENT + '__admin_id', 'message', 'is_read', 'created_at')[:batch_size])
+                if not rows:
+                    return total
+                ArchivedNotification.objects.bulk_create([
+                    ArchivedNotification(user_id=user_id, message=message, is_read=is_read, created_at=created_at)
+                    for pk, user_id, message, is_read, created_at in rows
+                ], batch_size=1000)
+                model.objects.filter(id__in=[row[0] for row in rows]).delete()
+            # Recount rather than adjust, so the archived rows cannot leave a counter off
+            cache.delete_many({unread_count_cache_key(user_id) for pk, user_id, message, is_read, created_at in rows
+                               if not is_read})
+            total += len(rows)
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from main_app.management.commands.seed_scale import CATEGORIES, FIRST_NAMES, LAST_NAMES
+from main_app.models import Book
+from main_app.search import search_books, search_terms
+
+ADJECTIVES = ["Silent", "Hidden", "Modern", "Applied", "Ancient", "Practical", "Quantum", "Digital",
+              "Classical", "Organic", "Advanced", "Introductory", "Discrete", "Global", "Urban", "Wild"]
+NOUNS = ["River", "Algorithms", "Mechanics", "Kingdom", "Economics", "Chemistry", "Networks", "Poetry",
+         "Compilers", "Empire", "Statistics", "Databases", "Ecology", "Optics", "Philosophy", "Garden"]
+
+
+class Command(BaseCommand):
+    help = "Time catalogue searches over a generated catalogue; nothing is kept in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=200000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.insert_books(rng, options['books'])
+            self.stdout.write("Inserted and indexed %d books in %.1fs" % (
+                options['books'], time.perf_counter() - started))
+            queries = [self.random_query(rng) for _ in range(options['queries'])]
+            indexed = self.time_queries(queries, lambda q: search_books(q))
+            # The unindexed equivalent: every word as a substring of any column
+            scanned = self.time_queries(queries[:max(len(queries) // 10, 1)], self.scan)
+            transaction.set_rollback(True)
+        self.stdout.write("%-10s %8s %8s %8s" % ('', 'queries', 'p50 ms', 'p95 ms'))
+        for label, timings in (('indexed', indexed), ('scan', scanned)):
+            self.stdout.write("%-10s %8d %8.2f %8.2f" % (
+                label, len(timings), statistics.median(timings) * 1000,
+                timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000))
+
+    def insert_books(self, rng, count):
+        rows = (
+            ("%s %s %d" % (rng.choice(ADJECTIVES), rng.choice(NOUNS), i),
+             "%s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+             9790000000000 + i, rng.choice(CATEGORIES))
+            for i in range(count)
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO main_app_book (name, author, isbn, category) VALUES (%s, %s, %s, %s)",
+                               list(rows))
+            if connection.vendor in ('sqlite', 'postgresql'):
+                cursor.execute("ANALYZE")
+
+    def random_query(self, rng):
+        kind = rng.random()
+        if kind < 0.4:
+            return "%s %s" % (rng.choice(ADJECTIVES), rng.choice(NOUNS)[:rng.randint(3, 6)])
+        if kind < 0.7:
+            return rng.choice(LAST_NAMES)
+        if kind < 0.9:
+            return "%s %s" % (rng.choice(NOUNS), rng.choice(CATEGORIES))
+        return "979000%d" % rng.randrange(100)
+
+    def scan(self, query):
+        matches = Q()
+        for term in search_terms(query):
+            matches &= (Q(name__icontains=term) | Q(author__icontains=term) | Q(category__icontains=term) |
+                        Q(isbn__contains=term))
+        return list(Book.objects.filter(matches).order_by('name', 'id')[:21])
+
+    def time_queries(self, queries, run):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)
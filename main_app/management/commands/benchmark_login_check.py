@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import URLPattern, get_resolver
+
+from main_app.middleware import LoginCheckMiddleWare
+from main_app.models import CustomUser
+
+# Unsaved users: the middleware only reads user_type, so nothing touches the database
+USERS = {
+    'anonymous': AnonymousUser(),
+    'hod': CustomUser(user_type='1'),
+    'staff': CustomUser(user_type='2'),
+    'student': CustomUser(user_type='3'),
+}
+
+
+class Command(BaseCommand):
+    help = "Time LoginCheckMiddleWare.process_view for every main_app URL and each role"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=2000, help="Calls timed per view and role")
+        parser.add_argument('--budget-us', type=float, default=10,
+                            help="Fail when a role's median microseconds per allowed call is over this")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        middleware = LoginCheckMiddleWare(lambda request: None)
+        self.stdout.write("Compiled %d routes in %.1fms" % (
+            len(middleware.rules), (time.perf_counter() - started) * 1000))
+        views = [pattern.callback for pattern in get_resolver('main_app.urls').url_patterns
+                 if isinstance(pattern, URLPattern)]
+        request = RequestFactory().get('/')
+
+        failures = []
+        self.stdout.write("%-10s %8s %8s %8s %11s %8s" % ('role', 'allowed', 'p50 us', 'max us', 'redirected', 'p50 us'))
+        for role, user in USERS.items():
+            request.user = user
+            # Redirects also build a response, so they are reported apart from the bare check
+            timings = {True: [], False: []}
+            for view in views:
+                allowed = middleware.process_view(request, view, (), {}) is None
+                began = time.perf_counter()
+                for _ in range(options['calls']):
+                    middleware.process_view(request, view, (), {})
+                timings[allowed].append((time.perf_counter() - began) / options['calls'] * 1e6)
+            allowed, redirected = timings[True], timings[False]
+            median = statistics.median(allowed) if allowed else 0
+            self.stdout.write("%-10s %8d %8.2f %8.2f %11d %8.2f" % (
+                role, len(allowed), median, max(allowed, default=0), len(redirected),
+                statistics.median(redirected) if redirected else 0))
+            if median > options['budget_us']:
+                failures.append("%s: %.2fus per allowed call over budget of %sus" % (
+                    role, median, options['budget_us']))
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError("%d budget check(s) failed" % len(failures))
@@ -0,0 +1,113 @@
+import datetime
+import random
+import statistics
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from main_app import analytics
+from main_app.management.commands.seed_scale import FIRST_NAMES, LAST_NAMES
+from main_app.models import Course, CustomUser, Session, Staff, Student, StudentResult, Subject
+
+
+class Command(BaseCommand):
+    help = "Time result analytics over a generated course; nothing is kept in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=5000)
+        parser.add_argument('--subjects', type=int, default=20,
+                            help="Every student gets a result in every subject")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            started = time.perf_counter()
+            course = self.insert_course(rng, options['students'], options['subjects'])
+            results = StudentResult.objects.filter(subject__course=course)
+            self.stdout.write("Inserted %d results in %.1fs" % (results.count(), time.perf_counter() - started))
+
+            load = self.time(lambda: analytics.load_scores(results), options['repeat'])
+            students, subjects, totals = analytics.load_scores(results)
+            compute = self.time(lambda: self.vectorized(students, totals), options['repeat'])
+            python = self.time(lambda: self.pure_python(students.tolist(), totals.tolist()), options['repeat'])
+            endpoint = self.time(lambda: analytics.analyse(results), options['repeat'])
+            subject = self.time(lambda: analytics.analyse(results.filter(subject_id=int(subjects[0]))),
+                                options['repeat'])
+            transaction.set_rollback(True)
+        self.stdout.write("%-34s %10s" % ('', 'median ms'))
+        for label, timing in (("load (one query)", load), ("stats + ranks, NumPy", compute),
+                              ("stats + ranks, pure Python", python), ("analyse(), whole course", endpoint),
+                              ("analyse(), one subject", subject)):
+            self.stdout.write("%-34s %10.1f" % (label, timing * 1000))
+
+    def insert_course(self, rng, students, subjects):
+        course = Course.objects.create(name="Analytics Benchmark")
+        session = Session.objects.create(start_year=datetime.date(2024, 7, 1), end_year=datetime.date(2028, 6, 30))
+        teacher = CustomUser.objects.create(email="analytics.staff@bench.college.test", user_type=2)
+        staff = Staff.objects.get_or_create(admin=teacher)[0]
+        Subject.objects.bulk_create([
+            Subject(name="Benchmark Subject %d" % i, course=course, staff=staff) for i in range(subjects)
+        ])
+        CustomUser.objects.bulk_create((
+            CustomUser(email="analytics%d@bench.college.test" % i, user_type=3, first_name=rng.choice(FIRST_NAMES),
+                       last_name=rng.choice(LAST_NAMES), gender=rng.choice("MF"), address="Campus Road")
+            for i in range(students)
+        ), batch_size=5000)
+        Student.objects.bulk_create((
+            Student(admin_id=admin_id, course=course, session=session)
+            for admin_id in CustomUser.objects.filter(email__endswith="@bench.college.test", user_type=3).values_list(
+                'id', flat=True)
+        ), batch_size=5000)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO main_app_studentresult (student_id, subject_id, test, exam, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)", [
+                    (student_id, subject_id, min(max(rng.gauss(26, 7), 0), 40), min(max(rng.gauss(36, 11), 0), 60),
+                     now, now)
+                    for subject_id in Subject.objects.filter(course=course).values_list('id', flat=True)
+                    for student_id in Student.objects.filter(course=course).values_list('id', flat=True)
+                ])
+            if connection.vendor in ('sqlite', 'postgresql'):
+                cursor.execute("ANALYZE")
+        return course
+
+    def vectorized(self, students, totals):
+        analytics.summarize(totals, 40)
+        student_ids, inverse = np.unique(students, return_inverse=True)
+        means = np.bincount(inverse, weights=totals) / np.bincount(inverse)
+        return analytics.competition_ranks(means)
+
+    def pure_python(self, students, totals):
+        """The same numbers the way a loop over the rows would get them"""
+        ordered = sorted(totals)
+        statistics.mean(totals), statistics.median(ordered), statistics.pstdev(totals)
+        statistics.quantiles(ordered, n=100, method='inclusive')
+        buckets = [0] * 10
+        for total in totals:
+            buckets[min(int(total // 10), 9)] += 1
+        sum(1 for total in totals if total >= 40) / len(totals)
+        sums, counts = {}, {}
+        for student_id, total in zip(students, totals):
+            sums[student_id] = sums.get(student_id, 0) + total
+            counts[student_id] = counts.get(student_id, 0) + 1
+        means = sorted(((sums[s] / counts[s], s) for s in sums), reverse=True)
+        ranks, previous = {}, None
+        for position, (mean, student_id) in enumerate(means, start=1):
+            ranks[student_id] = ranks[means[position - 2][1]] if mean == previous else position
+            previous = mean
+        return ranks
+
+    def time(self, run, repeat):
+        timings = []
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
@@ -0,0 +1,199 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test import Client, override_settings
+from django.urls import URLPattern, get_resolver
+
+from main_app.models import Admin, Course, ReportCardBatch, Session, Staff, Student, Subject
+
+# Query counts include the session, user and middleware lookups of the request
+BUDGETS = {
+    'admin_home': {'queries': 15, 'seconds': 1.0},
+    'student_home': {'queries': 10, 'seconds': 0.25},
+    'manage_student': {'queries': 10, 'seconds': 1.0},
+    'student_table': {'queries': 10, 'seconds': 0.25},
+    'view_issued_book': {'queries': 10, 'seconds': 0.5},
+}
+
+# Which account drives the views of each module
+ROLES = {
+    'main_app.hod_views': 'hod',
+    'main_app.staff_views': 'staff',
+    'main_app.EditResultView': 'staff',
+    'main_app.student_views': 'student',
+}
+
+# Views that end the session or delete data even when fetched with GET
+SKIPPED = {'user_logout', 'delete_staff', 'delete_student', 'delete_course', 'delete_subject', 'delete_session'}
+
+
+class QueryCounter:
+    """execute_wrapper() that counts statements, with no cap on how many"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Views' own atomic blocks become savepoints inside fetch(); leave them
+        # out like the BEGIN/COMMIT they would otherwise be
+        if 'SAVEPOINT' not in sql:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Fetch every main_app URL against the current database and check per-view budgets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write the JSON report to this file")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Timed runs per view; the median is reported")
+        parser.add_argument('--view', action='append', dest='views',
+                            help="Only benchmark the named URL (repeatable)")
+        parser.add_argument('--instrumentation', action='store_true',
+                            help="Also time every view with RequestInstrumentationMiddleware on and report "
+                                 "its overhead")
+
+    def handle(self, *args, **options):
+        accounts = self.accounts()
+        clients = self.clients(accounts)
+        # Each client loads its middleware on its first request, so these only ever run instrumented
+        instrumented = self.clients(accounts) if options['instrumentation'] else None
+        url_kwargs = self.url_kwargs(accounts)
+
+        results = {}
+        unfilled = {}
+        for pattern in get_resolver('main_app.urls').url_patterns:
+            if not isinstance(pattern, URLPattern) or pattern.name in SKIPPED:
+                continue
+            if options['views'] and pattern.name not in options['views']:
+                continue
+            # URLs need a row of each kwarg's model; skip the ones this database has none of
+            missing = sorted(name for name in pattern.pattern.converters if url_kwargs.get(name) is None)
+            if missing:
+                unfilled[pattern.name] = missing
+                continue
+            module = getattr(pattern.callback, 'view_class', pattern.callback).__module__
+            role = ROLES.get(module, 'anonymous')
+            path = '/' + str(pattern.pattern).replace('<int:', '{').replace('>', '}').format(**url_kwargs)
+            if instrumented is None:
+                result = self.measure(clients[role], path, options['repeat'])
+            else:
+                with override_settings(REQUEST_INSTRUMENTATION=False):
+                    result = self.measure(clients[role], path, options['repeat'])
+                with override_settings(REQUEST_INSTRUMENTATION=True):
+                    seconds = self.measure(instrumented[role], path, options['repeat'])['seconds']
+                result.update(instrumented_seconds=seconds, instrumentation_overhead=round(
+                    (seconds - result['seconds']) / result['seconds'], 4) if result['seconds'] else None)
+            results[pattern.name] = dict(result, role=role, path=path)
+
+        failures = self.check_budgets(results)
+        report = {'database': connections[DEFAULT_DB_ALIAS].vendor, 'views': results, 'failures': failures,
+                  'skipped': unfilled}
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump(report, fp, indent=2, sort_keys=True)
+                fp.write('\n')
+        self.print_summary(results, failures)
+        if instrumented is not None and results:
+            overheads = [result['instrumentation_overhead'] for result in results.values()
+                         if result['instrumentation_overhead'] is not None]
+            self.stdout.write("instrumentation overhead: median %+.1f%% over %d views" % (
+                statistics.median(overheads) * 100, len(overheads)))
+        for name, missing in sorted(unfilled.items()):
+            self.stderr.write("skipped %s: no value for %s" % (name, ", ".join(missing)))
+        if failures:
+            raise CommandError("%d budget check(s) failed" % len(failures))
+
+    def clients(self, accounts):
+        clients = {'anonymous': Client()}
+        for role, user in accounts.items():
+            clients[role] = Client()
+            clients[role].force_login(user)
+        return clients
+
+    def accounts(self):
+        hod = Admin.objects.select_related('admin').order_by('id').first()
+        staff = Staff.objects.filter(subject__isnull=False).select_related('admin').order_by('id').first()
+        student = Student.objects.filter(course__isnull=False).select_related('admin').order_by('id').first()
+        if not (hod and staff and student):
+            raise CommandError("Needs an HOD, a staff member with subjects and an enrolled student; "
+                               "run seed_scale first")
+        return {'hod': hod.admin, 'staff': staff.admin, 'student': student.admin}
+
+    def url_kwargs(self, accounts):
+        subject = Subject.objects.order_by('id').first()
+        return {
+            'staff_id': accounts['staff'].staff.id,
+            'student_id': accounts['student'].student.id,
+            'course_id': Course.objects.order_by('id').values_list('id', flat=True).first(),
+            'subject_id': subject.id if subject else 0,
+            'session_id': Session.objects.order_by('id').values_list('id', flat=True).first(),
+            'batch_id': ReportCardBatch.objects.order_by('id').values_list('id', flat=True).first(),
+        }
+
+    def fetch(self, client, path):
+        """GET inside a transaction that is always rolled back"""
+        with transaction.atomic():
+            try:
+                response = client.get(path)
+                status, error = response.status_code, None
+                b''.join(response) if response.streaming else response.content
+            except Exception as e:
+                status, error = 500, "%s: %s" % (type(e).__name__, e)
+            transaction.set_rollback(True)
+        return status, error
+
+    def measure(self, client, path, repeat):
+        tracemalloc.start()
+        self.fetch(client, path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings = []
+        for _ in range(max(repeat, 1)):
+            queries = QueryCounter()
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(queries):
+                started = time.perf_counter()
+                status, error = self.fetch(client, path)
+                timings.append(time.perf_counter() - started)
+        result = {
+            'status': status,
+            'seconds': round(statistics.median(timings), 4),
+            'queries': queries.count,
+            'peak_memory_kb': peak // 1024,
+        }
+        if error:
+            result['error'] = error
+        return result
+
+    def check_budgets(self, results):
+        failures = []
+        for name, budget in sorted(BUDGETS.items()):
+            result = results.get(name)
+            if result is None:
+                continue
+            if 'error' in result:
+                failures.append("%s failed: %s" % (name, result['error']))
+                continue
+            if result['status'] != 200:
+                # A redirect or error page is cheap and would pass its budget unnoticed
+                failures.append("%s answered %s" % (name, result['status']))
+                continue
+            for metric, limit in sorted(budget.items()):
+                if result[metric] > limit:
+                    failures.append("%s: %s %s over budget of %s" % (name, metric, result[metric], limit))
+        return failures
+
+    def print_summary(self, results, failures):
+        self.stdout.write("%-32s %-9s %6s %9s %8s %10s" % ('view', 'role', 'status', 'seconds', 'queries', 'peak KB'))
+        for name, result in sorted(results.items()):
+            self.stdout.write("%-32s %-9s %6s %9.4f %8d %10d" % (
+                name, result['role'], result['status'], result['seconds'], result['queries'],
+                result['peak_memory_kb']))
+        for failure in failures:
+            self.stderr.write(failure)
@@ -0,0 +1,21 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Delete expired database sessions in small batches, keeping write locks short"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        total = 0
+        while True:
+            keys = list(Session.objects.filter(expire_date__lt=now).values_list(
+                'session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            total += Session.objects.filter(session_key__in=keys).delete()[0]
+        self.stdout.write(self.style.SUCCESS("Deleted %d expired sessions" % total))
@@ -0,0 +1,68 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    """Answers like the legacy FCM send endpoint; tokens starting with
+    "invalid" are rejected and "flaky" ones report Unavailable"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        tokens = payload.get('registration_ids') or [payload.get('to')]
+        results = []
+        for token in tokens:
+            if token.startswith('invalid'):
+                results.append({'error': 'InvalidRegistration'})
+            elif token.startswith('flaky'):
+                results.append({'error': 'Unavailable'})
+            else:
+                results.append({'message_id': '0:%s' % token})
+        failures = sum('error' in result for result in results)
+        body = json.dumps({'success': len(results) - failures, 'failure': failures, 'results': results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.messages += len(tokens)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeFCMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), FakeFCMHandler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.messages = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/fcm/send' % self.server_port
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for FCM; point FCM_URL at it to send pushes offline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        server = FakeFCMServer(options['port'])
+        self.stdout.write("Fake FCM listening on %s" % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write("Answered %d requests for %d messages" % (server.requests, server.messages))
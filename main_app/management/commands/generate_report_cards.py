@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.models import Course, ReportCardBatch, Session
+from main_app.report_cards import build, claim_next, release_stale
+
+
+class Command(BaseCommand):
+    help = "Render queued report card batches into zips under PRIVATE_ROOT"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, help="Queue and build this course's cards (with --session)")
+        parser.add_argument('--session', type=int)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Rendering processes (default: REPORT_CARD_WORKERS or one per CPU)")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to wait when nothing is queued")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once nothing is queued instead of polling")
+
+    def handle(self, *args, **options):
+        if options['course'] or options['session']:
+            try:
+                ReportCardBatch.objects.create(course=Course.objects.get(id=options['course']),
+                                               session=Session.objects.get(id=options['session']))
+            except (Course.DoesNotExist, Session.DoesNotExist):
+                raise CommandError("--course and --session must both name existing rows")
+            options['once'] = True
+        while True:
+            released = release_stale()
+            if released:
+                self.stdout.write("Re-queued %d batches left running" % released)
+            batch = claim_next()
+            if batch is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            self.run(batch, options['workers'])
+
+    def run(self, batch, workers):
+        started = time.monotonic()
+        self.stdout.write("Batch %d: %s, %s" % (batch.id, batch.course, batch.session))
+        shown = []
+
+        def progress(rendered, total):
+            # A line for every tenth of the batch is enough on a terminal
+            if rendered * 10 // total not in shown:
+                shown.append(rendered * 10 // total)
+                self.stdout.write("  %d / %d cards" % (rendered, total))
+
+        try:
+            batch = build(batch, workers, progress)
+        except Exception as e:
+            self.stderr.write("Batch %d failed: %s" % (batch.id, e))
+            return
+        self.stdout.write(self.style.SUCCESS("Batch %d: %d cards in %.1fs, %s" % (
+            batch.id, batch.total, time.monotonic() - started, batch.file.name)))
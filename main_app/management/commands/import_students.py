@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from main_app.student_import import ImportFileError, create_students, read_rows, validate_rows
+
+
+class Command(BaseCommand):
+    help = "Create students from a .csv or .xlsx sheet; nothing is created unless every row is valid"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Password hashing processes (default: STUDENT_IMPORT_WORKERS or one per CPU)")
+        parser.add_argument('--dry-run', action='store_true', help="Only validate the sheet")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            with open(options['path'], 'rb') as fp:
+                rows = read_rows(fp, options['path'])
+        except (OSError, ImportFileError) as e:
+            raise CommandError(str(e))
+        valid, errors = validate_rows(rows)
+        self.stdout.write("Validated %d rows in %.1fs" % (len(rows), time.monotonic() - started))
+        self.check_errors(errors)
+        if options['dry_run']:
+            return
+        try:
+            created = create_students(valid, options['workers'])
+        except IntegrityError:
+            # An email was registered after the rows were validated
+            self.check_errors(validate_rows(rows)[1])
+            raise
+        self.stdout.write(self.style.SUCCESS("Imported %d students in %.1fs" % (created, time.monotonic() - started)))
+
+    def check_errors(self, errors):
+        for error in errors:
+            self.stderr.write("row %(row)d %(email)s: %(error)s" % error)
+        if errors:
+            raise CommandError("%d invalid rows; nothing was imported" % len(errors))
@@ -0,0 +1,122 @@
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from main_app.captcha import get_captcha_verifier
+from main_app.models import CustomUser
+
+
+class FakeSiteverifyHandler(BaseHTTPRequestHandler):
+    """Answers like reCAPTCHA siteverify after a fixed delay, over keep-alive"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        body = json.dumps({'success': True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.verifications += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSiteverifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), FakeSiteverifyHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.verifications = 0
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class Command(BaseCommand):
+    help = "Measure doLogin throughput for concurrent users against a local fake captcha server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Concurrent users")
+        parser.add_argument('--logins', type=int, default=5, help="Logins per user")
+        parser.add_argument('--password', default="password",
+                            help="Password of the student accounts used (seed_scale's default)")
+        parser.add_argument('--captcha-latency', type=float, default=50,
+                            help="Milliseconds the fake captcha server takes to answer")
+        parser.add_argument('--stub', action='store_true',
+                            help="Use StubCaptchaVerifier instead of HTTP verification")
+
+    def handle(self, *args, **options):
+        emails = list(CustomUser.objects.filter(user_type=3).order_by('id').values_list(
+            'email', flat=True)[:options['users']])
+        if len(emails) < options['users']:
+            raise CommandError("Needs %d student accounts; run seed_scale first" % options['users'])
+
+        server = FakeSiteverifyServer(options['captcha_latency'] / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        backend = 'main_app.captcha.%s' % ('StubCaptchaVerifier' if options['stub'] else 'RecaptchaVerifier')
+        try:
+            with override_settings(CAPTCHA_BACKEND=backend, CAPTCHA_SECRET_KEY='loadtest',
+                                   CAPTCHA_VERIFY_URL='http://127.0.0.1:%d/' % server.server_port):
+                get_captcha_verifier.cache_clear()
+                timings, failures, elapsed = self.run_users(emails, options)
+        finally:
+            get_captcha_verifier.cache_clear()
+            server.shutdown()
+            server.server_close()
+
+        total = len(timings) + failures
+        timings.sort()
+        self.stdout.write("backend            %s" % backend)
+        self.stdout.write("logins             %d (%d failed)" % (total, failures))
+        self.stdout.write("throughput         %.1f logins/s" % (len(timings) / elapsed))
+        if timings:
+            self.stdout.write("latency p50 / p95  %.0f / %.0f ms" % (
+                statistics.median(timings) * 1000, timings[int(len(timings) * 0.95) - 1] * 1000))
+        self.stdout.write("captcha requests   %d over %d connections" % (server.verifications, server.connections))
+
+    def run_users(self, emails, options):
+        url = reverse('user_login')
+        timings = []
+        failures = []
+        lock = threading.Lock()
+
+        def user(email):
+            client = Client()
+            try:
+                for n in range(options['logins']):
+                    started = time.perf_counter()
+                    response = client.post(url, {'email': email, 'password': options['password'],
+                                                 'g-recaptcha-response': 'token-%s-%d' % (email, n)})
+                    took = time.perf_counter() - started
+                    with lock:
+                        if response.status_code == 302 and response.url != '/':
+                            timings.append(took)
+                        else:
+                            failures.append(email)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=user, args=(email,)) for email in emails]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return timings, len(failures), time.perf_counter() - started
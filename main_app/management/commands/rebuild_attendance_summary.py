@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main_app.models import AttendanceSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-student attendance counters from the attendance reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows written per INSERT")
+
+    def handle(self, *args, **options):
+        total = AttendanceSummary.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt %d attendance summary rows" % total))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = "Repopulate the SQLite full-text book index from main_app_book"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write("Nothing to do: only the SQLite index keeps its own copy of the catalogue")
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO main_app_book_fts(main_app_book_fts) VALUES ('rebuild')")
+            cursor.execute("SELECT COUNT(*) FROM main_app_book_fts")
+            self.stdout.write(self.style.SUCCESS("Indexed %d books" % cursor.fetchone()[0]))
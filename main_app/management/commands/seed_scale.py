@@ -0,0 +1,194 @@
+import datetime
+import random
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from main_app.models import (Admin, Attendance, AttendanceReport, AttendanceSummary, Book, Course,
+                             CustomUser, IssuedBook, LeaveReportStudent, NotificationStaff,
+                             NotificationStudent, Session, Staff, Student, StudentResult, Subject)
+
+EMAIL_DOMAIN = "seed.college.test"
+FIRST_NAMES = ["Aarav", "Aisha", "Arjun", "Diya", "Farhan", "Ishaan", "Kavya", "Meera",
+               "Nikhil", "Priya", "Rahul", "Riya", "Sana", "Tanvi", "Vikram", "Zoya"]
+LAST_NAMES = ["Ansari", "Banerjee", "Chopra", "Das", "Gupta", "Iyer", "Khan", "Mehta",
+              "Nair", "Patel", "Qureshi", "Reddy", "Shah", "Singh", "Verma", "Yadav"]
+CATEGORIES = ["Computing", "Mathematics", "Physics", "Literature", "History", "Economics"]
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic, production-sized college dataset for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=20000)
+        parser.add_argument('--subjects', type=int, default=400)
+        parser.add_argument('--days', type=int, default=180,
+                            help="Length of the teaching period, in calendar days")
+        parser.add_argument('--courses', type=int, default=20)
+        parser.add_argument('--sessions', type=int, default=4)
+        parser.add_argument('--staff', type=int, default=None,
+                            help="Defaults to one member of staff per four subjects")
+        parser.add_argument('--meetings-per-week', type=int, default=1,
+                            help="Registers taken per subject and session each week")
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--password', default="password",
+                            help="Password shared by every generated account")
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(email__endswith="@" + EMAIL_DOMAIN).exists():
+            raise CommandError("Seed data is already present; run this against a fresh database")
+        if min(options['students'], options['subjects'], options['courses'], options['sessions']) < 1:
+            raise CommandError("--students, --subjects, --courses and --sessions must be positive")
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = connection.ops.adapt_datetimefield_value(timezone.now())
+        started = time.monotonic()
+        with transaction.atomic():
+            self.seed(options)
+        self.stdout.write(self.style.SUCCESS("Seeded in %.1fs" % (time.monotonic() - started)))
+
+    def report(self, label, count):
+        self.stdout.write("  %-22s %d" % (label, count))
+
+    def insert_rows(self, model, fields, rows):
+        """executemany() straight into the table; used for the multi-million row tables"""
+        columns = [model._meta.get_field(field).column for field in fields]
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            connection.ops.quote_name(model._meta.db_table),
+            ", ".join(connection.ops.quote_name(column) for column in columns),
+            ", ".join(["%s"] * len(columns)))
+        total = 0
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    return total
+                cursor.executemany(sql, batch)
+                total += len(batch)
+
+    def create_users(self, prefix, count, user_type, password):
+        rng = self.rng
+        CustomUser.objects.bulk_create((
+            CustomUser(email="%s%d@%s" % (prefix, i, EMAIL_DOMAIN), password=password, user_type=user_type,
+                       first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                       gender=rng.choice("MF"), address="Campus Road")
+            for i in range(count)
+        ), batch_size=self.batch_size)
+        return list(CustomUser.objects.filter(
+            email__startswith=prefix, email__endswith="@" + EMAIL_DOMAIN, user_type=user_type).order_by(
+            'id').values_list('id', flat=True))
+
+    def seed(self, options):
+        rng = self.rng
+        password = make_password(options['password'])
+        start = datetime.date(2024, 1, 1)
+        n_staff = options['staff'] or max(1, options['subjects'] // 4)
+
+        hod = CustomUser.objects.create(email="hod@" + EMAIL_DOMAIN, password=password, user_type=1,
+                                        first_name="Head", last_name="Department", is_staff=True)
+        Admin.objects.get_or_create(admin=hod)
+
+        Course.objects.bulk_create([Course(name="Course %d" % i) for i in range(options['courses'])])
+        courses = list(Course.objects.order_by('-id').values_list('id', flat=True)[:options['courses']])[::-1]
+        Session.objects.bulk_create([
+            Session(start_year=datetime.date(2021 + i, 7, 1), end_year=datetime.date(2025 + i, 6, 30))
+            for i in range(options['sessions'])
+        ])
+        sessions = list(Session.objects.order_by('-id').values_list('id', flat=True)[:options['sessions']])[::-1]
+        self.report("courses", len(courses))
+        self.report("sessions", len(sessions))
+
+        staff_users = self.create_users("staff", n_staff, 2, password)
+        Staff.objects.bulk_create([
+            Staff(admin_id=admin_id, course_id=courses[i % len(courses)]) for i, admin_id in enumerate(staff_users)
+        ], batch_size=self.batch_size)
+        staff = list(Staff.objects.filter(admin_id__in=staff_users).order_by('id').values_list('id', flat=True))
+        self.report("staff", len(staff))
+
+        Subject.objects.bulk_create([
+            Subject(name="Subject %d" % i, course_id=courses[i % len(courses)], staff_id=staff[i % len(staff)])
+            for i in range(options['subjects'])
+        ], batch_size=self.batch_size)
+        subjects = list(Subject.objects.filter(staff_id__in=staff).order_by('id').values_list('id', 'course_id'))
+        self.report("subjects", len(subjects))
+
+        # Students are spread evenly over every course x session cohort
+        student_users = self.create_users("student", options['students'], 3, password)
+        Student.objects.bulk_create([
+            Student(admin_id=admin_id, course_id=courses[i % len(courses)],
+                    session_id=sessions[(i // len(courses)) % len(sessions)])
+            for i, admin_id in enumerate(student_users)
+        ], batch_size=self.batch_size)
+        cohorts = {}
+        for student_id, course_id, session_id in Student.objects.filter(admin_id__in=student_users).values_list(
+                'id', 'course_id', 'session_id'):
+            cohorts.setdefault((course_id, session_id), []).append(student_id)
+        student_ids = [student_id for cohort in cohorts.values() for student_id in cohort]
+        self.report("students", len(student_ids))
+
+        Attendance.objects.bulk_create([
+            Attendance(subject_id=subject_id, session_id=session_id, date=start + datetime.timedelta(days=day))
+            for index, (subject_id, course_id) in enumerate(subjects)
+            for session_id in sessions
+            for day in range(options['days'])
+            if (day + index) % 7 < options['meetings_per_week']
+        ], batch_size=self.batch_size)
+        course_of = dict(subjects)
+        registers = list(Attendance.objects.filter(subject_id__in=course_of).values_list(
+            'id', 'subject_id', 'session_id'))
+        self.report("attendance registers", len(registers))
+
+        reports = self.insert_rows(AttendanceReport, ['attendance', 'student', 'status', 'created_at', 'updated_at'], (
+            (attendance_id, student_id, rng.random() < 0.85, self.now, self.now)
+            for attendance_id, subject_id, session_id in registers
+            for student_id in cohorts.get((course_of[subject_id], session_id), ())
+        ))
+        self.report("attendance reports", reports)
+        self.report("attendance summaries", AttendanceSummary.objects.rebuild(batch_size=self.batch_size))
+
+        results = self.insert_rows(StudentResult, ['student', 'subject', 'test', 'exam', 'created_at', 'updated_at'], (
+            (student_id, subject_id, rng.randint(0, 40), rng.randint(0, 60), self.now, self.now)
+            for subject_id, course_id in subjects
+            for session_id in sessions
+            for student_id in cohorts.get((course_id, session_id), ())
+        ))
+        self.report("results", results)
+
+        LeaveReportStudent.objects.bulk_create((
+            LeaveReportStudent(student_id=student_id, message="Medical leave", status=rng.choice((-1, 0, 1)),
+                               date=str(start + datetime.timedelta(days=rng.randrange(options['days']))))
+            for student_id in student_ids if rng.random() < 0.2
+        ), batch_size=self.batch_size)
+        self.report("student leaves", LeaveReportStudent.objects.filter(student_id__in=student_ids).count())
+
+        notifications = self.insert_rows(
+            NotificationStudent, ['student', 'message', 'is_read', 'created_at', 'updated_at'], (
+                (student_id, "Notice %d" % n, False, self.now, self.now)
+                for student_id in student_ids for n in range(rng.randint(0, 4))
+            ))
+        notifications += self.insert_rows(
+            NotificationStaff, ['staff', 'message', 'is_read', 'created_at', 'updated_at'], (
+                (staff_id, "Notice %d" % n, False, self.now, self.now) for staff_id in staff for n in range(5)
+            ))
+        self.report("notifications", notifications)
+
+        Book.objects.bulk_create((
+            Book(name="Book %d" % i, author="Author %d" % rng.randrange(1000), isbn=9780000000000 + i,
+                 category=rng.choice(CATEGORIES))
+            for i in range(options['books'])
+        ), batch_size=self.batch_size)
+        self.report("books", options['books'])
+        if options['books']:
+            loans = IssuedBook.objects.bulk_create((
+                IssuedBook(student_id=str(student_id), isbn=str(9780000000000 + rng.randrange(options['books'])),
+                           expiry_date=start + datetime.timedelta(days=rng.randrange(options['days'])))
+                for student_id in student_ids if rng.random() < 0.25
+            ), batch_size=self.batch_size)
+            self.report("issued books", len(loans))
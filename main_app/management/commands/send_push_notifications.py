@@ -0,0 +1,41 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.push import FCMClient, dispatch, release_stale
+
+
+class Command(BaseCommand):
+    help = "Drain the push notification outbox to Firebase Cloud Messaging"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to wait when the outbox is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no message is due instead of polling")
+
+    def handle(self, *args, **options):
+        try:
+            client = FCMClient()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e)) from e
+        started = time.monotonic()
+        total_claimed = total_sent = 0
+        while True:
+            # Checked on every poll, so messages of a worker that dies meanwhile are picked up too
+            released = release_stale()
+            if released:
+                self.stdout.write("Re-queued %d messages left in flight" % released)
+            claimed, sent = dispatch(client, options['batch_size'])
+            total_claimed += claimed
+            total_sent += sent
+            if claimed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS("Sent %d of %d messages in %.1fs (%.0f/s)" % (
+            total_sent, total_claimed, elapsed, total_sent / elapsed if elapsed else 0)))
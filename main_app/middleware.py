@@ -1,49 +1,235 @@
+import json
+import logging
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from time import perf_counter, time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404
+from django.template.base import Template
 from django.utils.deprecation import MiddlewareMixin
-from django.urls import reverse
+from django.urls import URLResolver, get_resolver, resolve, reverse
 from django.shortcuts import redirect
 from django.db.utils import OperationalError, ProgrammingError
 
+from .models import load_profile
+
+logger = logging.getLogger('main_app.instrumentation')
+
+
+class RouteRule:
+    def __init__(self, user_types, public=False, needs_db=True):
+        self.user_types = user_types  # User types allowed to open the view once logged in
+        self.public = public  # Reachable without logging in
+        self.needs_db = needs_db  # Redirect to login if the user tables cannot be read
+
+
+# Which user types may use the views of each module; the rest are open to all three
+MODULE_USER_TYPES = {
+    'main_app.hod_views': frozenset('1'),
+    'main_app.staff_views': frozenset('12'),
+    'main_app.EditResultView': frozenset('12'),
+    'main_app.student_views': frozenset('3'),
+}
+ALL_USER_TYPES = frozenset('123')
+HOME_PAGES = {'1': 'admin_home', '2': 'staff_home', '3': 'student_home'}
+
 
 class LoginCheckMiddleWare(MiddlewareMixin):
-    def process_view(self, request, view_func, view_args, view_kwargs):
-        modulename = view_func.__module__
-<<<<<<< HEAD
-        user = request.user # Who is the current user ?
-=======
-        auth_allowed_paths = {
-            reverse('login_page'),
-            reverse('user_login'),
-            reverse('user_logout'),
-        }
+    """Redirects users away from views their role may not open. The rule for
+    each view is compiled from the URLconf once, so a request costs one
+    dict lookup."""
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.login_page = reverse('login_page')
+        self.home_pages = {user_type: reverse(name) for user_type, name in HOME_PAGES.items()}
+        self.public_views = {resolve(reverse('login_page')).func, resolve(reverse('user_login')).func}
+        self.db_optional_views = self.public_views | {resolve(reverse('user_logout')).func}
+        self.rules = {}
+        self.compile_patterns(get_resolver().url_patterns)
+
+    def compile_patterns(self, patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                self.compile_patterns(pattern.url_patterns)
+            else:
+                self.compile_rule(pattern.callback)
 
+    def compile_rule(self, view_func):
+        view = getattr(view_func, 'view_class', view_func)
+        modulename = view.__module__
+        public = view_func in self.public_views or modulename == 'django.contrib.auth.views'
+        rule = RouteRule(
+            MODULE_USER_TYPES.get(modulename, ALL_USER_TYPES),
+            public=public,
+            needs_db=not (public or view_func in self.db_optional_views
+                          or modulename.startswith(('django.contrib.auth', 'django.contrib.admin'))))
+        self.rules[view_func] = rule
+        return rule
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        rule = self.rules.get(view_func) or self.compile_rule(view_func)
         try:
             user = request.user # Who is the current user ?
-            user_type = str(getattr(user, 'user_type', ''))
+            authenticated = user.is_authenticated
         except (OperationalError, ProgrammingError):
             # Let auth pages load even when DB tables are not initialized yet.
-            if (
-                request.path in auth_allowed_paths
-                or modulename.startswith('django.contrib.auth')
-                or request.path.startswith('/admin/')
-            ):
+            if rule.needs_db:
+                return redirect(self.login_page)
+            return None
+
+        if not authenticated:
+            if rule.public:
                 return None
-            return redirect(reverse('login_page'))
-
->>>>>>> 1cca3cd (Fix login 500 by handling DB readiness in auth middleware)
-        if user.is_authenticated:
-            if user.user_type == '1': # Is it the HOD/Admin
-                if modulename == 'main_app.student_views':
-                    return redirect(reverse('admin_home'))
-            elif user.user_type == '2': #  Staff :-/ ?
-                if modulename == 'main_app.student_views' or modulename == 'main_app.hod_views':
-                    return redirect(reverse('staff_home'))
-            elif user.user_type == '3': # ... or Student ?
-                if modulename == 'main_app.hod_views' or modulename == 'main_app.staff_views':
-                    return redirect(reverse('student_home'))
-            else: # None of the aforementioned ? Please take the user to login page
-                return redirect(reverse('login_page'))
-        else:
-            if request.path == reverse('login_page') or modulename == 'django.contrib.auth.views' or request.path == reverse('user_login'): # If the path is login or has anything to do with authentication, pass
-                pass
-            else:
-                return redirect(reverse('login_page'))
+            return redirect(self.login_page)
+        if user.user_type in rule.user_types:
+            return None
+        # Logged in, but not allowed here: send them to their own dashboard
+        return redirect(self.home_pages.get(user.user_type, self.login_page))
+
+
+class SessionRefreshMiddleware(MiddlewareMixin):
+    """Slides the session expiry without writing the session on every request.
+
+    The session is re-saved (pushing its expiry, and the "remember me"
+    cookie, forward) only once it was last saved more than
+    SESSION_REFRESH_INTERVAL seconds ago, so most page views write nothing.
+    """
+    refreshed_key = '_session_refreshed_at'
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is None or not session.accessed or session.is_empty():
+            return response
+        now = int(time())
+        refreshed_at = session.get(self.refreshed_key, 0)
+        interval = getattr(settings, 'SESSION_REFRESH_INTERVAL', 24 * 60 * 60)
+        # Sessions being saved anyway just record it
+        if session.modified or now - refreshed_at >= interval:
+            session[self.refreshed_key] = now
+        return response
+
+
+def get_request_profile(request):
+    if not hasattr(request, '_cached_profile'):
+        # Evaluating request.user leaves the unwrapped user in request._cached_user;
+        # model forms read the profile's admin.__dict__, which a lazy object hides
+        request.user.is_authenticated
+        request._cached_profile = load_profile(getattr(request, '_cached_user', request.user))
+    return request._cached_profile
+
+
+def get_profile_or_404(request, model):
+    """The logged in user's Admin, Staff or Student row, resolved once per request"""
+    profile = get_request_profile(request)
+    if not isinstance(profile, model):
+        raise Http404("No %s profile for this user" % model._meta.object_name)
+    return profile
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += perf_counter() - started
+            self.queries += 1
+            # Parameters are passed separately, so the SQL text is the query's shape
+            self.shapes[sql] += 1
+
+
+_local = threading.local()
+_render_lock = threading.Lock()
+_measured_requests = 0
+_original_render = Template.render
+
+
+def _instrumented_render(self, context):
+    """Time top-level Template.render calls made while a request is measured"""
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is None or metrics.rendering:  # Not measured, or an include/extends
+        return _original_render(self, context)
+    metrics.rendering = True
+    started = perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        metrics.template_time += perf_counter() - started
+        metrics.rendering = False
+
+
+def _instrument_template_render():
+    """Patch Template.render while at least one request is being measured"""
+    global _measured_requests
+    with _render_lock:
+        _measured_requests += 1
+        if _measured_requests == 1:
+            Template.render = _instrumented_render
+
+
+def _restore_template_render():
+    global _measured_requests
+    with _render_lock:
+        _measured_requests -= 1
+        if _measured_requests == 0:
+            Template.render = _original_render
+
+
+class RequestInstrumentationMiddleware:
+    """Adds a Server-Timing header with query, template and view timings when
+    REQUEST_INSTRUMENTATION is on, and logs query shapes repeated within one
+    request (N+1 patterns) to the main_app.instrumentation logger."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.repeat_threshold = getattr(settings, 'REQUEST_INSTRUMENTATION_REPEAT_THRESHOLD', 10)
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        _instrument_template_render()
+        started = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+            _restore_template_render()
+        total = perf_counter() - started
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.1f;desc="%d queries"' % (metrics.sql_time * 1000, metrics.queries),
+            'tpl;dur=%.1f' % (metrics.template_time * 1000),
+            'view;dur=%.1f' % ((total - metrics.template_time) * 1000),
+            'total;dur=%.1f' % (total * 1000),
+        ])
+        repeated = [(sql, count) for sql, count in metrics.shapes.items() if count >= self.repeat_threshold]
+        if repeated:
+            logger.warning(json.dumps({
+                'event': 'repeated_queries',
+                'method': request.method,
+                'path': request.path,
+                'view': getattr(request, 'instrumented_view', None),
+                'queries': metrics.queries,
+                'repeated': [{'count': count, 'sql': sql} for sql, count in sorted(repeated, key=lambda r: -r[1])],
+            }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        request.instrumented_view = view.__module__ + '.' + view.__name__
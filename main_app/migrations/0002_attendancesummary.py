@@ -0,0 +1,45 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_summary(apps, schema_editor):
+    AttendanceReport = apps.get_model('main_app', 'AttendanceReport')
+    AttendanceSummary = apps.get_model('main_app', 'AttendanceSummary')
+    totals = AttendanceReport.objects.values(
+        'student_id', 'attendance__subject_id', 'attendance__session_id').annotate(
+        present=models.Count('id', filter=models.Q(status=True)),
+        absent=models.Count('id', filter=models.Q(status=False))).order_by()
+    AttendanceSummary.objects.bulk_create([
+        AttendanceSummary(student_id=row['student_id'], subject_id=row['attendance__subject_id'],
+                          session_id=row['attendance__session_id'], present=row['present'], absent=row['absent'])
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('present', models.IntegerField(default=0)),
+                ('absent', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.session')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.student')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.subject')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='attendancesummary',
+            constraint=models.UniqueConstraint(fields=('student', 'subject', 'session'), name='unique_attendance_summary'),
+        ),
+        migrations.RunPython(populate_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+
+
+def deduplicate_attendance(apps, schema_editor):
+    Attendance = apps.get_model('main_app', 'Attendance')
+    AttendanceReport = apps.get_model('main_app', 'AttendanceReport')
+    AttendanceSummary = apps.get_model('main_app', 'AttendanceSummary')
+
+    # Fold repeated registers (same subject, session and date) into the oldest one
+    duplicated = Attendance.objects.values('subject_id', 'session_id', 'date').annotate(
+        keep=models.Min('id'), total=models.Count('id')).filter(total__gt=1).order_by()
+    for group in duplicated:
+        extra = Attendance.objects.filter(
+            subject_id=group['subject_id'], session_id=group['session_id'], date=group['date']).exclude(
+            id=group['keep'])
+        AttendanceReport.objects.filter(attendance__in=extra).update(attendance_id=group['keep'])
+        extra.delete()
+
+    # Keep only the latest report per student and register
+    duplicated = AttendanceReport.objects.values('attendance_id', 'student_id').annotate(
+        keep=models.Max('id'), total=models.Count('id')).filter(total__gt=1).order_by()
+    for group in duplicated:
+        AttendanceReport.objects.filter(
+            attendance_id=group['attendance_id'], student_id=group['student_id']).exclude(
+            id=group['keep']).delete()
+
+    # The counters were built from the duplicated rows, so recompute them
+    totals = AttendanceReport.objects.values(
+        'student_id', 'attendance__subject_id', 'attendance__session_id').annotate(
+        present=models.Count('id', filter=models.Q(status=True)),
+        absent=models.Count('id', filter=models.Q(status=False))).order_by()
+    AttendanceSummary.objects.all().delete()
+    AttendanceSummary.objects.bulk_create([
+        AttendanceSummary(student_id=row['student_id'], subject_id=row['attendance__subject_id'],
+                          session_id=row['attendance__session_id'], present=row['present'], absent=row['absent'])
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0002_attendancesummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_attendance, migrations.RunPython.noop),
+    ]
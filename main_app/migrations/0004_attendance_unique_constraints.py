@@ -0,0 +1,21 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0003_deduplicate_attendance'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('subject', 'session', 'date'), name='unique_attendance_register'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancereport',
+            constraint=models.UniqueConstraint(fields=('attendance', 'student'), name='unique_attendance_report'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0004_attendance_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['subject', 'date'], name='attendance_subject_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancereport',
+            index=models.Index(fields=['student', 'status'], name='attendancereport_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['isbn'], name='book_isbn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['user_type'], name='customuser_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['isbn'], name='issuedbook_isbn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leavereportstudent',
+            index=models.Index(fields=['status', 'student'], name='leavestudent_status_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0008_customuser_name_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='issuedbook',
+            index=models.Index(fields=['expiry_date', 'id'], name='issuedbook_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# Full-text index over the catalogue, maintained by the database itself so
+# bulk inserts and queryset updates stay searchable. Note that on SQLite a
+# later migration that rebuilds main_app_book (e.g. AlterField) drops these
+# triggers; recreate them there, then run rebuild_book_search.
+SQLITE_INSTALL = [
+    """CREATE VIRTUAL TABLE main_app_book_fts USING fts5(
+        name, author, category, isbn,
+        content='main_app_book', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER main_app_book_fts_insert AFTER INSERT ON main_app_book BEGIN
+        INSERT INTO main_app_book_fts(rowid, name, author, category, isbn)
+        VALUES (new.id, new.name, new.author, new.category, new.isbn);
+    END""",
+    """CREATE TRIGGER main_app_book_fts_delete AFTER DELETE ON main_app_book BEGIN
+        INSERT INTO main_app_book_fts(main_app_book_fts, rowid, name, author, category, isbn)
+        VALUES ('delete', old.id, old.name, old.author, old.category, old.isbn);
+    END""",
+    """CREATE TRIGGER main_app_book_fts_update AFTER UPDATE ON main_app_book BEGIN
+        INSERT INTO main_app_book_fts(main_app_book_fts, rowid, name, author, category, isbn)
+        VALUES ('delete', old.id, old.name, old.author, old.category, old.isbn);
+        INSERT INTO main_app_book_fts(rowid, name, author, category, isbn)
+        VALUES (new.id, new.name, new.author, new.category, new.isbn);
+    END""",
+    "INSERT INTO main_app_book_fts(main_app_book_fts) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS main_app_book_fts_insert",
+    "DROP TRIGGER IF EXISTS main_app_book_fts_delete",
+    "DROP TRIGGER IF EXISTS main_app_book_fts_update",
+    "DROP TABLE IF EXISTS main_app_book_fts",
+]
+# An expression index needs no triggers; main_app.search repeats the expression verbatim
+POSTGRESQL_INSTALL = [
+    """CREATE INDEX book_search_idx ON main_app_book USING GIN (to_tsvector('simple',
+        name || ' ' || author || ' ' || category || ' ' || isbn::text))""",
+]
+POSTGRESQL_UNINSTALL = ["DROP INDEX IF EXISTS book_search_idx"]
+
+
+def install(apps, schema_editor):
+    statements = {'sqlite': SQLITE_INSTALL, 'postgresql': POSTGRESQL_INSTALL}
+    for sql in statements.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(sql)
+
+
+def uninstall(apps, schema_editor):
+    statements = {'sqlite': SQLITE_UNINSTALL, 'postgresql': POSTGRESQL_UNINSTALL}
+    for sql in statements.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0009_issuedbook_expiry_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+def deduplicate_results(apps, schema_editor):
+    StudentResult = apps.get_model('main_app', 'StudentResult')
+    # Keep only the most recently created result per student and subject
+    duplicated = StudentResult.objects.values('student_id', 'subject_id').annotate(
+        keep=models.Max('id'), total=models.Count('id')).filter(total__gt=1).order_by()
+    for group in duplicated:
+        StudentResult.objects.filter(
+            student_id=group['student_id'], subject_id=group['subject_id']).exclude(id=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0010_book_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_results, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.1 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0011_deduplicate_results'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='studentresult',
+            constraint=models.UniqueConstraint(fields=('student', 'subject'), name='unique_student_result'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.1 on 2026-10-18 20:23
+
+from django.db import migrations, models
+import main_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_reportcardbatch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reportcardbatch',
+            name='file',
+            field=models.FileField(blank=True, storage=main_app.models.PrivateStorage(), upload_to='report_cards/'),
+        ),
+    ]
@@ -1,12 +1,21 @@
+import os
+
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
 from django.contrib.auth.models import UserManager
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Concat, Greatest
 from django.contrib.auth.models import AbstractUser
+from collections import defaultdict
 from datetime import datetime,timedelta
 
-
+from .pagination import keyset_page
 
 
 class CustomUserManager(UserManager):
@@ -57,6 +66,12 @@ class CustomUser(AbstractUser):
     REQUIRED_FIELDS = []
     objects = CustomUserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['user_type'], name='customuser_user_type_idx'),
+            models.Index(fields=['last_name', 'first_name', 'id'], name='customuser_name_idx'),
+        ]
+
     def __str__(self):
         return  self.first_name + " " + self.last_name
 
@@ -80,6 +95,11 @@ class Book(models.Model):
     isbn = models.PositiveIntegerField()
     category = models.CharField(max_length=50)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['isbn'], name='book_isbn_idx'),
+        ]
+
     def __str__(self):
         return str(self.name) + " ["+str(self.isbn)+']'
 
@@ -100,11 +120,61 @@ class Library(models.Model):
 
 def expiry():
     return datetime.today() + timedelta(days=14)
+
+
+class DaysBetween(models.Func):
+    """Whole days from the start date to the end date, computed by the database"""
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '  # PostgreSQL: date - date is an integer
+    output_field = models.IntegerField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='CAST(julianday(%(expressions)s) AS INTEGER)',
+                           arg_joiner=') - julianday(', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='DATEDIFF', template='%(function)s(%(expressions)s)',
+                           arg_joiner=', ', **extra_context)
+
+
+class IssuedBookManager(models.Manager):
+    def with_details(self, today):
+        """Loans with their book and student names, days overdue and fine as of
+        today, all from one query. student_id and isbn are free-text columns,
+        so they are matched by casting rather than through foreign keys; only
+        all-digit values are cast, since PostgreSQL rejects the rest outright."""
+        books = Book.objects.filter(isbn=OuterRef('isbn_number'))
+        students = Student.objects.filter(id=OuterRef('student_number')).annotate(
+            full_name=Concat('admin__last_name', Value(', '), 'admin__first_name'))
+        days_overdue = Greatest(DaysBetween(Value(today, output_field=models.DateField()), 'expiry_date'), Value(0))
+        return self.annotate(
+            isbn_number=Case(When(isbn__regex=r'^[0-9]{1,13}$', then=Cast('isbn', models.BigIntegerField()))),
+            # Nine digits always fit an integer column
+            student_number=Case(When(student_id__regex=r'^[0-9]{1,9}$',
+                                     then=Cast('student_id', models.IntegerField()))),
+        ).annotate(
+            book_name=Subquery(books.values('name')[:1]),
+            student_name=Subquery(students.values('full_name')[:1]),
+            days_overdue=days_overdue,
+            fine=days_overdue * Value(getattr(settings, 'LIBRARY_FINE_PER_DAY', 5)),
+        )
+
+
 class IssuedBook(models.Model):
     student_id = models.CharField(max_length=100, blank=True) 
     isbn = models.CharField(max_length=13)
     issued_date = models.DateField(auto_now=True)
     expiry_date = models.DateField(default=expiry)
+    objects = IssuedBookManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['isbn'], name='issuedbook_isbn_idx'),
+            models.Index(fields=['expiry_date', 'id'], name='issuedbook_expiry_idx'),
+        ]
 
 
 
@@ -134,6 +204,14 @@ class Attendance(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subject', 'session', 'date'], name='unique_attendance_register'),
+        ]
+        indexes = [
+            models.Index(fields=['subject', 'date'], name='attendance_subject_date_idx'),
+        ]
+
 
 class AttendanceReport(models.Model):
     student = models.ForeignKey(Student, on_delete=models.DO_NOTHING)
@@ -142,6 +220,67 @@ class AttendanceReport(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['attendance', 'student'], name='unique_attendance_report'),
+        ]
+        indexes = [
+            models.Index(fields=['student', 'status'], name='attendancereport_student_idx'),
+        ]
+
+
+class AttendanceSummaryManager(models.Manager):
+    def apply(self, subject_id, session_id, deltas):
+        """Add (present, absent) deltas, keyed by student id, to the counters"""
+        if not deltas:
+            return
+        self.bulk_create([
+            AttendanceSummary(student_id=student_id, subject_id=subject_id, session_id=session_id)
+            for student_id in deltas
+        ], ignore_conflicts=True)
+        # Students sharing a delta are moved together in one UPDATE
+        students_by_delta = defaultdict(list)
+        for student_id, delta in deltas.items():
+            if delta != (0, 0):
+                students_by_delta[delta].append(student_id)
+        now = timezone.now()
+        for (present, absent), student_ids in students_by_delta.items():
+            self.filter(subject_id=subject_id, session_id=session_id, student_id__in=student_ids).update(
+                present=F('present') + present, absent=F('absent') + absent, updated_at=now)
+
+    def rebuild(self, batch_size=1000):
+        """Recompute every counter from the raw attendance reports"""
+        totals = AttendanceReport.objects.values(
+            'student_id', 'attendance__subject_id', 'attendance__session_id').annotate(
+            present=Count('id', filter=Q(status=True)),
+            absent=Count('id', filter=Q(status=False))).order_by()
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create((
+                AttendanceSummary(student_id=row['student_id'], subject_id=row['attendance__subject_id'],
+                                  session_id=row['attendance__session_id'], present=row['present'], absent=row['absent'])
+                for row in totals.iterator()
+            ), batch_size=batch_size)
+        return self.count()
+
+
+class AttendanceSummary(models.Model):
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE)
+    present = models.IntegerField(default=0)
+    absent = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    objects = AttendanceSummaryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'subject', 'session'], name='unique_attendance_summary'),
+        ]
+
+    def __str__(self):
+        return str(self.student) + " - " + str(self.subject)
+
 
 class LeaveReportStudent(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
@@ -151,6 +290,11 @@ class LeaveReportStudent(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'student'], name='leavestudent_status_idx'),
+        ]
+
 
 class LeaveReportStaff(models.Model):
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE)
@@ -177,18 +321,114 @@ class FeedbackStaff(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
+class NotificationManager(models.Manager):
+    """Inbox queries shared by NotificationStaff and NotificationStudent, whose
+    recipient field is named by the model's RECIPIENT"""
+
+    def page(self, profile, cursor=None, limit=20):
+        """Newest-first notifications of profile following the keyset cursor
+        of a previous page, or the first page when the cursor is invalid;
+        returns (notifications, next page's cursor or None)"""
+        notifications = self.filter(**{self.model.RECIPIENT + '_id': profile.id})
+        try:
+            return keyset_page(notifications, ('-created_at', '-id'), cursor, limit)
+        except ValueError:
+            return keyset_page(notifications, ('-created_at', '-id'), None, limit)
+
+    def mark_read(self, profile, notifications):
+        """Flag the unread ones among profile's notifications as read, in one UPDATE"""
+        unread = [notification.id for notification in notifications if not notification.is_read]
+        if not unread:
+            return 0
+        updated = self.filter(id__in=unread, is_read=False, **{self.model.RECIPIENT + '_id': profile.id}).update(
+            is_read=True)
+        adjust_unread_counts([profile.admin_id], -updated)
+        return updated
+
+
 class NotificationStaff(models.Model):
+    RECIPIENT = 'staff'
+
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE)
     message = models.TextField()
+    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    objects = NotificationManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['staff', '-created_at', '-id'], name='notifstaff_inbox_idx'),
+            models.Index(fields=['created_at'], name='notifstaff_created_idx'),
+        ]
 
 
 class NotificationStudent(models.Model):
+    RECIPIENT = 'student'
+
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     message = models.TextField()
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    objects = NotificationManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', '-created_at', '-id'], name='notifstudent_inbox_idx'),
+            models.Index(fields=['created_at'], name='notifstudent_created_idx'),
+        ]
+
+
+class ArchivedNotification(models.Model):
+    """Staff and student notifications moved out of the inboxes by archive_notifications"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    message = models.TextField()
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+class PushNotificationManager(models.Manager):
+    def enqueue(self, user_ids, body, click_action, title="Student Management System"):
+        """Queue one push per user with an FCM token for the send_push_notifications worker"""
+        user_ids = list(user_ids)
+        with_token = []
+        for start in range(0, len(user_ids), 1000):
+            with_token.extend(CustomUser.objects.filter(id__in=user_ids[start:start + 1000]).exclude(
+                fcm_token='').values_list('id', flat=True))
+        now = timezone.now()
+        return self.bulk_create([
+            PushNotification(user_id=user_id, title=title, body=body, click_action=click_action, next_attempt_at=now)
+            for user_id in with_token
+        ], batch_size=1000)
+
+
+class PushNotification(models.Model):
+    """Outbox of Firebase push messages, drained by send_push_notifications"""
+    PENDING = 0
+    SENDING = 1
+    SENT = 2
+    FAILED = -1
+    STATUS = ((PENDING, "Pending"), (SENDING, "Sending"), (SENT, "Sent"), (FAILED, "Failed"))
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    title = models.CharField(max_length=120)
+    body = models.TextField()
+    click_action = models.CharField(max_length=200)
+    status = models.SmallIntegerField(default=PENDING, choices=STATUS)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=200, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    objects = PushNotificationManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='push_due_idx'),
+        ]
 
 
 class StudentResult(models.Model):
@@ -199,6 +439,112 @@ class StudentResult(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'subject'], name='unique_student_result'),
+        ]
+
+
+class PrivateStorage(FileSystemStorage):
+    """Files under PRIVATE_ROOT, outside MEDIA_ROOT, with no public URL; views
+    that check who is asking stream them instead"""
+
+    @property
+    def base_location(self):
+        return settings.PRIVATE_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def url(self, name):
+        raise ValueError("Private files have no URL")
+
+
+class ReportCardBatch(models.Model):
+    """Report cards of one course and session, zipped by generate_report_cards"""
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = -1
+    STATUS = ((PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed"))
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE)
+    requested_by = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.SmallIntegerField(default=PENDING, choices=STATUS)
+    total = models.PositiveIntegerField(default=0)
+    rendered = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to='report_cards/', storage=PrivateStorage(), blank=True)
+    error = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+# Profile model of each user type, and the relations worth joining in
+PROFILE_MODELS = {
+    '1': (Admin, ()),
+    '2': (Staff, ('course',)),
+    '3': (Student, ('course', 'session')),
+}
+
+
+def profile_cache_key(user_id):
+    return 'main_app:profile:%s' % user_id
+
+
+def load_profile(user):
+    """Return the Admin, Staff or Student row of a user with its course and
+    session joined in, or None. Kept in the cache for PROFILE_CACHE_TIMEOUT
+    seconds when that is set."""
+    if not user.is_authenticated or user.user_type not in PROFILE_MODELS:
+        return None
+    timeout = getattr(settings, 'PROFILE_CACHE_TIMEOUT', 0)
+    profile = cache.get(profile_cache_key(user.id)) if timeout else None
+    if profile is None:
+        model, related = PROFILE_MODELS[user.user_type]
+        profile = model.objects.select_related(*related).filter(admin_id=user.id).first()
+        if profile is None:
+            return None
+        if timeout:
+            cache.set(profile_cache_key(user.id), profile, timeout)
+    # The user is already loaded for this request; it is never cached
+    profile.admin = user
+    return profile
+
+
+NOTIFICATION_MODELS = {
+    '2': NotificationStaff,
+    '3': NotificationStudent,
+}
+
+
+def unread_count_cache_key(user_id):
+    return 'main_app:unread_notifications:%s' % user_id
+
+
+def unread_notification_count(user):
+    """Unread staff/student notifications of user, counted once and then kept
+    in the cache and adjusted as notifications are sent, read or archived"""
+    model = NOTIFICATION_MODELS.get(getattr(user, 'user_type', None))
+    if model is None or not user.is_authenticated:
+        return 0
+    key = unread_count_cache_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = model.objects.filter(**{model.RECIPIENT + '__admin_id': user.id}, is_read=False).count()
+        cache.set(key, count, getattr(settings, 'NOTIFICATION_COUNT_CACHE_TIMEOUT', 3600))
+    return count
+
+
+def adjust_unread_counts(user_ids, delta):
+    """Add delta to the cached counters of user_ids; uncached ones are counted when next needed"""
+    for user_id in user_ids:
+        try:
+            cache.incr(unread_count_cache_key(user_id), delta)
+        except ValueError:
+            pass
+
 
 @receiver(post_save, sender=CustomUser)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -221,3 +567,30 @@ def save_user_profile(sender, instance, **kwargs):
         instance.student.save()
 
 # todos
+
+
+@receiver(post_delete, sender=AttendanceReport)
+def remove_attendance_from_summary(sender, instance, **kwargs):
+    attendance = Attendance.objects.filter(id=instance.attendance_id).values('subject_id', 'session_id').first()
+    if attendance is None:
+        return
+    delta = (-1, 0) if instance.status else (0, -1)
+    AttendanceSummary.objects.apply(attendance['subject_id'], attendance['session_id'], {instance.student_id: delta})
+
+
+@receiver(post_save, sender=Admin)
+@receiver(post_save, sender=Staff)
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Admin)
+@receiver(post_delete, sender=Staff)
+@receiver(post_delete, sender=Student)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    if getattr(settings, 'PROFILE_CACHE_TIMEOUT', 0):
+        cache.delete(profile_cache_key(instance.admin_id))
+
+
+@receiver(post_save, sender=NotificationStaff)
+@receiver(post_save, sender=NotificationStudent)
+def count_unread_notification(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        adjust_unread_counts([getattr(instance, sender.RECIPIENT).admin_id], 1)
@@ -0,0 +1,71 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps the microseconds DjangoJSONEncoder drops; a truncated timestamp would skip rows"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, cls=CursorEncoder).encode()).decode()
+
+
+def decode_cursor(cursor, fields):
+    """Values of the row a page ended on, converted by the model fields they
+    were read from; raises ValueError when cursor was tampered with"""
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError("Invalid cursor")
+    try:
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _field(queryset, path):
+    """Model field (or annotation output field) an ordering path sorts on"""
+    if path in queryset.query.annotations:
+        return queryset.query.annotations[path].output_field
+    model = queryset.model
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _lookup(obj, path):
+    for name in path.split('__'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=50):
+    """One page of queryset sorted by ordering, which must end in a unique field
+    (prefix '-' for descending). Rows after cursor are found with a WHERE on
+    the sort key rather than an OFFSET, so every page costs the same; returns
+    (rows, cursor of the next page or None)."""
+    fields = [field.lstrip('-') for field in ordering]
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, [_field(queryset, field) for field in fields])
+        after = Q()
+        for i, field in enumerate(ordering):
+            lookup = '%s__%s' % (fields[i], 'lt' if field.startswith('-') else 'gt')
+            after |= Q(**dict(zip(fields[:i], values[:i])), **{lookup: values[i]})
+        # Implied by the OR above, but lets the database seek an index on the first field
+        bound = '%s__%s' % (fields[0], 'lte' if ordering[0].startswith('-') else 'gte')
+        queryset = queryset.filter(after, **{bound: values[0]})
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor([_lookup(rows[limit - 1], field) for field in fields])
@@ -0,0 +1,132 @@
+import datetime
+import json
+from itertools import groupby
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+from django.templatetags.static import static
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import PushNotification
+
+# FCM answers with these per-token errors when trying again later may work
+RETRYABLE_ERRORS = {'Unavailable', 'InternalServerError', 'DeviceMessageRateExceeded'}
+MAX_TOKENS_PER_REQUEST = 1000  # FCM's registration_ids limit
+
+
+class PushUnavailable(Exception):
+    """The whole FCM request failed; every message in it should be retried"""
+
+
+class FCMClient:
+    """Legacy FCM HTTP API over one pooled keep-alive session"""
+
+    def __init__(self):
+        if not getattr(settings, 'FCM_SERVER_KEY', ''):
+            raise ImproperlyConfigured("Set FCM_SERVER_KEY to send push notifications")
+        self.url = getattr(settings, 'FCM_URL', "https://fcm.googleapis.com/fcm/send")
+        self.timeout = getattr(settings, 'FCM_TIMEOUT', (3, 10))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=4))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=4))
+        self.session.headers.update({
+            'Authorization': 'key=' + settings.FCM_SERVER_KEY,
+            'Content-Type': 'application/json',
+        })
+
+    def send(self, tokens, title, body, click_action):
+        """Send one notification to many tokens; returns an error (or None) per token"""
+        payload = {
+            'notification': {
+                'title': title,
+                'body': body,
+                'click_action': click_action,
+                'icon': static('dist/img/AdminLTELogo.png'),
+            },
+            'registration_ids': tokens,
+        }
+        try:
+            response = self.session.post(self.url, data=json.dumps(payload), timeout=self.timeout)
+        except requests.RequestException as e:
+            raise PushUnavailable(str(e)) from e
+        if response.status_code >= 500:
+            raise PushUnavailable("FCM answered %d" % response.status_code)
+        if response.status_code != 200:
+            return ["HTTP %d" % response.status_code] * len(tokens)
+        try:
+            results = response.json()['results']
+        except (ValueError, KeyError) as e:
+            raise PushUnavailable("Unreadable FCM response") from e
+        return [result.get('error') for result in results]
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'PUSH_RETRY_DELAY', 30)
+    return datetime.timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def claim_due(batch_size):
+    """Mark up to batch_size due messages as being sent and return them"""
+    with transaction.atomic():
+        ids = list(PushNotification.objects.select_for_update(skip_locked=True).filter(
+            status=PushNotification.PENDING, next_attempt_at__lte=timezone.now()).order_by(
+            'next_attempt_at').values_list('id', flat=True)[:batch_size])
+        PushNotification.objects.filter(id__in=ids).update(
+            status=PushNotification.SENDING, attempts=F('attempts') + 1, updated_at=timezone.now())
+    return list(PushNotification.objects.filter(id__in=ids).select_related('user').order_by(
+        'title', 'body', 'click_action', 'id'))
+
+
+def release_stale(older_than=datetime.timedelta(minutes=10)):
+    """Put back messages claimed by a worker that died before recording them"""
+    return PushNotification.objects.filter(
+        status=PushNotification.SENDING, updated_at__lt=timezone.now() - older_than).update(
+        status=PushNotification.PENDING)
+
+
+def record(messages, errors):
+    """Store the outcome of each message; retryable failures are rescheduled"""
+    max_attempts = getattr(settings, 'PUSH_MAX_ATTEMPTS', 5)
+    now = timezone.now()
+    sent = []
+    for message, error in zip(messages, errors):
+        if error is None:
+            sent.append(message.id)
+            continue
+        message.last_error = error[:200]
+        if error in RETRYABLE_ERRORS and message.attempts < max_attempts:
+            message.status = PushNotification.PENDING
+            message.next_attempt_at = now + retry_delay(message.attempts)
+        else:
+            message.status = PushNotification.FAILED
+        message.updated_at = now
+    PushNotification.objects.filter(id__in=sent).update(
+        status=PushNotification.SENT, sent_at=now, last_error='', updated_at=now)
+    PushNotification.objects.bulk_update(
+        [message for message, error in zip(messages, errors) if error is not None],
+        ['status', 'next_attempt_at', 'last_error', 'updated_at'], batch_size=500)
+    return len(sent)
+
+
+def dispatch(client, batch_size=1000):
+    """Send one batch of due messages; returns (claimed, sent)"""
+    messages = claim_due(batch_size)
+    sent = 0
+    # Messages with the same content share one multicast request
+    for content, group in groupby(messages, key=lambda m: (m.title, m.body, m.click_action)):
+        group = list(group)
+        errors = [None if message.user.fcm_token else "No FCM token" for message in group]
+        deliverable = [message for message, error in zip(group, errors) if error is None]
+        for start in range(0, len(deliverable), MAX_TOKENS_PER_REQUEST):
+            chunk = deliverable[start:start + MAX_TOKENS_PER_REQUEST]
+            try:
+                results = client.send([message.user.fcm_token for message in chunk], *content)
+            except PushUnavailable:
+                results = ['Unavailable'] * len(chunk)
+            sent += record(chunk, results)
+        record([m for m, error in zip(group, errors) if error], [error for error in errors if error])
+    return len(messages), sent
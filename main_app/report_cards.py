@@ -0,0 +1,137 @@
+import datetime
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import AttendanceSummary, ReportCardBatch, Student, StudentResult, Subject
+
+
+def load_cards(course, session):
+    """Plain-data report card of every student of a course and session, from four queries"""
+    subjects = list(Subject.objects.filter(course=course).order_by('name', 'id').values_list('id', 'name'))
+    scores = {
+        (student_id, subject_id): (test, exam)
+        for student_id, subject_id, test, exam in StudentResult.objects.filter(
+            subject__course=course, student__course=course, student__session=session).values_list(
+            'student_id', 'subject_id', 'test', 'exam')
+    }
+    attendance = {
+        (student_id, subject_id): (present, absent)
+        for student_id, subject_id, present, absent in AttendanceSummary.objects.filter(
+            subject__course=course, session=session).values_list('student_id', 'subject_id', 'present', 'absent')
+    }
+    cards = []
+    for student_id, last_name, first_name, email in Student.objects.filter(course=course, session=session).order_by(
+            'admin__last_name', 'admin__first_name', 'id').values_list(
+            'id', 'admin__last_name', 'admin__first_name', 'admin__email'):
+        rows = []
+        for subject_id, subject in subjects:
+            test, exam = scores.get((student_id, subject_id), (None, None))
+            present, absent = attendance.get((student_id, subject_id), (0, 0))
+            rows.append({
+                'subject': subject, 'test': test, 'exam': exam, 'total': None if test is None else test + exam,
+                'present': present, 'held': present + absent,
+                'attendance': round(100 * present / (present + absent), 1) if present + absent else None,
+            })
+        totals = [row['total'] for row in rows if row['total'] is not None]
+        cards.append({
+            'id': student_id, 'name': last_name + " " + first_name, 'email': email,
+            'course': course.name, 'session': str(session), 'rows': rows,
+            'average': round(sum(totals) / len(totals), 2) if totals else None,
+        })
+    return cards
+
+
+def card_filename(card):
+    return "%s-%d.html" % (slugify(card['name']) or 'student', card['id'])
+
+
+@lru_cache(maxsize=None)
+def card_template():
+    # Compiled once per process; the loaders only cache templates when DEBUG is off
+    return get_template('main_app/report_card.html')
+
+
+def render_card(card):
+    """(file name, HTML) of one report card; runs in the worker processes"""
+    return card_filename(card), card_template().render({'card': card}).encode()
+
+
+def _setup_worker():
+    import django
+    django.setup()
+
+
+def render_cards(cards, workers=None):
+    """render_card() of each card in order, spread over a pool of processes"""
+    workers = workers or getattr(settings, 'REPORT_CARD_WORKERS', None) or os.cpu_count() or 1
+    if workers == 1 or len(cards) < 50:
+        yield from map(render_card, cards)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker) as pool:
+        yield from pool.map(render_card, cards, chunksize=max(len(cards) // (workers * 8), 1))
+
+
+def claim_next():
+    """Mark the oldest pending batch as running and return it, or None"""
+    with transaction.atomic():
+        batch = ReportCardBatch.objects.select_for_update(skip_locked=True).filter(
+            status=ReportCardBatch.PENDING).order_by('created_at', 'id').first()
+        if batch is not None:
+            batch.status = ReportCardBatch.RUNNING
+            batch.save(update_fields=['status', 'updated_at'])
+    return batch
+
+
+def release_stale(older_than=datetime.timedelta(minutes=10)):
+    """Queue again batches claimed by a worker that died while building them.
+    A live worker saves progress every 1% of cards, so it is never this quiet."""
+    return ReportCardBatch.objects.filter(
+        status=ReportCardBatch.RUNNING, updated_at__lt=timezone.now() - older_than).update(
+        status=ReportCardBatch.PENDING, rendered=0, updated_at=timezone.now())
+
+
+def build(batch, workers=None, progress=None):
+    """Render every card of the batch into one zip in private storage.
+
+    rendered is saved about every 1% of cards so the HOD page can show
+    progress; progress(rendered, total) is called at the same points.
+    """
+    batch = ReportCardBatch.objects.select_related('course', 'session').get(id=batch.id)
+    try:
+        cards = load_cards(batch.course, batch.session)
+        ReportCardBatch.objects.filter(id=batch.id).update(total=len(cards), rendered=0, updated_at=timezone.now())
+        step = max(len(cards) // 100, 1)
+        with tempfile.TemporaryFile() as tmp:
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as bundle:
+                bundle.writestr('index.html', render_to_string('main_app/report_card_index.html', {
+                    'cards': [(card_filename(card), card) for card in cards],
+                    'course': batch.course.name, 'session': str(batch.session)}))
+                for rendered, (name, html) in enumerate(render_cards(cards, workers), start=1):
+                    bundle.writestr(name, html)
+                    if rendered % step == 0 or rendered == len(cards):
+                        ReportCardBatch.objects.filter(id=batch.id).update(
+                            rendered=rendered, updated_at=timezone.now())
+                        if progress:
+                            progress(rendered, len(cards))
+            tmp.seek(0)
+            batch.file.save("report-cards-%s-%d-%d-%d.zip" % (
+                slugify(batch.course.name), batch.session.start_year.year, batch.session.end_year.year, batch.id),
+                File(tmp), save=False)
+    except Exception as e:
+        ReportCardBatch.objects.filter(id=batch.id).update(
+            status=ReportCardBatch.FAILED, error=str(e)[:200], updated_at=timezone.now())
+        raise
+    batch.status = ReportCardBatch.DONE
+    batch.total = batch.rendered = len(cards)
+    batch.save(update_fields=['status', 'total', 'rendered', 'file', 'updated_at'])
+    return batch
@@ -0,0 +1,43 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+# Column weights of the SQLite index: name, author, category, isbn
+SQLITE_WEIGHTS = (4.0, 2.0, 1.0, 8.0)
+POSTGRESQL_DOCUMENT = "to_tsvector('simple', name || ' ' || author || ' ' || category || ' ' || isbn::text)"
+
+
+def search_terms(query):
+    """Words of a user's query; punctuation and search operators are dropped"""
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+def search_books(query, page=1, per_page=20):
+    """Books matching every word of query (as a prefix), best match first.
+    Returns (books, has_next); an empty query lists the catalogue by name."""
+    terms = search_terms(query)
+    offset = (page - 1) * per_page
+    if not terms:
+        books = list(Book.objects.order_by('name', 'id')[offset:offset + per_page + 1])
+    elif connection.vendor == 'sqlite':
+        books = list(Book.objects.raw(
+            "SELECT main_app_book.* FROM main_app_book_fts "
+            "JOIN main_app_book ON main_app_book.id = main_app_book_fts.rowid "
+            "WHERE main_app_book_fts MATCH %%s ORDER BY bm25(main_app_book_fts, %s), main_app_book.id "
+            "LIMIT %%s OFFSET %%s" % ", ".join(map(str, SQLITE_WEIGHTS)),
+            [" ".join('"%s"*' % term for term in terms), per_page + 1, offset]))
+    elif connection.vendor == 'postgresql':
+        books = list(Book.objects.raw(
+            "SELECT *, ts_rank({doc}, query) AS rank FROM main_app_book, to_tsquery('simple', %s) query "
+            "WHERE {doc} @@ query ORDER BY rank DESC, id LIMIT %s OFFSET %s".format(doc=POSTGRESQL_DOCUMENT),
+            [" & ".join(term + ":*" for term in terms), per_page + 1, offset]))
+    else:
+        matches = Q()
+        for term in terms:
+            matches &= (Q(name__icontains=term) | Q(author__icontains=term) | Q(category__icontains=term) |
+                        Q(isbn__startswith=term))
+        books = list(Book.objects.filter(matches).order_by('name', 'id')[offset:offset + per_page + 1])
+    return books[:per_page], len(books) > per_page
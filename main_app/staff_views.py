@@ -1,31 +1,34 @@
+import csv
+import io
 import json
 
 from django.contrib import messages
 from django.core.files.storage import FileSystemStorage
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import Count
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import (HttpResponseRedirect, get_object_or_404,redirect, render)
 from django.urls import reverse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
 from .forms import *
+from .middleware import get_profile_or_404
+from .pagination import keyset_page
 from .models import *
 from . import forms, models
-from datetime import date
 
 def staff_home(request):
-    staff = get_object_or_404(Staff, admin=request.user)
+    staff = get_profile_or_404(request, Staff)
     total_students = Student.objects.filter(course=staff.course).count()
     total_leave = LeaveReportStaff.objects.filter(staff=staff).count()
-    subjects = Subject.objects.filter(staff=staff)
-    total_subject = subjects.count()
-    attendance_list = Attendance.objects.filter(subject__in=subjects)
-    total_attendance = attendance_list.count()
-    attendance_list = []
-    subject_list = []
-    for subject in subjects:
-        attendance_count = Attendance.objects.filter(subject=subject).count()
-        subject_list.append(subject.name)
-        attendance_list.append(attendance_count)
+    subjects = Subject.objects.filter(staff=staff).annotate(
+        attendance_count=Count('attendance')).values_list('name', 'attendance_count')
+    total_subject = len(subjects)
+    subject_list = [name for name, _ in subjects]
+    attendance_list = [attendance_count for _, attendance_count in subjects]
+    total_attendance = sum(attendance_list)
     context = {
         'page_title': 'Staff Panel - ' + str(staff.admin.first_name) + ' ' + str(staff.admin.last_name[0]) + '' + ' (' + str(staff.course) + ')',
         'total_students': total_students,
@@ -39,7 +42,7 @@ def staff_home(request):
 
 
 def staff_take_attendance(request):
-    staff = get_object_or_404(Staff, admin=request.user)
+    staff = get_profile_or_404(request, Staff)
     subjects = Subject.objects.filter(staff_id=staff)
     sessions = Session.objects.all()
     context = {
@@ -72,31 +75,108 @@ def get_students(request):
         return e
 
 
+def _parse_attendance_statuses(student_data):
+    """Map each posted student id to its status, collecting per-student errors"""
+    statuses = {}
+    errors = []
+    if not isinstance(student_data, list):
+        return statuses, [{'id': None, 'error': "Send the students as a JSON list of {id, status}"}]
+    for student_dict in student_data:
+        raw_id = student_dict.get('id') if isinstance(student_dict, dict) else None
+        try:
+            student_id = int(raw_id)
+            status = bool(int(student_dict.get('status') or 0))
+        except (TypeError, ValueError, OverflowError):
+            # Only echo ids that stay valid JSON (an overflowing 1e400 would come back as Infinity)
+            errors.append({'id': raw_id if isinstance(raw_id, (str, int)) else None,
+                           'error': "Invalid student id or status"})
+            continue
+        if student_id in statuses:
+            errors.append({'id': raw_id, 'error': "Student listed more than once"})
+            continue
+        statuses[student_id] = status
+    return statuses, errors
+
+
+def _write_attendance_statuses(attendance, statuses, existing):
+    """Insert missing reports and flip changed ones; returns the number of students written.
+
+    statuses maps student id to the posted status, existing maps student id
+    to the (report id, status) already stored for this attendance.
+    """
+    new_reports = []
+    now_present = []
+    now_absent = []
+    deltas = {}
+    for student_id, status in statuses.items():
+        if student_id not in existing:
+            new_reports.append(AttendanceReport(student_id=student_id, attendance=attendance, status=status))
+            deltas[student_id] = (1, 0) if status else (0, 1)
+            continue
+        report_id, current = existing[student_id]
+        if current == status:
+            continue
+        if status:
+            now_present.append(report_id)
+            deltas[student_id] = (1, -1)
+        else:
+            now_absent.append(report_id)
+            deltas[student_id] = (-1, 1)
+    AttendanceReport.objects.bulk_create(new_reports)
+    now = timezone.now()
+    if now_present:
+        AttendanceReport.objects.filter(id__in=now_present).update(status=True, updated_at=now)
+    if now_absent:
+        AttendanceReport.objects.filter(id__in=now_absent).update(status=False, updated_at=now)
+    AttendanceSummary.objects.apply(attendance.subject_id, attendance.session_id, deltas)
+    return len(deltas)
+
+
 @csrf_exempt
 def save_attendance(request):
     student_data = request.POST.get('student_ids')
     date = request.POST.get('date')
     subject_id = request.POST.get('subject')
     session_id = request.POST.get('session')
-    students = json.loads(student_data)
     try:
-        session = get_object_or_404(Session, id=session_id)
-        subject = get_object_or_404(Subject, id=subject_id)
-        attendance = Attendance(session=session, subject=subject, date=date)
-        attendance.save()
+        students = json.loads(student_data)
+        session = Session.objects.get(id=session_id)
+        subject = Subject.objects.get(id=subject_id)
+    except (TypeError, ValueError, Session.DoesNotExist, Subject.DoesNotExist):
+        return JsonResponse({'errors': [{'id': None, 'error': "Invalid subject, session or student list"}]}, status=400)
+
+    statuses, errors = _parse_attendance_statuses(students)
+    # One query validates the whole register against the subject's roster
+    roster = set(Student.objects.filter(
+        id__in=statuses, course_id=subject.course_id, session=session).values_list('id', flat=True))
+    for student_id in statuses.keys() - roster:
+        errors.append({'id': student_id, 'error': "Student is not enrolled in this subject's course and session"})
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
 
-        for student_dict in students:
-            student = get_object_or_404(Student, id=student_dict.get('id'))
-            attendance_report = AttendanceReport(student=student, attendance=attendance, status=student_dict.get('status'))
-            attendance_report.save()
-    except Exception as e:
-        return None
+    try:
+        with transaction.atomic():
+            # Re-posting a register (double clicks, retries) updates it in place
+            attendance, created = Attendance.objects.get_or_create(session=session, subject=subject, date=date)
+            attendance = Attendance.objects.select_for_update().get(id=attendance.id)
+            existing = {}
+            if not created:
+                existing = {
+                    student_id: (report_id, status)
+                    for report_id, student_id, status in AttendanceReport.objects.filter(
+                        attendance=attendance).values_list('id', 'student_id', 'status')
+                }
+            _write_attendance_statuses(attendance, statuses, existing)
+    except ValidationError as e:
+        return JsonResponse({'errors': [{'id': None, 'error': ' '.join(e.messages)}]}, status=400)
+    except DatabaseError as e:
+        return JsonResponse({'errors': [{'id': None, 'error': str(e)}]}, status=400)
 
     return HttpResponse("OK")
 
 
 def staff_update_attendance(request):
-    staff = get_object_or_404(Staff, admin=request.user)
+    staff = get_profile_or_404(request, Staff)
     subjects = Subject.objects.filter(staff_id=staff)
     sessions = Session.objects.all()
     context = {
@@ -129,25 +209,37 @@ def get_student_attendance(request):
 def update_attendance(request):
     student_data = request.POST.get('student_ids')
     date = request.POST.get('date')
-    students = json.loads(student_data)
     try:
-        attendance = get_object_or_404(Attendance, id=date)
-
-        for student_dict in students:
-            student = get_object_or_404(
-                Student, admin_id=student_dict.get('id'))
-            attendance_report = get_object_or_404(AttendanceReport, student=student, attendance=attendance)
-            attendance_report.status = student_dict.get('status')
-            attendance_report.save()
-    except Exception as e:
-        return None
+        students = json.loads(student_data)
+        attendance = Attendance.objects.get(id=date)
+    except (TypeError, ValueError, Attendance.DoesNotExist):
+        return JsonResponse({'errors': [{'id': None, 'error': "Invalid attendance date or student list"}]}, status=400)
+
+    # Posted ids are the students' user ids, as served by get_student_attendance
+    statuses, errors = _parse_attendance_statuses(students)
+    reports = {
+        admin_id: (student_id, (report_id, status))
+        for report_id, student_id, admin_id, status in AttendanceReport.objects.filter(
+            attendance=attendance, student__admin_id__in=statuses).values_list(
+            'id', 'student_id', 'student__admin_id', 'status')
+    }
+    for admin_id in statuses.keys() - reports.keys():
+        errors.append({'id': admin_id, 'error': "Student has no record in this attendance"})
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
 
-    return HttpResponse("OK")
+    with transaction.atomic():
+        updated = _write_attendance_statuses(
+            attendance,
+            {reports[admin_id][0]: status for admin_id, status in statuses.items()},
+            dict(reports.values()))
+
+    return JsonResponse({'updated': updated})
 
 
 def staff_apply_leave(request):
     form = LeaveReportStaffForm(request.POST or None)
-    staff = get_object_or_404(Staff, admin_id=request.user.id)
+    staff = get_profile_or_404(request, Staff)
     context = {
         'form': form,
         'leave_history': LeaveReportStaff.objects.filter(staff=staff),
@@ -171,7 +263,7 @@ def staff_apply_leave(request):
 
 def staff_feedback(request):
     form = FeedbackStaffForm(request.POST or None)
-    staff = get_object_or_404(Staff, admin_id=request.user.id)
+    staff = get_profile_or_404(request, Staff)
     context = {
         'form': form,
         'feedbacks': FeedbackStaff.objects.filter(staff=staff),
@@ -193,7 +285,7 @@ def staff_feedback(request):
 
 
 def staff_view_profile(request):
-    staff = get_object_or_404(Staff, admin=request.user)
+    staff = get_profile_or_404(request, Staff)
     form = StaffEditForm(request.POST or None, request.FILES or None,instance=staff)
     context = {'form': form, 'page_title': 'View/Update Profile'}
     if request.method == 'POST':
@@ -245,17 +337,19 @@ def staff_fcmtoken(request):
 
 
 def staff_view_notification(request):
-    staff = get_object_or_404(Staff, admin=request.user)
-    notifications = NotificationStaff.objects.filter(staff=staff)
+    staff = get_profile_or_404(request, Staff)
+    notifications, next_cursor = NotificationStaff.objects.page(staff, request.GET.get('after'))
+    NotificationStaff.objects.mark_read(staff, notifications)
     context = {
         'notifications': notifications,
+        'next_cursor': next_cursor,
         'page_title': "View Notifications"
     }
     return render(request, "staff_template/staff_view_notification.html", context)
 
 
 def staff_add_result(request):
-    staff = get_object_or_404(Staff, admin=request.user)
+    staff = get_profile_or_404(request, Staff)
     subjects = Subject.objects.filter(staff=staff)
     sessions = Session.objects.all()
     context = {
@@ -263,27 +357,7 @@ def staff_add_result(request):
         'subjects': subjects,
         'sessions': sessions
     }
-    if request.method == 'POST':
-        try:
-            student_id = request.POST.get('student_list')
-            subject_id = request.POST.get('subject')
-            test = request.POST.get('test')
-            exam = request.POST.get('exam')
-            student = get_object_or_404(Student, id=student_id)
-            subject = get_object_or_404(Subject, id=subject_id)
-            try:
-                data = StudentResult.objects.get(
-                    student=student, subject=subject)
-                data.exam = exam
-                data.test = test
-                data.save()
-                messages.success(request, "Scores Updated")
-            except:
-                result = StudentResult(student=student, subject=subject, test=test, exam=exam)
-                result.save()
-                messages.success(request, "Scores Saved")
-        except Exception as e:
-            messages.warning(request, "Error Occured While Processing Form")
+    # Scores are saved by save_results, which validates them against MAX_SCORES and the roster
     return render(request, "staff_template/staff_add_result.html", context)
 
 
@@ -303,6 +377,148 @@ def fetch_student_result(request):
     except Exception as e:
         return HttpResponse('False')
 
+MAX_SCORES = {'test': 40, 'exam': 60}
+
+
+@csrf_exempt
+def get_result_sheet(request):
+    """The subject's roster with any scores already entered, for the grid"""
+    staff = get_profile_or_404(request, Staff)
+    try:
+        subject = Subject.objects.get(id=request.POST.get('subject'), staff=staff)
+        session = Session.objects.get(id=request.POST.get('session'))
+    except (ValueError, Subject.DoesNotExist, Session.DoesNotExist):
+        return JsonResponse({'errors': [{'id': None, 'error': "Invalid subject or session"}]}, status=400)
+    students = list(Student.objects.filter(course_id=subject.course_id, session=session).order_by(
+        'admin__last_name', 'admin__first_name', 'id').values_list(
+        'id', 'admin__last_name', 'admin__first_name', 'admin__email'))
+    scores = {
+        student_id: (test, exam)
+        for student_id, test, exam in StudentResult.objects.filter(
+            subject=subject, student__course_id=subject.course_id, student__session=session).values_list(
+            'student_id', 'test', 'exam')
+    }
+    return JsonResponse({'students': [
+        dict(zip(('id', 'name', 'email', 'test', 'exam'),
+                 (student_id, last_name + " " + first_name, email) + scores.get(student_id, (None, None))))
+        for student_id, last_name, first_name, email in students
+    ]})
+
+
+def _read_score_csv(upload):
+    """Rows of an uploaded score sheet with student_id (or email), test and exam columns"""
+    reader = csv.DictReader(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''))
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+    if not {'test', 'exam'} <= set(reader.fieldnames) or not {'student_id', 'email'} & set(reader.fieldnames):
+        raise ValueError("CSV needs student_id (or email), test and exam columns")
+    return [
+        {'id': row.get('student_id') or None, 'email': (row.get('email') or '').strip(),
+         'test': row['test'], 'exam': row['exam']}
+        for row in reader if any(row.values())
+    ]
+
+
+def _parse_scores(rows):
+    """Map each posted student id to its (test, exam) scores, collecting per-student errors"""
+    scores = {}
+    errors = []
+    for row in rows:
+        raw_id = row.get('id') if isinstance(row, dict) else None
+        try:
+            student_id = int(raw_id)
+        except (TypeError, ValueError, OverflowError):
+            # Only echo ids that stay valid JSON, as for attendance
+            errors.append({'id': raw_id if isinstance(raw_id, (str, int)) else None, 'error': "Invalid student id"})
+            continue
+        if student_id in scores:
+            errors.append({'id': raw_id, 'error': "Student listed more than once"})
+            continue
+        try:
+            test, exam = float(row.get('test')), float(row.get('exam'))
+        except (TypeError, ValueError):
+            errors.append({'id': raw_id, 'error': "Test and exam scores must be numbers"})
+            continue
+        if not (0 <= test <= MAX_SCORES['test'] and 0 <= exam <= MAX_SCORES['exam']):
+            errors.append({'id': raw_id, 'error': "Test must be 0-%(test)d and exam 0-%(exam)d" % MAX_SCORES})
+            continue
+        scores[student_id] = (test, exam)
+    return scores, errors
+
+
+def _write_results(subject, scores):
+    """Insert missing results and update changed ones; returns (created, updated)"""
+    existing = {
+        result.student_id: result
+        for result in StudentResult.objects.select_for_update().filter(subject=subject, student_id__in=scores)
+    }
+    now = timezone.now()
+    new_results = []
+    changed = []
+    for student_id, (test, exam) in scores.items():
+        result = existing.get(student_id)
+        if result is None:
+            new_results.append(StudentResult(student_id=student_id, subject=subject, test=test, exam=exam))
+        elif (result.test, result.exam) != (test, exam):
+            result.test, result.exam, result.updated_at = test, exam, now
+            changed.append(result)
+    StudentResult.objects.bulk_create(new_results, batch_size=500)
+    StudentResult.objects.bulk_update(changed, ['test', 'exam', 'updated_at'], batch_size=500)
+    return len(new_results), len(changed)
+
+
+def save_results(request):
+    """Save a whole subject's scores at once, posted as a JSON list of
+    {id, test, exam} in "results" or as an uploaded CSV "file".
+    Nothing is written unless every row is valid."""
+    staff = get_profile_or_404(request, Staff)
+    if request.method != 'POST':
+        return JsonResponse({'errors': [{'id': None, 'error': "POST required"}]}, status=405)
+    try:
+        subject = Subject.objects.get(id=request.POST.get('subject'), staff=staff)
+        session = Session.objects.get(id=request.POST.get('session'))
+    except (ValueError, Subject.DoesNotExist, Session.DoesNotExist):
+        return JsonResponse({'errors': [{'id': None, 'error': "Invalid subject or session"}]}, status=400)
+    try:
+        if 'file' in request.FILES:
+            rows = _read_score_csv(request.FILES['file'])
+        else:
+            rows = json.loads(request.POST.get('results') or 'null')
+            if not isinstance(rows, list):
+                raise ValueError("Send results as a JSON list of {id, test, exam}")
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return JsonResponse({'errors': [{'id': None, 'error': str(e)}]}, status=400)
+
+    # One query validates the whole sheet against the subject's roster
+    roster = {
+        email.lower(): student_id
+        for email, student_id in Student.objects.filter(
+            course_id=subject.course_id, session=session).values_list('admin__email', 'id')
+    }
+    # CSV rows may name the student by email instead of id
+    resolved = []
+    errors = []
+    for row in rows:
+        if isinstance(row, dict) and row.get('id') is None and row.get('email'):
+            if row['email'].lower() not in roster:
+                errors.append({'id': row['email'], 'error': "Student is not enrolled in this subject's course and session"})
+                continue
+            row = dict(row, id=roster[row['email'].lower()])
+        resolved.append(row)
+    scores, parse_errors = _parse_scores(resolved)
+    errors += parse_errors
+    for student_id in scores.keys() - set(roster.values()):
+        errors.append({'id': student_id, 'error': "Student is not enrolled in this subject's course and session"})
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    try:
+        with transaction.atomic():
+            created, updated = _write_results(subject, scores)
+    except DatabaseError as e:
+        return JsonResponse({'errors': [{'id': None, 'error': str(e)}]}, status=400)
+    return JsonResponse({'created': created, 'updated': updated})
+
+
 #library
 def add_book(request):
     if request.method == "POST":
@@ -338,20 +554,21 @@ def issue_book(request):
     return render(request, "staff_template/issue_book.html", {'form':form})
 
 def view_issued_book(request):
-    issuedBooks = IssuedBook.objects.all()
-    details = []
-    for i in issuedBooks:
-        days = (date.today()-i.issued_date)
-        d=days.days
-        fine=0
-        if d>14:
-            day=d-14
-            fine=day*5
-        books = list(models.Book.objects.filter(isbn=i.isbn))
-        # students = list(models.Student.objects.filter(admin=i.admin))
-        i=0
-        for l in books:
-            t=(books[i].name,books[i].isbn,issuedBooks[0].issued_date,issuedBooks[0].expiry_date,fine)
-            i=i+1
-            details.append(t)
-    return render(request, "staff_template/view_issued_book.html", {'issuedBooks':issuedBooks, 'details':details})
\ No newline at end of file
+    today = timezone.localdate()
+    overdue = request.GET.get('overdue') == '1'
+    loans = IssuedBook.objects.with_details(today)
+    if overdue:
+        loans = loans.filter(expiry_date__lt=today)
+    # Soonest due (or longest overdue) first
+    try:
+        issued_books, next_cursor = keyset_page(loans, ('expiry_date', 'id'), request.GET.get('after'), 50)
+    except ValueError:
+        issued_books, next_cursor = keyset_page(loans, ('expiry_date', 'id'), None, 50)
+    context = {
+        'issuedBooks': issued_books,
+        'next_cursor': next_cursor,
+        'overdue': overdue,
+        'page_query': 'overdue=1' if overdue else '',
+        'page_title': "Issued Books",
+    }
+    return render(request, "staff_template/view_issued_book.html", context)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from .models import Course, CustomUser, Session, Student
+
+COLUMNS = ('email', 'first_name', 'last_name', 'gender', 'address', 'password', 'course', 'session')
+REQUIRED = ('email', 'first_name', 'last_name', 'gender', 'password', 'course', 'session')
+
+
+class ImportFileError(Exception):
+    """The uploaded file cannot be read as a student sheet at all"""
+
+
+def read_rows(fp, filename):
+    """Rows of a .csv or .xlsx file as dicts keyed by the lower-cased header"""
+    if filename.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError("Reading .xlsx files needs openpyxl; upload a CSV instead")
+        try:
+            sheet = load_workbook(fp, read_only=True, data_only=True).active
+        except Exception as e:
+            raise ImportFileError("Not a readable .xlsx file: %s" % e)
+        values = sheet.iter_rows(values_only=True)
+        header = [str(cell or '').strip().lower() for cell in next(values, ())]
+        rows = ([('' if cell is None else str(cell)) for cell in row] for row in values)
+    else:
+        try:
+            reader = csv.reader(io.TextIOWrapper(fp, encoding='utf-8-sig', newline=''))
+            header = [cell.strip().lower() for cell in next(reader, [])]
+        except UnicodeDecodeError:
+            raise ImportFileError("CSV files must be UTF-8 encoded")
+        rows = reader
+    missing = [column for column in REQUIRED if column not in header]
+    if missing:
+        raise ImportFileError("Missing column(s): %s" % ", ".join(missing))
+    try:
+        return [dict(zip(header, (cell.strip() for cell in row))) for row in rows if any(row)]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ImportFileError("Unreadable CSV: %s" % e)
+
+
+def _session_key(session):
+    return '%d-%d' % (session.start_year.year, session.end_year.year)
+
+
+def validate_rows(rows):
+    """Check every row against the database in a few queries; returns
+    (valid rows with course_id/session_id resolved, [{'row': n, 'error': ...}]).
+    Row numbers count the header as row 1, like a spreadsheet."""
+    courses = {}
+    for course in Course.objects.all():
+        courses[str(course.id)] = courses[course.name.lower()] = course.id
+    sessions = {}
+    for session in Session.objects.all():
+        sessions[str(session.id)] = sessions[_session_key(session)] = session.id
+    emails = [CustomUser.objects.normalize_email(row.get('email', '')) for row in rows]
+    taken = set()
+    for start in range(0, len(emails), 500):
+        taken.update(CustomUser.objects.filter(email__in=emails[start:start + 500]).values_list('email', flat=True))
+
+    valid, errors, seen = [], [], set()
+    for number, (row, email) in enumerate(zip(rows, emails), start=2):
+        problems = ["%s is required" % column for column in REQUIRED if not row.get(column)]
+        if row.get('email'):
+            try:
+                validate_email(email)
+            except ValidationError:
+                problems.append("invalid email")
+            if email in taken:
+                problems.append("email already registered")
+            elif email.lower() in seen:
+                problems.append("email repeated in this file")
+            seen.add(email.lower())
+        gender = row.get('gender', '')[:1].upper()
+        if row.get('gender') and gender not in ('M', 'F'):
+            problems.append("gender must be M or F")
+        course_id = courses.get(row.get('course', '').lower())
+        if row.get('course') and course_id is None:
+            problems.append("unknown course %r" % row['course'])
+        session_id = sessions.get(row.get('session', ''))
+        if row.get('session') and session_id is None:
+            problems.append("unknown session %r (use its id or start-end years, e.g. 2021-2025)" % row['session'])
+        if problems:
+            errors.append({'row': number, 'email': row.get('email', ''), 'error': "; ".join(problems)})
+            continue
+        valid.append(dict(row, email=email, gender=gender, course_id=course_id, session_id=session_id))
+    return valid, errors
+
+
+def _setup_worker():
+    import django
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """make_password() for each password, spread over a pool of processes.
+    PBKDF2 is deliberately slow and holds the GIL, so threads would not help."""
+    workers = workers or getattr(settings, 'STUDENT_IMPORT_WORKERS', None) or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < 50:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(len(passwords) // (workers * 8), 1)))
+
+
+def create_students(rows, workers=None, batch_size=1000):
+    """Insert users and their Student profiles in bulk. bulk_create() skips the
+    post_save handlers, so the profile rows are inserted here directly."""
+    hashes = hash_passwords([row['password'] for row in rows], workers)
+    with transaction.atomic():
+        CustomUser.objects.bulk_create((
+            CustomUser(email=row['email'], password=password, user_type=3, first_name=row['first_name'],
+                       last_name=row['last_name'], gender=row['gender'], address=row.get('address', ''))
+            for row, password in zip(rows, hashes)
+        ), batch_size=batch_size)
+        user_ids = {}
+        emails = iter([row['email'] for row in rows])
+        while True:
+            chunk = list(islice(emails, 500))
+            if not chunk:
+                break
+            user_ids.update(CustomUser.objects.filter(email__in=chunk).values_list('email', 'id'))
+        Student.objects.bulk_create((
+            Student(admin_id=user_ids[row['email']], course_id=row['course_id'], session_id=row['session_id'])
+            for row in rows
+        ), batch_size=batch_size)
+    return len(rows)
+
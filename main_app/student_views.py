@@ -4,6 +4,7 @@ from datetime import datetime
 
 from django.contrib import messages
 from django.core.files.storage import FileSystemStorage
+from django.db.models import Sum
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import (HttpResponseRedirect, get_object_or_404,
                               redirect, render)
@@ -11,14 +12,21 @@ from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 from .forms import *
+from . import search
+from .middleware import get_profile_or_404
 from .models import *
 
 
 def student_home(request):
-    student = get_object_or_404(Student, admin=request.user)
-    total_subject = Subject.objects.filter(course=student.course).count()
-    total_attendance = AttendanceReport.objects.filter(student=student).count()
-    total_present = AttendanceReport.objects.filter(student=student, status=True).count()
+    student = get_profile_or_404(request, Student)
+    subjects = Subject.objects.filter(course=student.course)
+    total_subject = subjects.count()
+    summary = {
+        row['subject_id']: row for row in AttendanceSummary.objects.filter(student=student).values(
+            'subject_id').annotate(present=Sum('present'), absent=Sum('absent')).order_by()
+    }
+    total_present = sum(row['present'] for row in summary.values())
+    total_attendance = total_present + sum(row['absent'] for row in summary.values())
     if total_attendance == 0:  # Don't divide. DivisionByZero
         percent_absent = percent_present = 0
     else:
@@ -27,16 +35,11 @@ def student_home(request):
     subject_name = []
     data_present = []
     data_absent = []
-    subjects = Subject.objects.filter(course=student.course)
     for subject in subjects:
-        attendance = Attendance.objects.filter(subject=subject)
-        present_count = AttendanceReport.objects.filter(
-            attendance__in=attendance, status=True, student=student).count()
-        absent_count = AttendanceReport.objects.filter(
-            attendance__in=attendance, status=False, student=student).count()
+        counts = summary.get(subject.id, {})
         subject_name.append(subject.name)
-        data_present.append(present_count)
-        data_absent.append(absent_count)
+        data_present.append(counts.get('present', 0))
+        data_absent.append(counts.get('absent', 0))
     context = {
         'total_attendance': total_attendance,
         'percent_present': percent_present,
@@ -54,7 +57,7 @@ def student_home(request):
 
 @ csrf_exempt
 def student_view_attendance(request):
-    student = get_object_or_404(Student, admin=request.user)
+    student = get_profile_or_404(request, Student)
     if request.method != 'POST':
         course = get_object_or_404(Course, id=student.course.id)
         context = {
@@ -88,7 +91,7 @@ def student_view_attendance(request):
 
 def student_apply_leave(request):
     form = LeaveReportStudentForm(request.POST or None)
-    student = get_object_or_404(Student, admin_id=request.user.id)
+    student = get_profile_or_404(request, Student)
     context = {
         'form': form,
         'leave_history': LeaveReportStudent.objects.filter(student=student),
@@ -112,7 +115,7 @@ def student_apply_leave(request):
 
 def student_feedback(request):
     form = FeedbackStudentForm(request.POST or None)
-    student = get_object_or_404(Student, admin_id=request.user.id)
+    student = get_profile_or_404(request, Student)
     context = {
         'form': form,
         'feedbacks': FeedbackStudent.objects.filter(student=student),
@@ -136,7 +139,7 @@ def student_feedback(request):
 
 
 def student_view_profile(request):
-    student = get_object_or_404(Student, admin=request.user)
+    student = get_profile_or_404(request, Student)
     form = StudentEditForm(request.POST or None, request.FILES or None,
                            instance=student)
     context = {'form': form,
@@ -188,17 +191,19 @@ def student_fcmtoken(request):
 
 
 def student_view_notification(request):
-    student = get_object_or_404(Student, admin=request.user)
-    notifications = NotificationStudent.objects.filter(student=student)
+    student = get_profile_or_404(request, Student)
+    notifications, next_cursor = NotificationStudent.objects.page(student, request.GET.get('after'))
+    NotificationStudent.objects.mark_read(student, notifications)
     context = {
         'notifications': notifications,
+        'next_cursor': next_cursor,
         'page_title': "View Notifications"
     }
     return render(request, "student_template/student_view_notification.html", context)
 
 
 def student_view_result(request):
-    student = get_object_or_404(Student, admin=request.user)
+    student = get_profile_or_404(request, Student)
     results = StudentResult.objects.filter(student=student)
     context = {
         'results': results,
@@ -210,10 +215,22 @@ def student_view_result(request):
 #library
 
 def view_books(request):
-    books = Book.objects.all()
     context = {
-        'books': books,
         'page_title': "Library"
     }
     return render(request, "student_template/view_books.html", context)
 
+
+def search_books(request):
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    books, has_next = search.search_books(request.GET.get('q', ''), page)
+    return JsonResponse({
+        'results': [{'name': book.name, 'author': book.author, 'isbn': book.isbn, 'category': book.category}
+                    for book in books],
+        'page': page,
+        'has_next': has_next,
+    })
+
@@ -1,3 +1,1266 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count
+from django.http import Http404
+from django.template.base import Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import AnonymousUser
+from django.urls import URLPattern, get_resolver, resolve, reverse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .models import (Attendance, AttendanceReport, AttendanceSummary, Book, Course, CustomUser, FeedbackStaff,
+                     FeedbackStudent, IssuedBook, LeaveReportStaff, LeaveReportStudent, NotificationStaff,
+                     NotificationStudent, PushNotification, ReportCardBatch, Session, Staff, Student, StudentResult,
+                     Subject, unread_notification_count)
+from .analytics import analyse
+from .captcha import RecaptchaVerifier
+from .report_cards import build
+from .middleware import (LoginCheckMiddleWare, RequestInstrumentationMiddleware, SessionRefreshMiddleware,
+                         get_profile_or_404)
+from .pagination import encode_cursor
+from .push import PushUnavailable, dispatch, release_stale
+from .search import search_books
+from .student_import import create_students, validate_rows
+
+
+def seed_college(students=2000, subjects=20, days=20):
+    """Bulk-insert one course worth of users, registers and reports"""
+    course = Course.objects.create(name="Computer Science")
+    session = Session.objects.create(start_year=datetime.date(2020, 1, 1), end_year=datetime.date(2021, 1, 1))
+    teacher = CustomUser.objects.create_user(email="staff@college.test", password="staff", user_type=2)
+    CustomUser.objects.bulk_create([
+        CustomUser(email="student%d@college.test" % i, user_type=3, first_name="First%d" % i, last_name="Last%d" % i)
+        for i in range(students)
+    ])
+    Student.objects.bulk_create([
+        Student(admin_id=admin_id, course=course, session=session)
+        for admin_id in CustomUser.objects.filter(user_type=3).values_list('id', flat=True)
+    ])
+    Subject.objects.bulk_create([
+        Subject(name="Subject %d" % i, staff=teacher.staff, course=course) for i in range(subjects)
+    ])
+    start = datetime.date(2020, 2, 1)
+    Attendance.objects.bulk_create([
+        Attendance(session=session, subject_id=subject_id, date=start + datetime.timedelta(days=day))
+        for subject_id in Subject.objects.values_list('id', flat=True) for day in range(days)
+    ])
+    student_ids = list(Student.objects.values_list('id', flat=True))
+    # Every register gets a sample of the class to keep the suite quick
+    AttendanceReport.objects.bulk_create([
+        AttendanceReport(attendance_id=attendance_id, student_id=student_id, status=(attendance_id + student_id) % 4 != 0)
+        for attendance_id in Attendance.objects.values_list('id', flat=True)
+        for student_id in student_ids[attendance_id % 10::10]
+    ], batch_size=5000)
+    LeaveReportStudent.objects.bulk_create([
+        LeaveReportStudent(student_id=student_id, date="2020-03-01", message="Leave", status=student_id % 3 - 1)
+        for student_id in student_ids
+    ])
+    Book.objects.bulk_create([
+        Book(name="Book %d" % i, author="Author %d" % (i % 50), isbn=9780000000000 + i, category="General")
+        for i in range(2000)
+    ])
+    IssuedBook.objects.bulk_create([
+        IssuedBook(student_id=str(student_id), isbn=str(9780000000000 + student_id))
+        for student_id in student_ids
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return course, session
+
+
+@skipUnless(connection.vendor == 'sqlite', "Query plans are checked against SQLite")
+class HotQueryIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.session = seed_college()
+        cls.student = Student.objects.order_by('id')[100]
+        cls.subject = Subject.objects.order_by('id').first()
+
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        steps = [line for line in plan.splitlines() if re.search(r'\b%s\b' % table, line)]
+        self.assertTrue(steps, "%s is not read by:\n%s" % (table, plan))
+        for step in steps:
+            self.assertRegex(step, r'USING (COVERING |INTEGER PRIMARY KEY|INDEX)',
+                             "Full scan of %s:\n%s" % (table, plan))
+
+    def test_attendance_report_by_student_and_status(self):
+        self.assertUsesIndex(
+            AttendanceReport.objects.filter(student=self.student, status=True),
+            'main_app_attendancereport')
+
+    def test_attendance_by_subject_and_date(self):
+        self.assertUsesIndex(
+            Attendance.objects.filter(subject=self.subject,
+                                      date__range=(datetime.date(2020, 2, 1), datetime.date(2020, 2, 10))),
+            'main_app_attendance')
+
+    def test_approved_leave_per_student(self):
+        self.assertUsesIndex(
+            LeaveReportStudent.objects.filter(status=1).values('student_id').annotate(total=Count('id')).order_by(),
+            'main_app_leavereportstudent')
+
+    def test_users_by_type(self):
+        self.assertUsesIndex(CustomUser.objects.filter(user_type=2), 'main_app_customuser')
+
+    def test_issued_book_and_book_by_isbn(self):
+        self.assertUsesIndex(IssuedBook.objects.filter(isbn="9780000000101"), 'main_app_issuedbook')
+        self.assertUsesIndex(Book.objects.filter(isbn=9780000000101), 'main_app_book')
+
+    def test_notification_inbox_page(self):
+        self.assertUsesIndex(
+            NotificationStudent.objects.filter(student=self.student).order_by('-created_at', '-id')[:20],
+            'main_app_notificationstudent')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ListViewQueryCountTest(TestCase):
+    """HOD list pages cost the same number of queries however many rows they show"""
+    QUERIES = 3  # Session, user and the page's one joined query
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_college(students=120, subjects=60, days=1)
+        cls.hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+        staff = Staff.objects.get()
+        students = list(Student.objects.all())
+        LeaveReportStudent.objects.bulk_create([
+            LeaveReportStudent(student=student, date="2020-03-02", message="Leave", status=0) for student in students
+        ])
+        LeaveReportStaff.objects.bulk_create([
+            LeaveReportStaff(staff=staff, date="2020-03-01", message="Leave", status=i % 3 - 1) for i in range(120)
+        ])
+        FeedbackStudent.objects.bulk_create([
+            FeedbackStudent(student=student, feedback="Feedback", reply="" if i % 2 else "Noted")
+            for i, student in enumerate(students)
+        ])
+        FeedbackStaff.objects.bulk_create([
+            FeedbackStaff(staff=staff, feedback="Feedback", reply="" if i % 2 else "Noted") for i in range(120)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.hod)
+
+    def assertListQueries(self, name, context_key):
+        # The first request of a session also refreshes it; keep that out of the counts
+        self.client.get(reverse(name))
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get(reverse(name))
+        self.assertEqual(len(response.context[context_key]), 50)
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get(reverse(name), {'after': response.context['next_cursor']})
+        self.assertTrue(response.context[context_key])
+        return response
+
+    def test_manage_subject(self):
+        self.assertListQueries('manage_subject', 'subjects')
+
+    def test_student_leave_pending_first(self):
+        response = self.assertListQueries('view_student_leave', 'allLeave')
+        self.assertTrue(all(leave.status == 0 for leave in response.context['allLeave']))
+
+    def test_staff_leave_pending_first(self):
+        response = self.client.get(reverse('view_staff_leave'))
+        statuses = [leave.status for leave in response.context['allLeave']]
+        self.assertEqual(statuses, [0] * 40 + statuses[40:])
+        self.assertNotIn(0, statuses[40:])
+        self.assertListQueries('view_staff_leave', 'allLeave')
+
+    def test_student_feedback(self):
+        self.assertListQueries('student_feedback_message', 'feedbacks')
+
+    def test_staff_feedback(self):
+        self.assertListQueries('staff_feedback_message', 'feedbacks')
+
+    def test_tampered_cursor_shows_first_page(self):
+        first = self.client.get(reverse('view_student_leave'))
+        for values in ([0, "2024-13-99T00:00:00+00:00", 1], ["x", "2024-01-01T00:00:00+00:00", 1], "garbage"):
+            after = values if isinstance(values, str) else encode_cursor(values)
+            response = self.client.get(reverse('view_student_leave'), {'after': after})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['allLeave'], first.context['allLeave'])
+
+    def test_tampered_issued_book_cursor_shows_first_page(self):
+        self.client.force_login(Staff.objects.get().admin)
+        first = self.client.get(reverse('view_issued_book'))
+        for values in (["2024-13-99", 1], [{"a": 1}, 1], ["2024-01-01"]):
+            response = self.client.get(reverse('view_issued_book'), {'after': encode_cursor(values)})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['issuedBooks'], first.context['issuedBooks'])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminDashboardQueryCountTest(TestCase):
+    """The HOD dashboard costs the same number of queries however many students are enrolled"""
+    QUERIES = 12  # Session, user and the dashboard's ten counts and grouped totals
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.session = seed_college(students=10, subjects=2, days=2)
+        cls.hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+
+    def enrol(self, students):
+        """Add a course with its own subject, registers and leave to the college"""
+        course = Course.objects.create(name="Course %d" % Course.objects.count())
+        CustomUser.objects.bulk_create([
+            CustomUser(email="%s-%d@college.test" % (course.id, i), user_type=3, first_name="First%d" % i)
+            for i in range(students)
+        ])
+        Student.objects.bulk_create([
+            Student(admin_id=admin_id, course=course, session=self.session)
+            for admin_id in CustomUser.objects.filter(user_type=3, student__isnull=True).values_list('id', flat=True)
+        ])
+        subject = Subject.objects.create(name="Subject of %s" % course.name, staff=Staff.objects.get(), course=course)
+        attendance = Attendance.objects.create(session=self.session, subject=subject, date="2020-03-02")
+        enrolled = list(Student.objects.filter(course=course).values_list('id', flat=True))
+        AttendanceReport.objects.bulk_create([
+            AttendanceReport(attendance=attendance, student_id=student_id, status=True) for student_id in enrolled
+        ])
+        LeaveReportStudent.objects.bulk_create([
+            LeaveReportStudent(student_id=student_id, date="2020-03-03", message="Leave", status=1)
+            for student_id in enrolled
+        ])
+
+    def test_same_queries_at_two_enrolment_sizes(self):
+        self.client.force_login(self.hod)
+        # The first request of a session also refreshes it; keep that out of the counts
+        self.client.get(reverse('admin_home'))
+        with self.assertNumQueries(self.QUERIES):
+            small = self.client.get(reverse('admin_home'))
+        self.enrol(150)
+        self.enrol(150)
+        with self.assertNumQueries(self.QUERIES):
+            large = self.client.get(reverse('admin_home'))
+        self.assertEqual((small.context['total_students'], large.context['total_students']), (10, 310))
+        self.assertEqual(len(large.context['student_name_list']), 310)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+                   REQUEST_INSTRUMENTATION=True, REQUEST_INSTRUMENTATION_REPEAT_THRESHOLD=3)
+class RequestInstrumentationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_college(students=30, subjects=1, days=1)
+        cls.staff = Staff.objects.select_related('admin').get().admin
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_server_timing_header(self):
+        render = Template.render
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('staff_view_notification'))
+        timing = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries", tpl;dur=([\d.]+), view;dur=[\d.]+, '
+                              r'total;dur=[\d.]+', response['Server-Timing'])
+        self.assertIsNotNone(timing, response['Server-Timing'])
+        self.assertEqual(int(timing.group(1)), len(queries))
+        self.assertGreater(float(timing.group(2)), 0)
+        # Patched only while a request is measured
+        self.assertIs(Template.render, render)
+
+    def test_repeated_queries_are_logged(self):
+        attendance = Attendance.objects.get()
+        with self.assertLogs('main_app.instrumentation', 'WARNING') as logs:
+            self.client.post(reverse('get_student_attendance'), {'attendance_date_id': attendance.id})
+        event = json.loads(logs.records[0].getMessage())
+        self.assertEqual(event['event'], 'repeated_queries')
+        self.assertEqual(event['view'], 'main_app.staff_views.get_student_attendance')
+        # One student and one user lookup per report; the user shape also loads request.user
+        reports = attendance.attendancereport_set.count()
+        self.assertEqual(sorted(query['count'] for query in event['repeated']), [reports, reports + 1])
+
+    def test_pages_without_repeats_log_nothing(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('main_app.instrumentation', 'WARNING'):
+                self.client.get(reverse('staff_view_notification'))
+
+    @override_settings(REQUEST_INSTRUMENTATION=False)
+    def test_off_unless_enabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestInstrumentationMiddleware(lambda request: None)
+        self.assertNotIn('Server-Timing', self.client.get(reverse('staff_view_notification')))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BenchmarkViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        course, session = seed_college(students=30, subjects=3, days=2)
+        CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+        CustomUser.objects.filter(user_type=2).update(first_name="Staff", last_name="Member")
+        ReportCardBatch.objects.create(course=course, session=session)
+
+    def benchmark(self, *args):
+        output = os.path.join(tempfile.mkdtemp(), 'report.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        stderr = io.StringIO()
+        try:
+            call_command('benchmark_views', '--repeat=1', '--output', output, *args,
+                         stdout=io.StringIO(), stderr=stderr)
+        finally:
+            with open(output) as fp:
+                self.report = json.load(fp)
+        return stderr.getvalue()
+
+    def test_every_view_is_fetched(self):
+        self.benchmark()
+        self.assertEqual(self.report['failures'], [])
+        self.assertEqual(self.report['skipped'], {})
+        self.assertIn('download_report_cards', self.report['views'])
+        self.assertEqual(self.report['views']['admin_home']['status'], 200)
+
+    def test_instrumentation_overhead_is_reported(self):
+        self.benchmark('--instrumentation', '--view', 'admin_home', '--view', 'manage_subject')
+        for result in self.report['views'].values():
+            self.assertGreater(result['instrumented_seconds'], 0)
+            self.assertIn('instrumentation_overhead', result)
+
+    def test_budgeted_views_that_do_not_answer_200_fail(self):
+        # The benchmarked student is now a staff account, so student_home redirects it
+        CustomUser.objects.filter(student=Student.objects.order_by('id').first()).update(user_type=2)
+        with self.assertRaisesMessage(CommandError, "1 budget check(s) failed"):
+            self.benchmark('--view', 'student_home')
+        self.assertEqual(self.report['views']['student_home']['status'], 302)
+        self.assertEqual(self.report['failures'], ["student_home answered 302"])
+
+    def test_urls_without_rows_are_skipped_and_reported(self):
+        ReportCardBatch.objects.all().delete()
+        stderr = self.benchmark('--view', 'download_report_cards', '--view', 'admin_home')
+        self.assertEqual(list(self.report['views']), ['admin_home'])
+        self.assertEqual(self.report['skipped'], {'download_report_cards': ['batch_id']})
+        self.assertIn("skipped download_report_cards: no value for batch_id", stderr)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SessionRefreshTest(TestCase):
+    def session_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('student_view_notification')).status_code, 200)
+        return [query['sql'] for query in queries if re.match(r'(INSERT INTO|UPDATE) "django_session"', query['sql'])]
+
+    def test_session_is_written_once_per_refresh_interval(self):
+        user = CustomUser.objects.create_user(email="student@college.test", password="student", user_type=3)
+        self.client.force_login(user)
+        self.assertEqual(len(self.session_writes()), 1)  # Records when it was refreshed
+        self.assertEqual(self.session_writes(), [])
+        self.assertEqual(self.session_writes(), [])
+
+        session = self.client.session
+        session[SessionRefreshMiddleware.refreshed_key] -= 2 * 24 * 60 * 60
+        session.save()
+        stored = session.get_model_class().objects.filter(session_key=session.session_key)
+        expiry = stored.get().expire_date
+        writes = self.session_writes()
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE'))
+        self.assertGreater(stored.get().expire_date, expiry)
+        self.assertEqual(self.session_writes(), [])
+
+
+class PeopleTableTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.session = seed_college(students=20, subjects=1, days=0)
+        # Identical names, so only the admin_id tie-breaker orders them
+        CustomUser.objects.filter(user_type=3, email__startswith="student1").update(first_name="Ada", last_name="Twin")
+        cls.hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+
+    def setUp(self):
+        self.client.force_login(self.hod)
+
+    def pages(self, name, **params):
+        response = self.client.get(reverse(name), dict(params, length=4)).json()
+        total, rows = response['total'], response['results']
+        while response['next']:
+            response = self.client.get(reverse(name), dict(params, length=4, after=response['next'])).json()
+            self.assertNotIn('total', response)
+            rows += response['results']
+        self.assertEqual(len(rows), total)
+        return rows
+
+    def test_student_pages_are_stable_across_ties(self):
+        students = Student.objects.select_related('admin')
+        rows = self.pages('student_table')
+        self.assertEqual([row['id'] for row in rows], [student.id for student in students.order_by(
+            'admin__last_name', 'admin__first_name', 'admin_id')])
+        rows = self.pages('student_table', sort='name', order='desc')
+        self.assertEqual([row['id'] for row in rows], [student.id for student in students.order_by(
+            '-admin__last_name', '-admin__first_name', '-admin_id')])
+        rows = self.pages('student_table', sort='email', course=self.course.id, session=self.session.id)
+        self.assertEqual([row['email'] for row in rows], sorted(students.values_list('admin__email', flat=True)))
+        self.assertEqual(rows[0]['session'], str(self.session))
+
+    def test_search_and_filters(self):
+        self.assertEqual(len(self.pages('student_table', search='twin')), 11)
+        self.assertEqual(self.pages('student_table', course=self.course.id + 1), [])
+        self.assertEqual([row['email'] for row in self.pages('staff_table')], ["staff@college.test"])
+        self.assertEqual(self.client.get(reverse('student_table'), {'course': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('student_table'), {'after': 'garbage'}).status_code, 400)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProfileResolutionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_college(students=3, subjects=2, days=2)
+
+    def profile_queries(self, user, name):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+        table = user.student._meta.db_table if user.user_type == '3' else user.staff._meta.db_table
+        # Loads of the profile row itself, not joins through it such as the unread notification count
+        return [query['sql'] for query in queries
+                if query['sql'].startswith('SELECT "%s"."id"' % table) and '"%s"."admin_id" =' % table in query['sql']]
+
+    def test_views_resolve_the_profile_once(self):
+        student = Student.objects.select_related('admin').first()
+        self.assertEqual(len(self.profile_queries(student.admin, 'student_home')), 1)
+        self.assertEqual(len(self.profile_queries(student.admin, 'student_view_notification')), 1)
+        staff = Staff.objects.select_related('admin').get()
+        self.assertEqual(len(self.profile_queries(staff.admin, 'staff_view_notification')), 1)
+
+    def test_helper_loads_once_per_request(self):
+        request = RequestFactory().get('/')
+        request.user = Staff.objects.select_related('admin').get().admin
+        with self.assertNumQueries(1):
+            staff = get_profile_or_404(request, Staff)
+            self.assertIs(get_profile_or_404(request, Staff), staff)
+        with self.assertRaises(Http404):
+            get_profile_or_404(request, Student)
+
+
+class LoginCheckMiddlewareTest(TestCase):
+    # Paths each role may open; every other path below redirects to its home page
+    ALLOWED = {
+        'anonymous': {'login_page', 'user_login'},
+        '1': {'login_page', 'user_login', 'user_logout', 'admin_home', 'manage_student', 'staff_home',
+              'staff_add_result', 'edit_student_result'},
+        '2': {'login_page', 'user_login', 'user_logout', 'staff_home', 'staff_add_result', 'edit_student_result'},
+        '3': {'login_page', 'user_login', 'user_logout', 'student_home', 'student_view_notification'},
+    }
+    PATHS = ('login_page', 'user_login', 'user_logout', 'admin_home', 'manage_student', 'staff_home',
+             'staff_add_result', 'edit_student_result', 'student_home', 'student_view_notification')
+    HOMES = {'anonymous': 'login_page', '1': 'admin_home', '2': 'staff_home', '3': 'student_home'}
+
+    def setUp(self):
+        self.middleware = LoginCheckMiddleWare(lambda request: None)
+
+    def check(self, user, name):
+        request = RequestFactory().get(reverse(name))
+        request.user = user
+        return self.middleware.process_view(request, resolve(request.path).func, (), {})
+
+    def test_route_table(self):
+        users = {'anonymous': AnonymousUser()}
+        users.update((user_type, CustomUser(user_type=user_type)) for user_type in '123')
+        for role, user in users.items():
+            for name in self.PATHS:
+                with self.subTest(role=role, path=name):
+                    response = self.check(user, name)
+                    if name in self.ALLOWED[role]:
+                        self.assertIsNone(response)
+                    else:
+                        self.assertEqual(response.url, reverse(self.HOMES[role]))
+
+    def test_every_route_is_compiled_and_checked_without_queries(self):
+        views = [pattern.callback for pattern in get_resolver().url_patterns if isinstance(pattern, URLPattern)]
+        self.assertTrue(all(view in self.middleware.rules for view in views))
+        request = RequestFactory().get('/')
+        request.user = CustomUser(user_type='2')
+        with self.assertNumQueries(0):
+            for view in views:
+                self.middleware.process_view(request, view, (), {})
+
+    def test_benchmark_stays_within_budget(self):
+        out = io.StringIO()
+        call_command('benchmark_login_check', '--calls=50', '--budget-us=200', stdout=out)
+        self.assertIn('student', out.getvalue())
+
+
+class BroadcastTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+        cls.science, cls.arts = Course.objects.create(name="Science"), Course.objects.create(name="Arts")
+        cls.old = Session.objects.create(start_year=datetime.date(2019, 1, 1), end_year=datetime.date(2020, 1, 1))
+        cls.new = Session.objects.create(start_year=datetime.date(2020, 1, 1), end_year=datetime.date(2021, 1, 1))
+        cls.staff = {}
+        for course in (cls.science, cls.arts):
+            staff = CustomUser.objects.create_user(
+                email="staff-%s@college.test" % course.name, password="x", user_type=2).staff
+            Staff.objects.filter(id=staff.id).update(course=course)
+            cls.staff[course.name] = staff
+        cls.subject = Subject.objects.create(name="Physics", staff=cls.staff['Science'], course=cls.science)
+        cls.students = {}
+        for course in (cls.science, cls.arts):
+            for session in (cls.old, cls.new):
+                # Pushes only go to users with a device token; one Arts student has none
+                token = "" if (course, session) == (cls.arts, cls.old) else "token-%s-%d" % (course.name, session.id)
+                student = CustomUser.objects.create_user(
+                    email="%s-%d@college.test" % (course.name, session.id), password="x", user_type=3,
+                    fcm_token=token).student
+                Student.objects.filter(id=student.id).update(course=course, session=session)
+                cls.students[course.name, session] = student.id
+
+    def setUp(self):
+        self.client.force_login(self.hod)
+
+    def broadcast(self, audience, **filters):
+        return self.client.post(reverse('broadcast_notification'), dict(filters, audience=audience, message="Hello"))
+
+    def assertReaches(self, audience, profile_ids, **filters):
+        model = NotificationStudent if audience == 'student' else NotificationStaff
+        model.objects.all().delete()
+        self.assertEqual(self.broadcast(audience, **filters).json(), {'recipients': len(profile_ids)})
+        self.assertEqual(set(model.objects.values_list(model.RECIPIENT + '_id', flat=True)), set(profile_ids))
+
+    def test_students_by_course_session_and_subject(self):
+        students = self.students
+        self.assertReaches('student', students.values())
+        self.assertReaches('student', [students['Arts', self.old], students['Arts', self.new]], course_id=self.arts.id)
+        self.assertReaches('student', [students['Science', self.new], students['Arts', self.new]],
+                           session_id=self.new.id)
+        self.assertReaches('student', [students['Science', self.old], students['Science', self.new]],
+                           subject_id=self.subject.id)
+        self.assertReaches('student', [students['Science', self.old]], subject_id=self.subject.id,
+                           session_id=self.old.id)
+        self.assertReaches('student', [], subject_id=self.subject.id, course_id=self.arts.id)
+        self.assertEqual(PushNotification.objects.filter(user__user_type=3).count(), 3 + 1 + 2 + 2 + 1)
+
+    def test_staff_by_course_and_subject(self):
+        self.assertReaches('staff', [staff.id for staff in self.staff.values()])
+        self.assertReaches('staff', [self.staff['Arts'].id], course_id=self.arts.id)
+        self.assertReaches('staff', [self.staff['Science'].id], subject_id=self.subject.id)
+
+    def test_invalid_targets_are_rejected(self):
+        for audience, filters in (('staff', {'session_id': self.new.id}), ('hod', {}),
+                                  ('student', {'course_id': 'x'})):
+            response = self.broadcast(audience, **filters)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        self.assertFalse(PushNotification.objects.exists())
+
+
+class AttendanceRegisterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.session = seed_college(students=6, subjects=2, days=0)
+        cls.subject = Subject.objects.order_by('id').first()
+        cls.students = list(Student.objects.order_by('id'))
+
+    def setUp(self):
+        self.client.force_login(self.subject.staff.admin)
+
+    def save(self, statuses, date='2020-03-02'):
+        return self.client.post(reverse('save_attendance'), {
+            'subject': self.subject.id, 'session': self.session.id, 'date': date,
+            'student_ids': json.dumps([{'id': student_id, 'status': status} for student_id, status in statuses])})
+
+    def assertCountersMatchReports(self):
+        counters = {
+            row[:3]: row[3:] for row in AttendanceSummary.objects.values_list(
+                'student_id', 'subject_id', 'session_id', 'present', 'absent') if row[3:] != (0, 0)
+        }
+        AttendanceSummary.objects.rebuild()
+        self.assertEqual(counters, {
+            row[:3]: row[3:] for row in AttendanceSummary.objects.values_list(
+                'student_id', 'subject_id', 'session_id', 'present', 'absent')
+        })
+
+    def test_counters_follow_every_write_path(self):
+        statuses = [(student.id, student.id % 2) for student in self.students]
+        self.assertEqual(self.save(statuses).status_code, 200)
+        self.assertCountersMatchReports()
+        self.save(statuses)
+        self.assertCountersMatchReports()
+        self.save([(student_id, 1 - status) for student_id, status in statuses[:3]])
+        self.assertCountersMatchReports()
+        self.save(statuses, date='2020-03-03')
+        attendance = Attendance.objects.get(date='2020-03-03')
+        self.client.post(reverse('update_attendance'), {'date': attendance.id, 'student_ids': json.dumps([
+            {'id': student.admin_id, 'status': 1} for student in self.students])})
+        self.assertCountersMatchReports()
+        AttendanceReport.objects.filter(attendance=attendance, student=self.students[0]).get().delete()
+        self.assertCountersMatchReports()
+        summary = AttendanceSummary.objects.get(student=self.students[0], subject=self.subject)
+        self.assertEqual(summary.present + summary.absent, 1)
+
+    def test_invalid_register_is_rejected_with_an_error_per_student(self):
+        outsider = CustomUser.objects.create_user(email="outsider@college.test", password="x", user_type=3).student
+        response = self.save([(self.students[0].id, 1), ('abc', 1), (self.students[1].id, 'maybe'),
+                              (self.students[0].id, 0), (outsider.id, 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': [
+            {'id': 'abc', 'error': "Invalid student id or status"},
+            {'id': self.students[1].id, 'error': "Invalid student id or status"},
+            {'id': self.students[0].id, 'error': "Student listed more than once"},
+            {'id': outsider.id, 'error': "Student is not enrolled in this subject's course and session"},
+        ]})
+        self.assertFalse(Attendance.objects.filter(date='2020-03-02').exists())
+        response = self.client.post(reverse('save_attendance'), {
+            'subject': self.subject.id, 'session': self.session.id, 'date': '2020-03-02', 'student_ids': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['id'], None)
+
+    def test_malformed_payloads_are_rejected_not_crashed(self):
+        attendance = Attendance.objects.create(session=self.session, subject=self.subject, date='2020-03-09')
+        payloads = {
+            '[1]': [{'id': None, 'error': "Invalid student id or status"}],
+            '["x"]': [{'id': None, 'error': "Invalid student id or status"}],
+            '[{"id": 1e400, "status": 1}]': [{'id': None, 'error': "Invalid student id or status"}],
+            '[{"id": 1, "status": 1e400}]': [{'id': 1, 'error': "Invalid student id or status"}],
+            '5': [{'id': None, 'error': "Send the students as a JSON list of {id, status}"}],
+        }
+        for payload, errors in payloads.items():
+            for name, data in (('save_attendance', {'subject': self.subject.id, 'session': self.session.id,
+                                                    'date': '2020-03-02'}),
+                               ('update_attendance', {'date': attendance.id})):
+                with self.subTest(view=name, payload=payload):
+                    response = self.client.post(reverse(name), dict(data, student_ids=payload))
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json(), {'errors': errors})
+
+    def test_update_writes_only_changed_statuses(self):
+        self.save([(student.id, 1) for student in self.students])
+        attendance = Attendance.objects.get()
+        statuses = [{'id': student.admin_id, 'status': int(n >= 2)} for n, student in enumerate(self.students)]
+
+        def update(statuses):
+            return self.client.post(reverse('update_attendance'), {
+                'date': attendance.id, 'student_ids': json.dumps(statuses)})
+
+        self.assertEqual(update(statuses).json(), {'updated': 2})
+        self.assertEqual(set(AttendanceReport.objects.filter(status=False).values_list('student_id', flat=True)),
+                         {self.students[0].id, self.students[1].id})
+        self.assertEqual(update(statuses).json(), {'updated': 0})
+        response = update([{'id': 999999, 'status': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': [{'id': 999999, 'error': "Student has no record in this attendance"}]})
+
+    def test_resaving_a_register_upserts(self):
+        statuses = [(student.id, 1) for student in self.students]
+        self.save(statuses)
+        statuses[0] = (self.students[0].id, 0)
+        self.assertEqual(self.save(statuses).status_code, 200)
+        attendance = Attendance.objects.get()
+        self.assertEqual(attendance.attendancereport_set.count(), len(self.students))
+        self.assertEqual(attendance.attendancereport_set.get(student=self.students[0]).status, False)
+
+
+class DeduplicationMigrationTest(TransactionTestCase):
+    """Runs the deduplicating migrations over duplicated rows of the historical models"""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('main_app', target)])
+        return executor.loader.project_state([('main_app', target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('main_app'))
+
+    def seed(self, apps):
+        Course, Session = apps.get_model('main_app', 'Course'), apps.get_model('main_app', 'Session')
+        CustomUser, Staff = apps.get_model('main_app', 'CustomUser'), apps.get_model('main_app', 'Staff')
+        course = Course.objects.create(name="Computer Science")
+        session = Session.objects.create(start_year=datetime.date(2020, 1, 1), end_year=datetime.date(2021, 1, 1))
+        staff = Staff.objects.create(admin=CustomUser.objects.create(email="staff@college.test", user_type=2))
+        subject = apps.get_model('main_app', 'Subject').objects.create(name="Maths", staff=staff, course=course)
+        students = [
+            apps.get_model('main_app', 'Student').objects.create(
+                admin=CustomUser.objects.create(email="student%d@college.test" % i, user_type=3),
+                course=course, session=session)
+            for i in range(2)
+        ]
+        return session, subject, students
+
+    def test_attendance_duplicates_are_merged_before_the_constraints(self):
+        apps = self.migrate('0002_attendancesummary')
+        Attendance = apps.get_model('main_app', 'Attendance')
+        AttendanceReport = apps.get_model('main_app', 'AttendanceReport')
+        session, subject, (first, second) = self.seed(apps)
+        kept, repeated = [Attendance.objects.create(session=session, subject=subject, date='2020-03-02')
+                          for _ in range(2)]
+        AttendanceReport.objects.create(attendance=kept, student=first, status=True)
+        AttendanceReport.objects.create(attendance=kept, student=first, status=False)
+        AttendanceReport.objects.create(attendance=repeated, student=second, status=True)
+
+        apps = self.migrate('0004_attendance_unique_constraints')
+        Attendance = apps.get_model('main_app', 'Attendance')
+        AttendanceReport = apps.get_model('main_app', 'AttendanceReport')
+        self.assertEqual(list(Attendance.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(sorted(AttendanceReport.objects.values_list('attendance_id', 'student_id', 'status')),
+                         [(kept.id, first.id, False), (kept.id, second.id, True)])
+        self.assertEqual(sorted(apps.get_model('main_app', 'AttendanceSummary').objects.values_list(
+            'student_id', 'present', 'absent')), [(first.id, 0, 1), (second.id, 1, 0)])
+        with self.assertRaises(IntegrityError):
+            Attendance.objects.create(session_id=session.id, subject_id=subject.id, date='2020-03-02')
+
+    def test_result_duplicates_are_merged_before_the_constraint(self):
+        apps = self.migrate('0010_book_search_index')
+        StudentResult = apps.get_model('main_app', 'StudentResult')
+        session, subject, (first, second) = self.seed(apps)
+        StudentResult.objects.create(student=first, subject=subject, test=10, exam=10)
+        latest = StudentResult.objects.create(student=first, subject=subject, test=30, exam=40)
+        other = StudentResult.objects.create(student=second, subject=subject, test=20, exam=20)
+
+        apps = self.migrate('0012_studentresult_unique_constraint')
+        StudentResult = apps.get_model('main_app', 'StudentResult')
+        self.assertEqual(sorted(StudentResult.objects.values_list('id', flat=True)), [latest.id, other.id])
+        with self.assertRaises(IntegrityError):
+            StudentResult.objects.create(student_id=second.id, subject_id=subject.id)
+
+
+class ResultSheetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.session = seed_college(students=30, subjects=1, days=0)
+        cls.subject = Subject.objects.get()
+        cls.students = list(Student.objects.order_by('id'))
+
+    def setUp(self):
+        self.client.force_login(self.subject.staff.admin)
+
+    def save(self, results):
+        return self.client.post(reverse('save_results'), {
+            'subject': self.subject.id, 'session': self.session.id, 'results': json.dumps(results)})
+
+    def test_saves_whole_sheet_and_updates_in_place(self):
+        StudentResult.objects.create(student=self.students[0], subject=self.subject, test=1, exam=1)
+        response = self.save([{'id': student.id, 'test': 30, 'exam': 45} for student in self.students])
+        self.assertEqual(response.json(), {'created': 29, 'updated': 1})
+        response = self.save([{'id': self.students[0].id, 'test': 20, 'exam': 45}])
+        self.assertEqual(response.json(), {'created': 0, 'updated': 1})
+        self.assertEqual(StudentResult.objects.filter(subject=self.subject).count(), 30)
+        self.assertEqual(StudentResult.objects.get(student=self.students[0]).test, 20)
+
+    def test_invalid_rows_save_nothing(self):
+        response = self.save([
+            {'id': self.students[0].id, 'test': 30, 'exam': 45},
+            {'id': self.students[1].id, 'test': 41, 'exam': 45},
+            {'id': 0, 'test': 1, 'exam': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['id'] for error in response.json()['errors']], [self.students[1].id, 0])
+        self.assertFalse(StudentResult.objects.exists())
+
+    def upload(self, *lines):
+        sheet = io.BytesIO("".join(line + "\r\n" for line in lines).encode())
+        sheet.name = 'scores.csv'
+        return self.client.post(reverse('save_results'), {
+            'subject': self.subject.id, 'session': self.session.id, 'file': sheet})
+
+    def test_csv_upload_by_id_or_email(self):
+        first, second = self.students[:2]
+        response = self.upload("Student_ID,Email,Test,Exam", "%d,,30,45" % first.id,
+                               ",%s,25.5,40" % second.admin.email.upper())
+        self.assertEqual(response.json(), {'created': 2, 'updated': 0})
+        self.assertEqual(dict(StudentResult.objects.values_list('student_id', 'test')), {first.id: 30, second.id: 25.5})
+
+    def test_csv_upload_with_unknown_student_saves_nothing(self):
+        response = self.upload("student_id,test,exam", "%d,30,45" % self.students[0].id, "999999,30,45")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'],
+                         [{'id': 999999, 'error': "Student is not enrolled in this subject's course and session"}])
+        self.assertFalse(StudentResult.objects.exists())
+
+    def test_csv_upload_with_non_numeric_scores_saves_nothing(self):
+        response = self.upload("student_id,test,exam", "%d,30,45" % self.students[0].id,
+                               "%d,absent,45" % self.students[1].id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'],
+                         [{'id': str(self.students[1].id), 'error': "Test and exam scores must be numbers"}])
+        self.assertFalse(StudentResult.objects.exists())
+        response = self.upload("student_id,score", "%d,30" % self.students[0].id)
+        self.assertEqual(response.json()['errors'][0]['error'], "CSV needs student_id (or email), test and exam columns")
+
+    def test_overflowing_ids_are_rejected(self):
+        response = self.client.post(reverse('save_results'), {
+            'subject': self.subject.id, 'session': self.session.id, 'results': '[{"id": 1e400, "test": 1, "exam": 1}]'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'errors': [{'id': None, 'error': "Invalid student id"}]})
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_result_page_does_not_save_posted_scores(self):
+        response = self.client.post(reverse('staff_add_result'), {
+            'student_list': self.students[0].id, 'subject': self.subject.id, 'test': 400, 'exam': -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(StudentResult.objects.exists())
+
+
+class ResultAnalyticsTest(TestCase):
+    def test_distribution_pass_rate_and_ranks(self):
+        course, session = seed_college(students=4, subjects=2, days=0)
+        first, second = Subject.objects.order_by('id')
+        students = list(Student.objects.order_by('id'))
+        # Totals: 90/50, 70/70, 30/30, 10 (one subject only)
+        StudentResult.objects.bulk_create([
+            StudentResult(student=students[0], subject=first, test=40, exam=50),
+            StudentResult(student=students[0], subject=second, test=20, exam=30),
+            StudentResult(student=students[1], subject=first, test=30, exam=40),
+            StudentResult(student=students[1], subject=second, test=30, exam=40),
+            StudentResult(student=students[2], subject=first, test=10, exam=20),
+            StudentResult(student=students[2], subject=second, test=10, exam=20),
+            StudentResult(student=students[3], subject=first, test=5, exam=5),
+        ])
+        with self.assertNumQueries(3):
+            report = analyse(StudentResult.objects.filter(subject__course=course), pass_mark=40)
+        summary = report['summary']
+        self.assertEqual((summary['count'], summary['median'], summary['min'], summary['max']), (7, 50, 10, 90))
+        self.assertEqual(summary['pass_rate'], round(4 / 7, 4))
+        self.assertEqual([bucket['count'] for bucket in summary['histogram']], [0, 1, 0, 2, 0, 1, 0, 2, 0, 1])
+        self.assertEqual([(s['id'], s['count']) for s in report['subjects']], [(first.id, 4), (second.id, 3)])
+        self.assertEqual([(s['id'], s['score'], s['rank']) for s in report['students']], [
+            (students[0].id, 70, 1), (students[1].id, 70, 1), (students[2].id, 30, 3), (students[3].id, 10, 4)])
+        self.assertEqual(report['students'][0]['name'], "Last0 First0")
+
+        self.assertEqual(analyse(StudentResult.objects.none())['summary']['mean'], None)
+
+
+class ReportCardTest(TestCase):
+    def setUp(self):
+        self.private = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.private)
+
+    def test_batch_zips_one_card_per_student(self):
+        course, session = seed_college(students=3, subjects=2, days=2)
+        AttendanceSummary.objects.rebuild()
+        student = Student.objects.order_by('id').first()
+        StudentResult.objects.create(student=student, subject=Subject.objects.order_by('id').first(), test=30, exam=45)
+        batch = ReportCardBatch.objects.create(course=course, session=session)
+        progress = []
+        with override_settings(PRIVATE_ROOT=self.private):
+            build(batch, workers=1, progress=lambda rendered, total: progress.append((rendered, total)))
+            batch.refresh_from_db()
+            names = zipfile.ZipFile(batch.file.path).namelist()
+            card = zipfile.ZipFile(batch.file.path).read('last0-first0-%d.html' % student.id).decode()
+        self.assertEqual((batch.status, batch.total, batch.rendered), (ReportCardBatch.DONE, 3, 3))
+        self.assertEqual(progress[-1], (3, 3))
+        self.assertEqual(len(names), 4)
+        self.assertIn('index.html', names)
+        self.assertIn('<td class="number">75.0</td>', card)
+
+    def test_zip_is_private_and_downloaded_by_the_hod_only(self):
+        course, session = seed_college(students=2, subjects=1, days=1)
+        batch = ReportCardBatch.objects.create(course=course, session=session)
+        hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+        with override_settings(PRIVATE_ROOT=self.private, MEDIA_ROOT=self.private + '/media'):
+            build(batch, workers=1)
+            batch.refresh_from_db()
+            self.assertTrue(batch.file.path.startswith(self.private + '/report_cards/'))
+            self.client.force_login(Staff.objects.get().admin)
+            response = self.client.get(reverse('download_report_cards', args=[batch.id]))
+            self.assertRedirects(response, reverse('staff_home'), fetch_redirect_response=False)
+            self.client.force_login(hod)
+            url = self.client.get(reverse('report_card_batches')).json()['batches'][0]['url']
+            self.assertEqual(url, reverse('download_report_cards', args=[batch.id]))
+            response = self.client.get(url)
+            self.assertIn('attachment', response['Content-Disposition'])
+            self.assertEqual(len(zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))).namelist()), 3)
+
+    def test_batches_of_dead_workers_are_built_again(self):
+        course, session = seed_college(students=2, subjects=1, days=1)
+        stale, live = [ReportCardBatch.objects.create(course=course, session=session, status=ReportCardBatch.RUNNING)
+                       for _ in range(2)]
+        ReportCardBatch.objects.filter(id=stale.id).update(updated_at=timezone.now() - datetime.timedelta(minutes=11))
+        with override_settings(PRIVATE_ROOT=self.private):
+            out = io.StringIO()
+            call_command('generate_report_cards', '--once', '--workers=1', stdout=out)
+        self.assertIn("Re-queued 1 batches left running", out.getvalue())
+        self.assertEqual(dict(ReportCardBatch.objects.values_list('id', 'status')),
+                         {stale.id: ReportCardBatch.DONE, live.id: ReportCardBatch.RUNNING})
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AttendanceExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.course, cls.session = seed_college(students=30, subjects=3, days=5)
+        cls.hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+
+    def setUp(self):
+        self.client.force_login(self.hod)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_attendance'), dict(
+            params, course=self.course.id, session=self.session.id))
+        self.assertTrue(response.streaming)
+        return list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+    def test_long_layout_has_a_row_per_report_in_date_order(self):
+        rows = self.export()
+        self.assertEqual(rows[0], ['date', 'subject', 'student_id', 'student', 'email', 'status'])
+        self.assertEqual(len(rows) - 1, AttendanceReport.objects.count())
+        self.assertEqual([row[0] for row in rows[1:]], sorted(row[0] for row in rows[1:]))
+        rows = self.export(start='2020-02-02', end='2020-02-03')
+        self.assertEqual({row[0] for row in rows[1:]}, {'2020-02-02', '2020-02-03'})
+
+    def test_matrix_layout_has_a_column_per_date(self):
+        rows = self.export(layout='matrix')
+        self.assertEqual(rows[0][4:], ['2020-02-0%d' % day for day in range(1, 6)] + ['present', 'absent'])
+        report = AttendanceReport.objects.select_related('attendance__subject').first()
+        row = next(row for row in rows if row[0] == report.attendance.subject.name and row[1] == str(report.student_id))
+        self.assertEqual(row[4 + report.attendance.date.day - 1], 'P' if report.status else 'A')
+        self.assertEqual(sum(int(row[-2]) + int(row[-1]) for row in rows[1:]), AttendanceReport.objects.count())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StudentImportTest(TestCase):
+    HEADER = "email,first_name,last_name,gender,address,password,course,session\n"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name="Computer Science")
+        cls.session = Session.objects.create(start_year=datetime.date(2020, 1, 1), end_year=datetime.date(2021, 1, 1))
+        CustomUser.objects.create_user(email="taken@college.test", password="taken", user_type=3)
+        cls.hod = CustomUser.objects.create_user(email="hod@college.test", password="hod", user_type=1)
+
+    def sheet(self, *lines):
+        path = os.path.join(tempfile.mkdtemp(), 'students.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(self.HEADER + "".join(line + "\n" for line in lines))
+        return path
+
+    def test_validate_rows_reports_each_bad_row(self):
+        valid, errors = validate_rows([
+            {'email': 'a@college.test', 'first_name': 'A', 'last_name': 'One', 'gender': 'male',
+             'password': 'pw', 'course': 'computer science', 'session': '2020-2021'},
+            {'email': 'not-an-email', 'first_name': 'B', 'last_name': 'Two', 'gender': 'X',
+             'password': 'pw', 'course': 'Physics', 'session': '1999-2000'},
+            {'email': 'c@college.test', 'first_name': '', 'last_name': 'Three', 'gender': 'F',
+             'password': 'pw', 'course': str(self.course.id), 'session': str(self.session.id)},
+        ])
+        self.assertEqual(valid, [dict(valid[0], email='a@college.test', gender='M',
+                                      course_id=self.course.id, session_id=self.session.id)])
+        self.assertEqual([(error['row'], error['email']) for error in errors],
+                         [(3, 'not-an-email'), (4, 'c@college.test')])
+        for problem in ("invalid email", "gender must be M or F", "unknown course 'Physics'", "unknown session"):
+            self.assertIn(problem, errors[0]['error'])
+        self.assertEqual(errors[1]['error'], "first_name is required")
+
+    def test_duplicate_emails_are_rejected(self):
+        row = {'first_name': 'A', 'last_name': 'One', 'gender': 'M', 'password': 'pw',
+               'course': str(self.course.id), 'session': str(self.session.id)}
+        valid, errors = validate_rows([dict(row, email='taken@college.test'), dict(row, email='new@college.test'),
+                                       dict(row, email='NEW@college.test')])
+        self.assertEqual([row['email'] for row in valid], ['new@college.test'])
+        self.assertEqual([(error['row'], error['error']) for error in errors],
+                         [(2, "email already registered"), (4, "email repeated in this file")])
+
+    def test_command_dry_run_creates_nothing(self):
+        path = self.sheet("a@college.test,A,One,M,,pw,%d,2020-2021" % self.course.id,
+                          "b@college.test,B,Two,F,,pw,%d,2020-2021" % self.course.id)
+        call_command('import_students', path, '--dry-run', stdout=io.StringIO())
+        self.assertFalse(CustomUser.objects.filter(email__in=['a@college.test', 'b@college.test']).exists())
+        call_command('import_students', path, '--workers=1', stdout=io.StringIO())
+        self.assertEqual(Student.objects.filter(course=self.course, admin__email='b@college.test').count(), 1)
+
+    def test_command_imports_nothing_when_a_row_is_invalid(self):
+        path = self.sheet("a@college.test,A,One,M,,pw,%d,2020-2021" % self.course.id,
+                          "taken@college.test,B,Two,F,,pw,%d,2020-2021" % self.course.id)
+        with self.assertRaisesMessage(CommandError, "1 invalid rows"):
+            call_command('import_students', path, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertFalse(CustomUser.objects.filter(email='a@college.test').exists())
+
+    @override_settings(STUDENT_IMPORT_MAX_UPLOAD_ROWS=1)
+    def test_web_upload_is_capped(self):
+        self.client.force_login(self.hod)
+        with open(self.sheet("a@college.test,A,One,M,,pw,%d,2020-2021" % self.course.id,
+                             "b@college.test,B,Two,F,,pw,%d,2020-2021" % self.course.id), 'rb') as fp:
+            response = self.client.post(reverse('import_students'), {'file': fp})
+        self.assertContains(response, "Uploads are limited to 1 rows")
+        self.assertFalse(CustomUser.objects.filter(email='a@college.test').exists())
+
+    def test_web_upload_reads_xlsx(self):
+        workbook = Workbook()
+        workbook.active.append(self.HEADER.strip().split(','))
+        workbook.active.append(['x@college.test', 'X', 'Ray', 'F', None, 'pw', 'Computer Science', '2020-2021'])
+        workbook.active.append(['y@college.test', 'Y', 'Zed', 'M', 'Town', 'pw', self.course.id, self.session.id])
+        upload = io.BytesIO()
+        workbook.save(upload)
+        upload.seek(0)
+        upload.name = 'students.xlsx'
+        self.client.force_login(self.hod)
+        response = self.client.post(reverse('import_students'), {'file': upload}, follow=True)
+        self.assertContains(response, "Imported 2 students")
+        self.assertEqual(list(Student.objects.filter(session=self.session).order_by('admin__email').values_list(
+            'admin__email', 'admin__address', 'course_id')),
+            [('x@college.test', '', self.course.id), ('y@college.test', 'Town', self.course.id)])
+
+    def test_email_registered_during_upload_is_a_row_error(self):
+        def register_then_hash(passwords, workers=None):
+            # Another request signs the address up between validation and insertion
+            CustomUser.objects.create_user(email="b@college.test", password="x", user_type=3)
+            return [make_password(password) for password in passwords]
+
+        self.client.force_login(self.hod)
+        with open(self.sheet("a@college.test,A,One,M,,pw,%d,2020-2021" % self.course.id,
+                             "b@college.test,B,Two,F,,pw,%d,2020-2021" % self.course.id), 'rb') as fp, \
+                mock.patch('main_app.student_import.hash_passwords', register_then_hash):
+            response = self.client.post(reverse('import_students'), {'file': fp})
+        self.assertContains(response, "Nothing was imported: 1 of 2 rows have errors")
+        self.assertEqual(response.context['errors'],
+                         [{'row': 3, 'email': 'b@college.test', 'error': "email already registered"}])
+        self.assertFalse(CustomUser.objects.filter(email='a@college.test').exists())
+
+    # A cheap hasher keeps the test quick; the forked workers inherit the override
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_passwords_hashed_by_the_process_pool_verify(self):
+        rows = [{'email': 'pool%d@college.test' % i, 'first_name': 'P', 'last_name': str(i), 'gender': 'M',
+                 'password': 'secret-%d' % i, 'course_id': self.course.id, 'session_id': self.session.id}
+                for i in range(60)]
+        with mock.patch('main_app.student_import.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool:
+            self.assertEqual(create_students(rows, workers=2), 60)
+        pool.assert_called_once()
+        users = CustomUser.objects.filter(email__startswith='pool').order_by('id')
+        self.assertEqual(len(users), 60)
+        for i, user in enumerate(users):
+            self.assertTrue(user.check_password('secret-%d' % i), user.email)
+
+
+@override_settings(CAPTCHA_SECRET_KEY='secret')
+class RecaptchaVerifierTest(TestCase):
+    def test_every_token_is_checked_with_google(self):
+        verifier = RecaptchaVerifier()
+        answers = [{'success': True}, {'success': False, 'error-codes': ['timeout-or-duplicate']}]
+        with mock.patch.object(verifier.session, 'post') as post:
+            post.return_value.json.side_effect = answers
+            self.assertTrue(verifier.verify('token', '10.0.0.1'))
+            self.assertFalse(verifier.verify('token', '10.0.0.2'))
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args[1]['data']['remoteip'], '10.0.0.2')
+
+    @override_settings(CAPTCHA_SECRET_KEY='')
+    def test_refuses_to_run_without_a_secret(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "CAPTCHA_SECRET_KEY"):
+            RecaptchaVerifier()
+
+
+class StubFCMClient:
+    """Answers each token with the error in errors (None when sent), or fails the whole request"""
+
+    def __init__(self, errors=None, unavailable=False):
+        self.errors = errors or {}
+        self.unavailable = unavailable
+        self.sent = []
+
+    def send(self, tokens, title, body, click_action):
+        if self.unavailable:
+            raise PushUnavailable("down")
+        self.sent.extend(tokens)
+        return [self.errors.get(token) for token in tokens]
+
+
+@override_settings(PUSH_RETRY_DELAY=30, PUSH_MAX_ATTEMPTS=5)
+class PushOutboxTest(TestCase):
+    def push(self, token):
+        user = CustomUser.objects.create_user(email="%s@college.test" % (token or 'none'), password="x",
+                                              user_type=3, fcm_token=token)
+        PushNotification.objects.enqueue([user.id], "Hello", "/notifications/")
+        return PushNotification.objects.get(user=user)
+
+    def test_delivered_message_is_sent(self):
+        message = self.push('good')
+        self.assertEqual(dispatch(StubFCMClient()), (1, 1))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts, message.last_error), (PushNotification.SENT, 1, ''))
+        self.assertIsNotNone(message.sent_at)
+        self.assertEqual(dispatch(StubFCMClient()), (0, 0))
+
+    def test_invalid_token_fails(self):
+        message = self.push('stale')
+        dispatch(StubFCMClient({'stale': 'InvalidRegistration'}))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.last_error), (PushNotification.FAILED, 'InvalidRegistration'))
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        message = self.push('busy')
+        before = timezone.now()
+        dispatch(StubFCMClient({'busy': 'Unavailable'}))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (PushNotification.PENDING, 1))
+        self.assertGreaterEqual(message.next_attempt_at, before + datetime.timedelta(seconds=30))
+        self.assertEqual(dispatch(StubFCMClient()), (0, 0))
+        PushNotification.objects.update(next_attempt_at=before)
+        dispatch(StubFCMClient(unavailable=True))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (PushNotification.PENDING, 2))
+        self.assertGreaterEqual(message.next_attempt_at, before + datetime.timedelta(seconds=60))
+        PushNotification.objects.update(next_attempt_at=before, attempts=4)
+        dispatch(StubFCMClient({'busy': 'Unavailable'}))
+        message.refresh_from_db()
+        self.assertEqual(message.status, PushNotification.FAILED)
+
+    def test_users_without_a_token_are_not_queued(self):
+        message = self.push('good')
+        tokenless = CustomUser.objects.create_user(email="none@college.test", password="x", user_type=3)
+        PushNotification.objects.enqueue([tokenless.id, message.user_id], "Hi", "/notifications/")
+        self.assertEqual(list(PushNotification.objects.values_list('user_id', flat=True).order_by('id')),
+                         [message.user_id, message.user_id])
+
+    def test_token_cleared_after_queueing_fails_without_a_request(self):
+        message = self.push('gone')
+        CustomUser.objects.filter(id=message.user_id).update(fcm_token='')
+        client = StubFCMClient()
+        dispatch(client)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.last_error), (PushNotification.FAILED, "No FCM token"))
+        self.assertEqual(client.sent, [])
+
+    @override_settings(FCM_SERVER_KEY='')
+    def test_worker_refuses_to_start_without_a_key(self):
+        message = self.push('good')
+        with self.assertRaisesMessage(CommandError, "FCM_SERVER_KEY"):
+            call_command('send_push_notifications', '--once', stdout=io.StringIO())
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (PushNotification.PENDING, 0))
+
+    def test_stale_claims_are_released(self):
+        stale, recent = self.push('a'), self.push('b')
+        PushNotification.objects.update(status=PushNotification.SENDING)
+        PushNotification.objects.filter(id=stale.id).update(updated_at=timezone.now() - datetime.timedelta(minutes=11))
+        self.assertEqual(release_stale(), 1)
+        self.assertEqual(dict(PushNotification.objects.values_list('id', 'status')),
+                         {stale.id: PushNotification.PENDING, recent.id: PushNotification.SENDING})
+
+    def test_worker_releases_stale_claims_on_every_poll(self):
+        message = self.push('good')
+
+        class Stop(Exception):
+            pass
+
+        polls = []
+
+        def sleep(seconds):
+            polls.append(seconds)
+            if len(polls) > 1:
+                raise Stop
+            # Left in flight by another worker after this one started
+            PushNotification.objects.update(status=PushNotification.SENDING, next_attempt_at=timezone.now(),
+                                             updated_at=timezone.now() - datetime.timedelta(minutes=11))
+
+        with mock.patch('main_app.management.commands.send_push_notifications.FCMClient', StubFCMClient), \
+                mock.patch('main_app.management.commands.send_push_notifications.time.sleep', sleep):
+            PushNotification.objects.update(next_attempt_at=timezone.now() + datetime.timedelta(hours=1))
+            with self.assertRaises(Stop):
+                call_command('send_push_notifications', stdout=io.StringIO())
+        message.refresh_from_db()
+        self.assertEqual(message.status, PushNotification.SENT)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class NotificationInboxTest(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(email="student@college.test", password="student", user_type=3)
+        self.user = CustomUser.objects.get(email="student@college.test")
+        self.student = self.user.student
+        # One timestamp for all, so the pages are ordered by id alone
+        NotificationStudent.objects.bulk_create([
+            NotificationStudent(student=self.student, message="Notice %d" % i) for i in range(25)
+        ])
+        NotificationStudent.objects.update(created_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        # bulk_create sends no post_save, so drop any counter cached before it
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_pages_newest_first_and_marks_shown_rows_read(self):
+        self.assertEqual(unread_notification_count(self.user), 25)
+        response = self.client.get(reverse('student_view_notification'))
+        first = [n.message for n in response.context['notifications']]
+        self.assertEqual(first, ["Notice %d" % i for i in range(24, 4, -1)])
+        self.assertEqual(unread_notification_count(self.user), 5)
+        response = self.client.get(reverse('student_view_notification'), {'after': response.context['next_cursor']})
+        self.assertEqual([n.message for n in response.context['notifications']], ["Notice %d" % i for i in range(4, -1, -1)])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertEqual(unread_notification_count(self.user), 0)
+        self.assertFalse(NotificationStudent.objects.filter(is_read=False).exists())
+
+    def test_bad_cursor_shows_first_page(self):
+        response = self.client.get(reverse('student_view_notification'), {'after': '1700000000000000_5'})
+        self.assertEqual(len(response.context['notifications']), 20)
+
+    def test_mark_read_is_one_update(self):
+        notifications, cursor = NotificationStudent.objects.page(self.student)
+        with self.assertNumQueries(1):
+            self.assertEqual(NotificationStudent.objects.mark_read(self.student, notifications), 20)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage', LIBRARY_FINE_PER_DAY=5)
+class IssuedBookDetailsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = CustomUser.objects.create_user(email="reader@college.test", password="x", user_type=3,
+                                                     first_name="Ada", last_name="Reader").student
+        Book.objects.create(name="Optics", author="Newton", isbn=9780000000001, category="Physics")
+        cls.today = timezone.localdate()
+        loans = [
+            (str(cls.student.id), '9780000000001', -3),  # Three days overdue
+            (str(cls.student.id), '9780000000001', 4),  # Due in four days
+            ('', '9780000000001', -1),  # No borrower recorded
+            ('Ada', 'ISBN 978-0', -2),  # Free text in both columns
+            ('99999999999999999999', '12345678901234567890', 1),  # Too long to cast
+        ]
+        IssuedBook.objects.bulk_create([
+            IssuedBook(student_id=student_id, isbn=isbn, expiry_date=cls.today + datetime.timedelta(days=days))
+            for student_id, isbn, days in loans
+        ])
+        cls.staff = CustomUser.objects.create_user(email="librarian@college.test", password="x", user_type=2)
+
+    def test_details_of_every_loan(self):
+        loans = IssuedBook.objects.with_details(self.today).order_by('id')
+        self.assertEqual([(loan.book_name, loan.student_name, loan.days_overdue, loan.fine) for loan in loans], [
+            ("Optics", "Reader, Ada", 3, 15),
+            ("Optics", "Reader, Ada", 0, 0),
+            ("Optics", None, 1, 5),
+            (None, None, 2, 10),
+            (None, None, 0, 0),
+        ])
+
+    def test_overdue_filter(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('view_issued_book'))
+        self.assertEqual(len(response.context['issuedBooks']), 5)
+        response = self.client.get(reverse('view_issued_book'), {'overdue': '1'})
+        self.assertEqual([loan.days_overdue for loan in response.context['issuedBooks']], [3, 2, 1])
+        self.assertContains(response, "Reader, Ada")
+
+
+@skipUnless(connection.vendor == 'sqlite', "Checks the SQLite FTS5 triggers")
+class BookSearchTest(TestCase):
+    def test_index_follows_inserts_updates_and_deletes(self):
+        book = Book.objects.create(name="Concrete Mathematics", author="Knuth", isbn=9780201558029,
+                                   category="Mathematics")
+        Book.objects.bulk_create([
+            Book(name="Mathematics Book %d" % i, author="Author", isbn=9780000000000 + i, category="General")
+            for i in range(30)
+        ])
+        self.assertEqual(search_books("knu")[0], [book])
+        self.assertEqual(search_books("9780201")[0], [book])
+        results, has_next = search_books("mathematics")
+        self.assertEqual((results[0], len(results), has_next), (book, 20, True))
+
+        Book.objects.filter(id=book.id).update(author="Graham")
+        self.assertEqual(search_books("knuth")[0], [])
+        self.assertEqual(search_books("graham concrete")[0], [book])
+        book.delete()
+        self.assertEqual(search_books("concrete")[0], [])
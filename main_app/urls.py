@@ -32,6 +32,8 @@ urlpatterns = [
          name='send_student_notification'),
     path("send_staff_notification/", hod_views.send_staff_notification,
          name='send_staff_notification'),
+    path("notification/broadcast/", hod_views.broadcast_notification,
+         name='broadcast_notification'),
     path("add_session/", hod_views.add_session, name='add_session'),
     path("admin_notify_student", hod_views.admin_notify_student,
          name='admin_notify_student'),
@@ -55,10 +57,25 @@ urlpatterns = [
          name="admin_view_attendance",),
     path("attendance/fetch/", hod_views.get_admin_attendance,
          name='get_admin_attendance'),
+    path("attendance/export/", hod_views.export_attendance,
+         name='export_attendance'),
+    path("results/analytics/", hod_views.result_analytics,
+         name='result_analytics'),
+    path("results/analytics/data/", hod_views.result_analytics_data,
+         name='result_analytics_data'),
+    path("results/report_cards/", hod_views.report_cards,
+         name='report_cards'),
+    path("results/report_cards/batches/", hod_views.report_card_batches,
+         name='report_card_batches'),
+    path("results/report_cards/<int:batch_id>/download/", hod_views.download_report_cards,
+         name='download_report_cards'),
     path("student/add/", hod_views.add_student, name='add_student'),
     path("subject/add/", hod_views.add_subject, name='add_subject'),
     path("staff/manage/", hod_views.manage_staff, name='manage_staff'),
     path("student/manage/", hod_views.manage_student, name='manage_student'),
+    path("student/import/", hod_views.import_students, name='import_students'),
+    path("staff/manage/data/", hod_views.staff_table, name='staff_table'),
+    path("student/manage/data/", hod_views.student_table, name='student_table'),
     path("course/manage/", hod_views.manage_course, name='manage_course'),
     path("subject/manage/", hod_views.manage_subject, name='manage_subject'),
     path("staff/edit/<int:staff_id>", hod_views.edit_staff, name='edit_staff'),
@@ -116,6 +133,10 @@ urlpatterns = [
          name='edit_student_result'),
     path('staff/result/fetch/', staff_views.fetch_student_result,
          name='fetch_student_result'),
+    path('staff/result/sheet/', staff_views.get_result_sheet,
+         name='get_result_sheet'),
+    path('staff/result/save/', staff_views.save_results,
+         name='save_results'),
 
 
 
@@ -135,6 +156,7 @@ urlpatterns = [
 
      
      path("student/viewbooks/", student_views.view_books, name="view_books"),
+    path("student/books/search/", student_views.search_books, name="search_books"),
 
     path("student/view/notification/", student_views.student_view_notification,
          name="student_view_notification"),
@@ -1,11 +1,11 @@
 import json
-import requests
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from django.views.decorators.csrf import csrf_exempt
 
+from .captcha import CaptchaUnavailable, get_captcha_verifier
 from .EmailBackend import EmailBackend
 from .models import Attendance, Session, Subject 
 
@@ -29,21 +29,11 @@ def doLogin(request, **kwargs):
     else:
         #Google recaptcha
         captcha_token = request.POST.get('g-recaptcha-response')
-        captcha_url = "https://www.google.com/recaptcha/api/siteverify"
-        captcha_key = "6LfTGD4qAAAAALtlli02bIM2MGi_V0cUYrmzGEGd"
-        # captcha_key = "6LfHPwojAAAAAAtIjbi-7_N4fNf7Wp0LUiYlCDw_"  #server
-        data = {
-            'secret': captcha_key,
-            'response': captcha_token
-        }
-        # Make request
         try:
-            captcha_server = requests.post(url=captcha_url, data=data)
-            response = json.loads(captcha_server.text)
-            if response['success'] == False:
+            if not get_captcha_verifier().verify(captcha_token, request.META.get('REMOTE_ADDR')):
                 messages.error(request, 'Invalid Captcha. Try Again')
                 return redirect('/')
-        except:
+        except CaptchaUnavailable:
             messages.error(request, 'Captcha could not be verified. Try Again')
             return redirect('/')
         